@@ -4,7 +4,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
 import shutil
-from datetime import datetime
+import hashlib
 from ...database import get_db
 from ...models.person import Person, PersonImage, BatchUpload
 from ...schemas.person import (
@@ -16,10 +16,24 @@ from ...schemas.person import (
     BatchUploadComplete
 )
 from ...core.file_processor import FileProcessor
+from ...core.thumbnails import configured_sizes, get_thumbnail
+from ...services.ingest_service import save_processed_image, remove_ingested_sources
+from ...services.batch_service import (
+    get_directory_batch,
+    enqueue_batch,
+    get_batch_progress,
+    register_batch_files,
+    register_uploaded_file,
+    has_batch_files
+)
+from ...tasks.batch_jobs import notify_job_runner
 from ...config import settings
 
 router = APIRouter()
 
+# Tamanho dos blocos lidos do upload (cópia e cálculo do hash)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 @router.get("/", response_model=List[PersonSchema])
 def get_persons(
     skip: int = 0,
@@ -111,55 +125,50 @@ async def upload_file(
                 }
             }
     
-    # Salvar o arquivo no diretório de uploads
+    # Salvar o arquivo no diretório de uploads, calculando o hash do conteúdo durante a cópia
     file_path = os.path.join(settings.UPLOAD_DIR, file.filename)
     os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    digest = hashlib.sha256()
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            buffer.write(chunk)
+    content_hash = digest.hexdigest()
+    
+    # O mesmo conteúdo enviado com outro nome também é duplicata
+    if not allow_duplicates:
+        existing_file = db.query(PersonImage).filter(
+            PersonImage.content_hash == content_hash
+        ).first()
+        
+        if existing_file:
+            os.remove(file_path)
+            return {
+                "success": False,
+                "message": f"O conteúdo do arquivo {file.filename} já foi processado anteriormente "
+                           f"(arquivo {existing_file.original_filename}).",
+                "details": {
+                    "filename": file.filename,
+                    "original_filename": existing_file.original_filename,
+                    "processed_date": existing_file.processed_date,
+                    "duplicate": True
+                }
+            }
     
-    # Processar o arquivo
+    # Processar o arquivo (conteúdo já processado reaproveita a detecção em cache)
     from ...core.dependencies import get_file_processor
     file_processor = get_file_processor()
-    result = file_processor.process_image(file_path)
+    result = file_processor.process_image(file_path, digest=content_hash)
     if not result["success"]:
         return result
     
-    # Verificar se a pessoa já existe no banco de dados
-    db_person = db.query(Person).filter(
-        Person.name == result["person_name"],
-        Person.cpf == result["cpf"],
-        Person.person_id == result["person_id"]
-    ).first()
-    
-    if not db_person:
-        # Criar nova pessoa
-        person_data = {
-            "person_id": result["person_id"],
-            "cpf": result["cpf"],
-            "name": result["person_name"],
-            "origin_code": result["origin"][:3],
-            "origin": result["origin"],
-        }
-        db_person = Person(**person_data)
-        db.add(db_person)
-        db.commit()
-        db.refresh(db_person) # Isso carregará o registro_unico gerado
-    
-    # Criar nova entrada de imagem
-    image_data = {
-        "person_id": db_person.person_id, # Mantido para compatibilidade
-        "registro_unico": db_person.registro_unico, # Nova chave estrangeira
-        "filename": result["filename"],
-        "original_filename": result["original_filename"],
-        "file_path": os.path.join(settings.PROCESSED_DIR, result["filename"]),
-        "processed": True,
-        "processed_date": datetime.now(),
-        "face_detected": True,
-        "faiss_id": result.get("faiss_id")
-    }
-    db_image = PersonImage(**image_data)
-    db.add(db_image)
+    # Registrar pessoa e imagem no banco de dados
+    db_image = save_processed_image(db, result)
     db.commit()
+    db_person = db_image.person
+    
+    # O conteúdo já está no diretório de processados
+    remove_ingested_sources([result], remove_all=settings.REMOVE_INGESTED_UPLOADS)
     
     return {
         "success": True,
@@ -173,64 +182,34 @@ async def upload_file(
         }
     }
 
-@router.post("/batch-process/")
+@router.post("/batch-process/", status_code=202)
 def batch_process(db: Session = Depends(get_db)):
-    """Processa todas as imagens no diretório de uploads."""
-    from ...core.dependencies import get_file_processor
-    file_processor = get_file_processor()
-    result = file_processor.process_batch(max_workers=settings.BATCH_WORKERS)
+    """Enfileira o processamento das imagens do diretório de uploads (apenas os arquivos ainda
+    não processados). O progresso é consultado em /persons/batches/{batch_id}."""
+    batch = get_directory_batch(db)
+    if batch.status not in ('queued', 'processing'):
+        register_batch_files(db, batch, settings.UPLOAD_DIR)
+        enqueue_batch(db, batch)
+        notify_job_runner()
+    return get_batch_progress(batch)
 
-    # Atualizar banco de dados com os resultados
-    if result["success"]:
-        for detail in result["details"]:
-            if detail["success"]:
-                # Verificar se a pessoa já existe no banco de dados
-                db_person = db.query(Person).filter(
-                    Person.name == result["person_name"],
-                    Person.cpf == result["cpf"],
-                    Person.person_id == result["person_id"]
-                ).first()
-                
-                if not db_person:
-                    # Criar nova pessoa
-                    person_data = {
-                        "person_id": detail["person_id"],
-                        "cpf": detail["cpf"],
-                        "name": detail["person_name"],
-                        "origin_code": detail["origin"][:3],
-                        "origin": detail["origin"],
-                    }
-                    db_person = Person(**person_data)
-                    db.add(db_person)
-                    db.commit()
-                    db.refresh(db_person) # Carrega o registro_unico gerado
-                
-                # Criar nova entrada de imagem
-                image_data = {
-                    "person_id": db_person.person_id, # Mantido para compatibilidade
-                    "registro_unico": db_person.registro_unico, # Nova chave estrangeira
-                    "filename": detail["filename"],
-                    "original_filename": detail["original_filename"],
-                    "file_path": os.path.join(settings.PROCESSED_DIR, detail["filename"]),
-                    "processed": True,
-                    "processed_date": datetime.now(),
-                    "face_detected": True,
-                    "faiss_id": detail.get("faiss_id")
-                }
-                db_image = PersonImage(**image_data)
-                db.add(db_image)
-                db.commit()
-    
-    return result
+@router.get("/batches/{batch_id}")
+def get_batch_status(batch_id: str, db: Session = Depends(get_db)):
+    """Retorna o progresso de um lote: contadores, vazão (imagens/s) e estimativa de término."""
+    batch = db.query(BatchUpload).filter(BatchUpload.batch_id == batch_id).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return get_batch_progress(batch)
 
 @router.get("/{person_id}/image")
 def get_person_image(
     person_id: str,
     image_id: Optional[int] = None,
+    size: Optional[int] = Query(None, description="Tamanho da miniatura (maior lado), um de THUMBNAIL_SIZES"),
     db: Session = Depends(get_db)
 ):
     """Retorna a imagem de uma pessoa. Se image_id for fornecido, retorna essa imagem específica.
-    Caso contrário, retorna a imagem mais recente."""
+    Caso contrário, retorna a imagem mais recente. Com size, retorna a miniatura."""
     person = db.query(Person).filter(Person.person_id == person_id).first()
     if person is None:
         raise HTTPException(status_code=404, detail="Person not found")
@@ -250,6 +229,13 @@ def get_person_image(
     if not image or not image.file_path or not os.path.exists(image.file_path):
         raise HTTPException(status_code=404, detail="Image not found")
     
+    if size is not None:
+        if size not in configured_sizes():
+            raise HTTPException(status_code=400, detail=f"Invalid size. Allowed sizes: {list(configured_sizes())}")
+        thumbnail = get_thumbnail(image.file_path, settings.PROCESSED_DIR, image.filename, size)
+        if thumbnail:
+            return FileResponse(thumbnail)
+    
     return FileResponse(image.file_path)
 
 @router.get("/{person_id}/images", response_model=List[PersonImageSchema])
@@ -298,50 +284,42 @@ async def upload_file(
         raise HTTPException(status_code=400, detail="Invalid or completed batch")
     
     # Salvar arquivo
-    file_path = os.path.join(settings.UPLOAD_DIR, f"{batch_id}_{file.filename}")
+    filename = f"{batch_id}_{file.filename}"
+    file_path = os.path.join(settings.UPLOAD_DIR, filename)
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     
+    # Registrar o arquivo no lote (evita varrer o diretório ao concluir o upload)
+    register_uploaded_file(db, batch, filename, os.stat(file_path).st_ctime_ns)
+    
     return {"message": "File uploaded successfully"}
 
-@router.post("/batch-upload-complete/")
+@router.post("/batch-upload-complete/", status_code=202)
 def complete_batch_upload(
     batch_info: BatchUploadComplete,
     db: Session = Depends(get_db)
 ):
-    """Processar todos os arquivos de um lote"""
+    """Enfileira o processamento dos arquivos de um lote e retorna imediatamente.
+    Lotes interrompidos ou com falha podem ser enfileirados novamente: apenas os arquivos
+    ainda pendentes são processados. O progresso é consultado em /persons/batches/{batch_id}."""
     batch = db.query(BatchUpload).filter(
         BatchUpload.batch_id == batch_info.batch_id,
-        BatchUpload.status == 'pending'
+        BatchUpload.status.in_(['pending', 'failed'])
     ).first()
     
     if not batch:
         raise HTTPException(status_code=400, detail="Invalid batch")
     
-    try:
-        # Processar todos os arquivos do lote
-        batch_files = [f for f in os.listdir(settings.UPLOAD_DIR) 
-                      if f.startswith(f"{batch_info.batch_id}_")]
-        
-        from ...core.dependencies import get_file_processor
-        file_processor = get_file_processor()
-        
-        for filename in batch_files:
-            full_path = os.path.join(settings.UPLOAD_DIR, filename)
-            file_processor.process_image(full_path)
-            # Marcar progresso
-            batch.processed_files += 1
-        
-        # Marcar lote como concluído
-        batch.status = 'completed'
-        db.commit()
-        
-        return {
-            "message": "Batch upload processed successfully",
-            "total_files": batch.total_files,
-            "processed_files": batch.processed_files
-        }
-    except Exception as e:
-        batch.status = 'failed'
-        db.commit()
-        raise HTTPException(status_code=500, detail=str(e))
+    # Lotes enviados antes do registro por arquivo: registrar a partir do diretório
+    if not has_batch_files(db, batch):
+        register_batch_files(db, batch, settings.UPLOAD_DIR)
+    
+    enqueue_batch(db, batch)
+    notify_job_runner()
+    
+    return {
+        "message": "Batch upload queued for processing",
+        "batch_id": batch.batch_id,
+        "status": batch.status,
+        "total_files": batch.total_files
+    }
@@ -1,36 +1,67 @@
-from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query, Body
+from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Query, Body, Form
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
-import shutil
 import uuid
+import hashlib
 from ...database import get_db
-from ...schemas.person import SearchResponse
+from ...schemas.person import SearchResponse, MultiFaceSearchResponse, VerifyResponse
 from ...config import settings
 from ...models.person import Person, PersonImage
+from ...core.image_store import resolve_filename, is_content_addressed
+from ...core.thumbnails import configured_sizes, get_thumbnail
 
 router = APIRouter()
 
+# Tamanho dos blocos lidos do upload (cópia e cálculo do hash)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 @router.get("/image-by-filename/{filename}")
-def get_image_by_filename(filename: str):
-    """Retorna uma imagem pelo seu nome de arquivo."""
-    # Construir o caminho completo para o arquivo
-    file_path = os.path.join(settings.PROCESSED_DIR, filename)
+def get_image_by_filename(
+    filename: str,
+    size: Optional[int] = Query(None, description="Tamanho da miniatura (maior lado), um de THUMBNAIL_SIZES"),
+    db: Session = Depends(get_db)
+):
+    """Retorna uma imagem pelo seu nome de arquivo, ou a sua miniatura se size for informado."""
+    # Construir o caminho completo para o arquivo (subdiretórios do hash ou raiz, para nomes antigos)
+    file_path = resolve_filename(settings.PROCESSED_DIR, filename)
+    
+    # Imagens antigas migradas para o layout por conteúdo: caminho gravado no banco
+    if not os.path.exists(file_path) and not is_content_addressed(filename):
+        image = db.query(PersonImage.file_path).filter(PersonImage.filename == filename).first()
+        if image and image.file_path:
+            file_path = image.file_path
     
     # Verificar se o arquivo existe
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="Image not found")
     
+    if size is not None:
+        if size not in configured_sizes():
+            raise HTTPException(status_code=400, detail=f"Invalid size. Allowed sizes: {list(configured_sizes())}")
+        file_path = get_thumbnail(file_path, settings.PROCESSED_DIR, filename, size) or file_path
+    
     return FileResponse(file_path)
 
-@router.post("/search/", response_model=SearchResponse)
-async def search_faces(
-    file: UploadFile = File(...),
-    k: int = Query(5, description="Número de resultados a retornar"),
-    db: Session = Depends(get_db)
-):
-    """Busca faces similares a partir de uma imagem de consulta."""
+def _search_filters(origin: Optional[str]) -> dict:
+    """Filtros de metadados de uma busca (apenas os informados)."""
+    return {"origin": origin} if origin else {}
+
+def _add_image_urls(result: dict) -> dict:
+    """Adiciona URLs diretas para cada resultado."""
+    if result.get("success", False) and "results" in result:
+        base_url = f"{settings.API_PREFIX}/recognition/image-by-filename"
+        sizes = configured_sizes()
+        for item in result["results"]:
+            item["direct_image_url"] = f"{base_url}/{item['filename']}"
+            if sizes:
+                item["thumbnail_url"] = f"{base_url}/{item['filename']}?size={sizes[0]}"
+    return result
+
+def _save_query_image(file: UploadFile):
+    """Salva a imagem de consulta em um arquivo temporário, calculando o hash do conteúdo
+    (chave do cache de consultas). Retorna o caminho e o hash."""
     # Verificar se é uma imagem
     valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp']
     file_ext = os.path.splitext(file.filename)[1].lower()
@@ -46,31 +77,190 @@ async def search_faces(
     file_path = os.path.join(temp_dir, unique_filename)
 
     # Salvar o arquivo
+    digest = hashlib.sha256()
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return file_path, digest.hexdigest()
 
+@router.post("/search/", response_model=SearchResponse)
+async def search_faces(
+    file: UploadFile = File(...),
+    files: Optional[List[UploadFile]] = File(None, description="Outras imagens da mesma pessoa (busca combinada)"),
+    k: int = Query(5, ge=1, le=settings.SEARCH_MAX_K, description="Número de resultados a retornar"),
+    origin: Optional[str] = Query(None, description="Considerar apenas imagens desta origem"),
+    fusion: str = Query("mean", description="Combinação de várias imagens: mean (média dos embeddings) ou max (menor distância)"),
+    db: Session = Depends(get_db)
+):
+    """Busca faces similares a partir de uma imagem de consulta. A resposta inclui um
+    query_handle para buscar outras páginas ou aplicar filtros em /search/{query_handle}.
+
+    Com várias imagens da mesma pessoa (file e files), as imagens são processadas em um
+    único lote e a busca é feita com a consulta combinada."""
+    if fusion not in ("mean", "max"):
+        raise HTTPException(status_code=400, detail="Invalid fusion. Use 'mean' or 'max'.")
+    
+    saved = []
     try:
-        # Buscar faces similares
+        for upload in [file] + (files or []):
+            saved.append(_save_query_image(upload))
+        
+        # Buscar faces similares (consultas repetidas usam os caches de embedding e resultados)
         from ...core.dependencies import get_file_processor
         file_processor = get_file_processor()
-        result = file_processor.search_similar_faces(file_path, k)
-        
-        # Adicionar URLs diretas para cada resultado
-        if result.get("success", False) and "results" in result:
-            base_url = f"{settings.API_PREFIX}/recognition/image-by-filename"
-            for item in result["results"]:
-                item["direct_image_url"] = f"{base_url}/{item['filename']}"
-        
+        if len(saved) > 1:
+            result = file_processor.search_fused(
+                [path for path, _ in saved], [digest for _, digest in saved],
+                k, filters=_search_filters(origin), fusion=fusion
+            )
+        else:
+            file_path, digest = saved[0]
+            result = file_processor.search_similar_faces(
+                file_path, k, digest=digest, filters=_search_filters(origin)
+            )
+        return _add_image_urls(result)
+    finally:
+        # Remover os arquivos temporários
+        for file_path, _ in saved:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+@router.post("/search-faces/", response_model=MultiFaceSearchResponse)
+async def search_all_faces(
+    file: UploadFile = File(...),
+    k: int = Query(5, ge=1, le=settings.SEARCH_MAX_K, description="Número de resultados por face"),
+    origin: Optional[str] = Query(None, description="Considerar apenas imagens desta origem"),
+    min_face_size: int = Query(40, ge=0, description="Menor lado mínimo (em pixels) de uma face pesquisada"),
+    min_score: float = Query(0.5, ge=0.0, le=1.0, description="Score mínimo de detecção de uma face pesquisada")
+):
+    """Busca cada face detectada na imagem de consulta (ex.: fotos de grupo) em uma única
+    busca em lote, com os resultados agrupados por face. Cada face tem seu query_handle."""
+    file_path, digest = _save_query_image(file)
+    try:
+        from ...core.dependencies import get_file_processor
+        file_processor = get_file_processor()
+        result = file_processor.search_all_faces(
+            file_path, k, digest=digest, filters=_search_filters(origin),
+            min_face_size=min_face_size, min_score=min_score
+        )
+        for face in result.get("faces", []):
+            _add_image_urls({"success": True, "results": face["results"]})
         return result
     finally:
         # Remover o arquivo temporário
         if os.path.exists(file_path):
             os.remove(file_path)
 
+@router.post("/verify/", response_model=VerifyResponse)
+async def verify_faces(
+    file: UploadFile = File(...),
+    file2: Optional[UploadFile] = File(None, description="Segunda imagem (comparação entre duas fotos)"),
+    registro_unico: Optional[str] = Form(None, description="Pessoa cadastrada a comparar com a imagem"),
+    threshold: Optional[float] = Query(None, description="Limiar de decisão (padrão: SIMILARITY_THRESHOLD)"),
+    db: Session = Depends(get_db)
+):
+    """Verificação 1:1: a imagem corresponde à segunda imagem, ou à pessoa informada?
+
+    A imagem de consulta é processada uma vez (as duas imagens em um único lote) e comparada
+    por similaridade de cosseno com a segunda imagem ou com os embeddings já armazenados das
+    imagens da pessoa, sem busca no índice."""
+    if (file2 is None) == (registro_unico is None):
+        raise HTTPException(status_code=400, detail="Provide either file2 or registro_unico.")
+    if threshold is None:
+        threshold = settings.SIMILARITY_THRESHOLD
+    
+    person = None
+    images = []
+    if registro_unico is not None:
+        person = db.query(Person).filter(Person.registro_unico == registro_unico).first()
+        if not person:
+            raise HTTPException(status_code=404, detail="Person not found")
+        images = db.query(PersonImage.filename, PersonImage.faiss_id, PersonImage.content_hash).filter(
+            PersonImage.registro_unico == registro_unico,
+            PersonImage.face_detected == True
+        ).all()
+    
+    saved = []
+    try:
+        for upload in [file] + ([file2] if file2 is not None else []):
+            saved.append(_save_query_image(upload))
+        
+        from ...core.dependencies import get_file_processor
+        file_processor = get_file_processor()
+        embeddings = file_processor.query_embeddings([path for path, _ in saved], [digest for _, digest in saved])
+        if embeddings[0] is None:
+            return {"success": False, "error": "No face detected in query image"}
+        
+        if file2 is not None:
+            if embeddings[1] is None:
+                return {"success": False, "error": "No face detected in second image"}
+            filenames = [file2.filename]
+            gallery = embeddings[1]
+        else:
+            positions, gallery = file_processor.stored_embeddings(
+                [(image.faiss_id, image.content_hash) for image in images]
+            )
+            if not positions:
+                return {
+                    "success": False,
+                    "registro_unico": registro_unico,
+                    "person_name": person.name,
+                    "error": "No stored embeddings for this person"
+                }
+            filenames = [images[position].filename for position in positions]
+        
+        scores = file_processor.cosine_scores(embeddings[0], gallery)
+        best = int(scores.argmax())
+        return {
+            "success": True,
+            "score": float(scores[best]),
+            "threshold": threshold,
+            "match": bool(scores[best] >= threshold),
+            "registro_unico": registro_unico,
+            "person_name": person.name if person is not None else None,
+            "best_match": filenames[best],
+            "scores": [
+                {"filename": filename, "score": float(score)}
+                for filename, score in zip(filenames, scores.tolist())
+            ]
+        }
+    finally:
+        # Remover os arquivos temporários
+        for file_path, _ in saved:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+@router.get("/search/{query_handle}", response_model=SearchResponse)
+def search_by_handle(
+    query_handle: str,
+    offset: int = Query(0, ge=0, le=settings.SEARCH_MAX_OFFSET, description="Posição do primeiro resultado"),
+    k: int = Query(5, ge=1, le=settings.SEARCH_MAX_K, description="Número de resultados a retornar"),
+    origin: Optional[str] = Query(None, description="Considerar apenas imagens desta origem")
+):
+    """Busca outra página (ou com outros filtros) de uma busca por imagem anterior, usando
+    o embedding guardado no servidor: apenas a busca vetorial é executada."""
+    from ...core.dependencies import get_file_processor
+    file_processor = get_file_processor()
+    query = file_processor.query_handles.get(query_handle)
+    if query is None:
+        raise HTTPException(status_code=404, detail="Query handle not found or expired")
+    embedding, query_image = query
+    
+    results, has_more = file_processor.search_page(embedding, offset, k, _search_filters(origin))
+    return _add_image_urls({
+        "success": True,
+        "query_image": query_image,
+        "query_handle": query_handle,
+        "offset": offset,
+        "has_more": has_more,
+        "results": results
+    })
+
 @router.post("/search-by-id/", response_model=SearchResponse)
 def search_by_person_id(
     person_id: str = Body(..., embed=True),
-    k: int = Query(5, description="Número de resultados a retornar"),
+    k: int = Query(5, ge=1, le=settings.SEARCH_MAX_K, description="Número de resultados a retornar"),
     db: Session = Depends(get_db)
 ):
     """Busca diretamente uma pessoa pelo seu ID (RG)."""
@@ -118,7 +308,7 @@ def search_by_person_id(
 @router.post("/search-by-cpf/", response_model=SearchResponse)
 def search_by_cpf(
     cpf: str = Body(..., embed=True),
-    k: int = Query(5, description="Número de resultados a retornar"),
+    k: int = Query(5, ge=1, le=settings.SEARCH_MAX_K, description="Número de resultados a retornar"),
     db: Session = Depends(get_db)
 ):
     """Busca diretamente uma pessoa pelo seu CPF."""
@@ -166,7 +356,7 @@ def search_by_cpf(
 @router.post("/search-by-name/", response_model=SearchResponse)
 def search_by_name(
     name: str = Body(..., embed=True),
-    k: int = Query(25, description="Número de resultados a retornar"),
+    k: int = Query(25, ge=1, le=settings.SEARCH_MAX_K, description="Número de resultados a retornar"),
     db: Session = Depends(get_db)
 ):
     """Busca pessoas pelo nome."""
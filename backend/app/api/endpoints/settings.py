@@ -10,6 +10,8 @@ from ...services.settings_service import (
     rebuild_faiss_index,
     create_backup
 )
+from ...services.index_job_service import RECONCILE_JOB, enqueue_index_job, get_index_job_status
+from ...models.index_job import IndexJob
 from ...core.dependencies import get_faiss_index, get_file_processor
 
 router = APIRouter()
@@ -52,6 +54,28 @@ def rebuild_index(
     background_tasks.add_task(rebuild_faiss_index, db, faiss_index, file_processor)
     return {"message": "Reconstrução do índice FAISS iniciada em segundo plano"}
 
+@router.post("/reconcile-index", status_code=202)
+def reconcile_faiss_index(db: Session = Depends(get_db)) -> Any:
+    """
+    Enfileira a reconciliação incremental do índice FAISS com o banco de dados (embeddings
+    ausentes são adicionados e órfãos removidos). A reconciliação roda no processo escritor
+    do índice; o progresso é consultado em /reconcile-index/{job_id}.
+    """
+    from ...tasks.scheduled_tasks import notify_index_jobs
+    job = enqueue_index_job(db, RECONCILE_JOB)
+    notify_index_jobs()
+    return get_index_job_status(job)
+
+@router.get("/reconcile-index/{job_id}")
+def get_reconcile_status(job_id: str, db: Session = Depends(get_db)) -> Any:
+    """
+    Retorna o status e, quando concluída, o resultado de uma reconciliação enfileirada.
+    """
+    job = db.query(IndexJob).filter(IndexJob.job_id == job_id, IndexJob.kind == RECONCILE_JOB).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Reconciliation job not found")
+    return get_index_job_status(job)
+
 @router.post("/backup")
 def backup_system(
     background_tasks: BackgroundTasks,
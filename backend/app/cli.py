@@ -0,0 +1,329 @@
+"""
+Linha de comando para ingestão em massa sem passar pela API HTTP.
+
+    python -m app.cli ingest /caminho/das/fotos --processes 4
+    python -m app.cli ingest remessa.zip
+    python -m app.cli ingest remessa.tar.gz
+    python -m app.cli migrate-storage
+    python -m app.cli compare-decode /caminho/das/amostras --limit 500
+
+Usa diretamente FileProcessor.parse_filename, o processador de faces, o índice FAISS e os
+modelos do banco. A detecção/embedding roda em um pool de processos (cada um com seus
+próprios modelos); decodificação e persistência seguem o pipeline em estágios. Arquivos
+zip/tar são lidos como fluxo: só a cópia processada e o recorte alinhado vão para o disco.
+
+Com SHARED_INDEX habilitado e a API em execução, as inclusões são encaminhadas ao processo
+escritor do índice. Sem ele, execute a ingestão com a API parada, pois a API sobrescreveria
+o índice salvo por este comando.
+"""
+import os
+import sys
+import time
+import tarfile
+import zipfile
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import numpy as np
+from .config import settings
+from .database import engine, Base, SessionLocal, upgrade_schema
+from .core.dependencies import create_faiss_index, load_faiss_index
+from .core.file_processor import FileProcessor
+from .core.thumbnails import parse_sizes
+from .core.ingest_pipeline import IngestPipeline, IMAGE_EXTENSIONS, iter_archive
+from .services.ingest_service import save_processed_images, remove_ingested_sources
+from .services.storage_migration import migrate_storage
+from . import models  # noqa: F401 (registra os modelos em Base)
+
+logger = logging.getLogger(__name__)
+
+# Processador de faces de cada processo do pool
+_worker_face_processor = None
+
+
+def _init_worker(models_dir: str):
+    global _worker_face_processor
+    from .core.face_processor import FaceProcessor
+    _worker_face_processor = FaceProcessor(model_path=models_dir, decode_target_size=settings.DECODE_TARGET_SIZE)
+
+
+def _detect_batch(
+    images: List[np.ndarray],
+    gate_quality: bool = False,
+    scales: Optional[List[float]] = None
+) -> List[List[Dict[str, Any]]]:
+    return _worker_face_processor.detect_faces_batch(images, gate_quality=gate_quality, scales=scales)
+
+
+def _embed_crops(crops: np.ndarray) -> np.ndarray:
+    return _worker_face_processor.embed_crops(crops)
+
+
+class PoolFaceProcessor:
+    """
+    Distribui os lotes de detecção/embedding entre processos, cada um com um FaceProcessor.
+    Oferece apenas detect_faces_batch e embed_crops, que é o que o pipeline de ingestão usa.
+    """
+    def __init__(self, models_dir: str, processes: int):
+        """
+        Args:
+            models_dir: Diretório dos modelos do InsightFace
+            processes: Número de processos de inferência
+        """
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(models_dir,)
+        )
+
+    def detect_faces_batch(
+        self,
+        images: List[np.ndarray],
+        gate_quality: bool = False,
+        scales: Optional[List[float]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        return self.executor.submit(_detect_batch, images, gate_quality, scales).result()
+
+    def embed_crops(self, crops: np.ndarray) -> np.ndarray:
+        return self.executor.submit(_embed_crops, crops).result()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def list_image_files(root: str) -> Iterator[Tuple[str, str]]:
+    """
+    Lista recursivamente as imagens de um diretório como (caminho, nome do arquivo).
+    """
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, filename), filename
+
+
+def ingest(
+    source: str,
+    processes: int,
+    decode_workers: int,
+    batch_size: int,
+    chunk_size: int,
+    placement: str = "auto",
+    remove_source: bool = False
+) -> Dict[str, Any]:
+    """
+    Ingere as imagens de um diretório ou arquivo compactado (zip/tar).
+
+    Args:
+        source: Diretório ou arquivo compactado com as imagens
+        processes: Processos de detecção/embedding
+        decode_workers: Threads de leitura e decodificação
+        batch_size: Imagens por lote de inferência
+        chunk_size: Resultados gravados no banco por transação
+        placement: Estratégia de colocação das imagens processadas (ver image_store.place_file)
+        remove_source: Remover os arquivos de origem após o registro no banco
+
+    Returns:
+        Estatísticas do processamento
+    """
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+
+    faiss_index = create_faiss_index(settings.PROCESSED_DIR)
+    load_faiss_index(faiss_index, settings.PROCESSED_DIR)
+    face_processor = PoolFaceProcessor(settings.MODELS_DIR, processes)
+    file_processor = FileProcessor(
+        upload_dir=settings.UPLOAD_DIR,
+        processed_dir=settings.PROCESSED_DIR,
+        face_processor=face_processor,
+        faiss_index=faiss_index,
+        file_placement=placement,
+        embedding_cache=settings.EMBEDDING_CACHE,
+        decode_target_size=settings.DECODE_TARGET_SIZE,
+        image_normalization=settings.IMAGE_NORMALIZATION,
+        normalize_max_side=settings.NORMALIZE_MAX_SIDE,
+        normalize_quality=settings.NORMALIZE_QUALITY,
+        thumbnail_sizes=parse_sizes(settings.THUMBNAIL_SIZES) if settings.THUMBNAILS_AT_INGEST else ()
+    )
+
+    db = SessionLocal()
+    progress = {"done": 0, "failed": 0, "start": time.monotonic()}
+
+    def sink(chunk: List[Dict[str, Any]]):
+        successes = [result for result in chunk if result["success"]]
+        try:
+            save_processed_images(db, successes)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        else:
+            remove_ingested_sources(successes, remove_all=remove_source)
+        finally:
+            progress["done"] += len(chunk)
+            progress["failed"] += len(chunk) - len(successes)
+            elapsed = time.monotonic() - progress["start"]
+            print(
+                f"\r{progress['done']} files ({progress['failed']} failed), "
+                f"{progress['done'] / max(elapsed, 1e-6):.1f} images/s",
+                end="", file=sys.stderr, flush=True
+            )
+
+    pipeline = IngestPipeline(
+        file_processor,
+        decode_workers=decode_workers,
+        inference_workers=processes,
+        persist_workers=max(1, decode_workers // 2),
+        queue_size=max(64, batch_size * processes * 2),
+        inference_batch_size=batch_size
+    )
+
+    try:
+        # Arquivos compactados são lidos como fluxo, sem extração para o disco
+        items = list_image_files(source) if os.path.isdir(source) else iter_archive(source)
+        result = pipeline.run(items, sink=sink, sink_chunk_size=chunk_size, collect_details=False)
+    finally:
+        print(file=sys.stderr)
+        face_processor.close()
+        db.close()
+
+    return result
+
+
+def compare_decode(source: str, limit: int = 0) -> Dict[str, Any]:
+    """
+    Compara, em um conjunto de amostras, os embeddings da decodificação reduzida (com e sem
+    o novo alinhamento em resolução total das faces pequenas) com os da resolução total.
+
+    Args:
+        source: Diretório com as imagens de amostra
+        limit: Número máximo de imagens (0 = todas)
+
+    Returns:
+        Dicionário com o número de faces comparadas, quantas foram realinhadas e a
+        similaridade de cosseno média e mínima de cada variante com a resolução total
+    """
+    from .core.face_processor import FaceProcessor, needs_full_resolution, recognition_crop
+    from .core.image_decode import decode_image
+
+    face_processor = FaceProcessor(model_path=settings.MODELS_DIR)
+    reduced_scores = []
+    realigned_scores = []
+    small_faces = 0
+    for position, (path, _) in enumerate(list_image_files(source)):
+        if limit and position >= limit:
+            break
+        with open(path, "rb") as f:
+            data = f.read()
+        full_img, _ = decode_image(data)
+        reduced_img, scale = decode_image(data, settings.DECODE_TARGET_SIZE)
+        if full_img is None or scale == 1.0:
+            continue
+        full_faces = face_processor.detect_faces_batch([full_img])[0]
+        reduced_faces = face_processor.detect_faces_batch([reduced_img], scales=[scale])[0]
+        if not full_faces or not reduced_faces or not full_faces[0].get("embedding") or not reduced_faces[0].get("embedding"):
+            continue
+
+        full = np.asarray(full_faces[0]["embedding"], dtype=np.float32)
+        reduced = np.asarray(reduced_faces[0]["embedding"], dtype=np.float32)
+        realigned = reduced
+        if needs_full_resolution(reduced_faces[0]["kps"], scale):
+            small_faces += 1
+            crop = recognition_crop(full_img, reduced_faces[0]["kps"])
+            realigned = face_processor.embed_crops(crop[np.newaxis])[0]
+        reduced_scores.append(float(FileProcessor.cosine_scores(full, reduced)[0]))
+        realigned_scores.append(float(FileProcessor.cosine_scores(full, realigned)[0]))
+
+    return {
+        "faces": len(reduced_scores),
+        "realigned": small_faces,
+        "reduced_mean": float(np.mean(reduced_scores)) if reduced_scores else None,
+        "reduced_min": float(np.min(reduced_scores)) if reduced_scores else None,
+        "realigned_mean": float(np.mean(realigned_scores)) if realigned_scores else None,
+        "realigned_min": float(np.min(realigned_scores)) if realigned_scores else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Ferramentas de linha de comando do SIF")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Ingere imagens de um diretório ou arquivo zip/tar")
+    ingest_parser.add_argument("source", help="Diretório ou arquivo compactado com as imagens")
+    ingest_parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                               help="Processos de detecção/embedding")
+    ingest_parser.add_argument("--decode-workers", type=int, default=settings.BATCH_WORKERS,
+                               help="Threads de leitura e decodificação")
+    ingest_parser.add_argument("--batch-size", type=int, default=16, help="Imagens por lote de inferência")
+    ingest_parser.add_argument("--chunk-size", type=int, default=500, help="Resultados gravados por transação")
+    ingest_parser.add_argument("--placement", default="auto", choices=["auto", "move", "hardlink", "reflink", "copy"],
+                               help="Colocação das imagens processadas (auto: hardlink, reflink ou cópia)")
+    ingest_parser.add_argument("--remove-source", action="store_true",
+                               help="Remover os arquivos de origem após o registro no banco")
+
+    subparsers.add_parser(
+        "migrate-storage",
+        help="Move as imagens processadas para o layout endereçado por conteúdo"
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare-decode",
+        help="Compara os embeddings da decodificação reduzida com os da resolução total"
+    )
+    compare_parser.add_argument("source", help="Diretório com as imagens de amostra")
+    compare_parser.add_argument("--limit", type=int, default=0, help="Número máximo de imagens (0 = todas)")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.command == "ingest":
+        if not os.path.exists(args.source):
+            parser.error(f"source not found: {args.source}")
+        if not os.path.isdir(args.source) and not (zipfile.is_zipfile(args.source) or tarfile.is_tarfile(args.source)):
+            parser.error(f"source is not a directory, zip or tar archive: {args.source}")
+        result = ingest(
+            args.source, args.processes, args.decode_workers, args.batch_size, args.chunk_size,
+            placement=args.placement, remove_source=args.remove_source
+        )
+        elapsed = result["elapsed_time"]
+        rate = result["total_files"] / elapsed if elapsed > 0 else 0.0
+        print(
+            f"Ingested {result['processed']} of {result['total_files']} files "
+            f"({result['failed']} failed) in {elapsed:.1f}s: {rate:.1f} images/s"
+        )
+        return 0 if result["success"] else 1
+
+    if args.command == "migrate-storage":
+        Base.metadata.create_all(bind=engine)
+        upgrade_schema()
+        db = SessionLocal()
+        try:
+            result = migrate_storage(db, settings.PROCESSED_DIR)
+        finally:
+            db.close()
+        print(
+            f"Migrated {result['migrated']} images ({result['missing']} missing files) "
+            f"in {result['elapsed_time']:.1f}s"
+        )
+        return 0
+
+    if args.command == "compare-decode":
+        if not os.path.isdir(args.source):
+            parser.error(f"source is not a directory: {args.source}")
+        result = compare_decode(args.source, args.limit)
+        if not result["faces"]:
+            print("No reduced-decode samples with a detected face")
+            return 1
+        print(
+            f"{result['faces']} faces ({result['realigned']} realigned at full resolution); "
+            f"cosine to full-resolution embedding: reduced decode mean {result['reduced_mean']:.4f} "
+            f"min {result['reduced_min']:.4f}, with realignment mean {result['realigned_mean']:.4f} "
+            f"min {result['realigned_min']:.4f}"
+        )
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -22,13 +22,49 @@ class Settings(BaseSettings):
     
     # Configurações do InsightFace
     INSIGHTFACE_MODEL: str = "buffalo_l"
+    INFERENCE_SERVER_ADDRESS: str = ""  # Servidor de inferência dedicado ("host:porta" ou socket Unix); vazio = modelos no processo da API
+    INFERENCE_SERVER_AUTHKEY: str = os.getenv("INFERENCE_SERVER_AUTHKEY", "")  # Segredo do servidor de inferência (obrigatório com INFERENCE_SERVER_ADDRESS; use só em rede confiável)
     
     # Configurações do FAISS
     FAISS_DIMENSION: int = 512
     FAISS_INDEX_TYPE: str = "L2"
+    FAISS_DELTA_MAX_SIZE: int = 10000  # Tamanho do índice delta que dispara a fusão com o principal
+    FAISS_SHARDS: int = 0  # Número de shards em processos locais (0 = índice único no processo da API)
+    FAISS_SHARD_KEY: str = "id"  # Particionamento dos shards: "id" (hash do ID) ou "origin"
+    FAISS_SHARD_ADDRESSES: str = ""  # Shards remotos já iniciados ("host:porta,host:porta")
+    FAISS_SHARD_AUTHKEY: str = os.getenv("FAISS_SHARD_AUTHKEY", "")  # Segredo dos shards remotos (obrigatório com FAISS_SHARD_ADDRESSES); vazio = chave aleatória local
+    SHARED_INDEX: bool = False  # Compartilhar o índice entre workers do uvicorn (um escritor, leitores via mmap; somente índice L2)
+    SHARED_INDEX_PUBLISH_SECONDS: float = 5.0  # Intervalo de publicação dos snapshots pelo escritor
+    INDEX_RECONCILE_INTERVAL_MINUTES: int = 60  # 0 desativa a reconciliação agendada
     
     # Configurações de processamento
     BATCH_WORKERS: int = 8
+    BATCH_JOB_WORKERS: int = 1  # Lotes processados simultaneamente pelo executor de jobs
+    BATCH_JOB_POLL_SECONDS: float = 2.0  # Intervalo de consulta da fila de lotes
+    BATCH_JOB_STALE_MINUTES: int = 10  # Lotes em processamento sem heartbeat por esse tempo voltam para a fila
+    BATCH_JOB_HEARTBEAT_SECONDS: float = 30.0  # Intervalo de renovação da reserva de um lote em processamento
+    BATCH_PROGRESS_CHUNK_SIZE: int = 200  # Arquivos por transação de progresso de um lote
+    FILE_PLACEMENT: str = "auto"  # Colocação dos arquivos processados: auto (hardlink, reflink ou cópia), move, hardlink, reflink, copy
+    EMBEDDING_CACHE: bool = True  # Reaproveitar a detecção/embedding de imagens com conteúdo já processado
+    IMAGE_NORMALIZATION: str = "off"  # Regravar as imagens processadas: off, jpeg ou webp (orientação EXIF aplicada)
+    NORMALIZE_MAX_SIDE: int = 2048  # Maior lado das imagens normalizadas (0 = sem limite)
+    NORMALIZE_QUALITY: int = 90  # Qualidade do JPEG/WebP das imagens normalizadas
+    THUMBNAIL_SIZES: str = "128,256,512"  # Tamanhos das miniaturas (maior lado), servidos pelo parâmetro size
+    THUMBNAILS_AT_INGEST: bool = False  # Gerar as miniaturas na ingestão (senão, na primeira requisição)
+    DECODE_TARGET_SIZE: int = 1280  # Maior lado mínimo ao decodificar JPEGs grandes em resolução reduzida (0 desativa)
+    REMOVE_INGESTED_UPLOADS: bool = True  # Remover o arquivo de upload após o registro no banco
+    WATCH_UPLOAD_DIR_SECONDS: int = 0  # Intervalo de observação da pasta de uploads para ingestão contínua (0 desativa)
+    SEARCH_CACHE_SIZE: int = 1024  # Entradas dos caches de consultas e de resultados de busca (0 desativa)
+    SEARCH_CACHE_TTL_SECONDS: float = 600.0  # Tempo de vida das entradas desses caches
+    QUERY_HANDLE_TTL_SECONDS: float = 1800.0  # Tempo de vida dos identificadores de consulta (paginação de buscas)
+    SEARCH_MAX_K: int = 100  # Máximo de resultados por busca (e por página)
+    SEARCH_MAX_OFFSET: int = 1000  # Posição máxima do primeiro resultado na paginação de buscas
+    SEARCH_FILTER_FETCH_FACTOR: int = 16  # Candidatos examinados por resultado pedido em buscas com filtros (acima disso o resultado é parcial)
+    QUALITY_GATE: str = "flag"  # Qualidade das faces na ingestão: off, flag (registra os critérios) ou reject (não indexa)
+    QUALITY_MIN_DET_SCORE: float = 0.6  # Score mínimo de detecção
+    QUALITY_MIN_INTER_OCULAR: float = 20.0  # Distância mínima entre os olhos (pixels)
+    QUALITY_MIN_SHARPNESS: float = 20.0  # Variância mínima do Laplaciano do recorte alinhado (nitidez)
+    QUALITY_MAX_YAW: float = 45.0  # Rotação lateral máxima estimada pelos 5 pontos (graus)
     SIMILARITY_THRESHOLD: float = 0.7
     
     # Configurações de e-mail
@@ -0,0 +1,185 @@
+"""
+Armazenamento compactado dos recortes alinhados das faces.
+
+Os recortes são anexados a um único arquivo de dados (uint8, N x S x S x 3) que pode ser
+mapeado em memória, e um arquivo de índice guarda pares (chave, posição) com a chave sendo
+o faiss_id da imagem. Os recortes são exatamente a entrada do modelo de reconhecimento
+(alinhados pelos 5 pontos do detector, na ordem de canais usada na ingestão), de modo que
+reprocessar a galeria com outro modelo é uma leitura sequencial, sem detecção.
+"""
+import os
+import fcntl
+import threading
+import logging
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Subdiretório do diretório de processados com os arquivos de recortes
+CROPS_DIRNAME = "crops"
+DATA_FILENAME = "crops.u8"
+INDEX_FILENAME = "crops.idx"
+
+
+class CropStore:
+    """
+    Arquivo de recortes somente para anexação, compartilhável entre processos.
+    """
+    def __init__(self, root_dir: str, image_size: int = 112):
+        """
+        Args:
+            root_dir: Diretório dos arquivos de dados e de índice
+            image_size: Lado dos recortes (em pixels)
+        """
+        self.root_dir = root_dir
+        self.image_size = image_size
+        self.record_size = image_size * image_size * 3
+        self.data_path = os.path.join(root_dir, DATA_FILENAME)
+        self.index_path = os.path.join(root_dir, INDEX_FILENAME)
+        self._positions: Dict[int, int] = {}
+        self._index_offset = 0
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def append(self, key: int, crop: np.ndarray) -> int:
+        """
+        Anexa um recorte. O registro de dados é gravado antes da entrada do índice, de modo
+        que uma interrupção nunca deixa no índice uma posição sem dados.
+
+        Returns:
+            Posição do recorte no arquivo de dados
+        """
+        crop = np.ascontiguousarray(crop, dtype=np.uint8)
+        if crop.shape != (self.image_size, self.image_size, 3):
+            raise ValueError(f"Invalid crop shape {crop.shape}, expected {(self.image_size, self.image_size, 3)}")
+
+        with self._lock, open(self.data_path, "a+b") as data_file:
+            # Lock entre processos (ex.: API e CLI de ingestão)
+            fcntl.flock(data_file, fcntl.LOCK_EX)
+            try:
+                # Um registro incompleto de uma interrupção anterior é sobrescrito
+                position = os.fstat(data_file.fileno()).st_size // self.record_size
+                data_file.truncate(position * self.record_size)
+                data_file.seek(position * self.record_size)
+                data_file.write(crop.tobytes())
+                data_file.flush()
+
+                with open(self.index_path, "ab") as index_file:
+                    index_file.write(np.array([key, position], dtype=np.int64).tobytes())
+            finally:
+                fcntl.flock(data_file, fcntl.LOCK_UN)
+
+        self._positions[int(key)] = position
+        return position
+
+    def alias(self, key: int, existing_key: int) -> Optional[int]:
+        """
+        Faz uma nova chave apontar para o recorte já gravado de outra chave (ex.: a imagem
+        recebeu um novo faiss_id), anexando apenas uma entrada ao índice.
+
+        Returns:
+            Posição do recorte, ou None se a chave existente não tem recorte
+        """
+        self._refresh()
+        position = self._positions.get(int(existing_key))
+        if position is None:
+            return None
+
+        with self._lock, open(self.index_path, "ab") as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                index_file.write(np.array([key, position], dtype=np.int64).tobytes())
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+        self._positions[int(key)] = position
+        return position
+
+    def _refresh(self):
+        """
+        Lê as entradas do índice anexadas desde a última leitura (inclusive por outros processos).
+        """
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return
+        entry_size = 16
+        size -= size % entry_size
+        if size <= self._index_offset:
+            return
+
+        with self._lock:
+            if size <= self._index_offset:
+                return
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_offset)
+                entries = np.frombuffer(f.read(size - self._index_offset), dtype=np.int64).reshape(-1, 2)
+            # Entradas posteriores prevalecem (recorte regravado para a mesma chave)
+            self._positions.update(zip(entries[:, 0].tolist(), entries[:, 1].tolist()))
+            self._index_offset = size
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._positions)
+
+    def __contains__(self, key: int) -> bool:
+        self._refresh()
+        return int(key) in self._positions
+
+    def max_key(self) -> int:
+        """
+        Maior chave com recorte gravado (-1 se o armazenamento está vazio).
+        """
+        self._refresh()
+        return max(self._positions, default=-1)
+
+    def memmap(self) -> Optional[np.memmap]:
+        """
+        Mapeia o arquivo de dados em memória (somente leitura) como N x S x S x 3.
+        """
+        try:
+            count = os.path.getsize(self.data_path) // self.record_size
+        except FileNotFoundError:
+            return None
+        if count == 0:
+            return None
+        return np.memmap(
+            self.data_path, dtype=np.uint8, mode="r",
+            shape=(count, self.image_size, self.image_size, 3)
+        )
+
+    def get_many(self, keys: List[int]) -> Tuple[List[int], Optional[np.ndarray]]:
+        """
+        Lê os recortes das chaves informadas, em ordem de posição no arquivo.
+
+        Returns:
+            Chaves encontradas e array (M x S x S x 3) com os recortes correspondentes
+        """
+        self._refresh()
+        found = sorted(
+            ((self._positions[int(key)], int(key)) for key in keys if int(key) in self._positions)
+        )
+        data = self.memmap()
+        if not found or data is None:
+            return [], None
+        positions = np.array([position for position, _ in found], dtype=np.int64)
+        return [key for _, key in found], np.array(data[positions])
+
+    def get(self, key: int) -> Optional[np.ndarray]:
+        keys, crops = self.get_many([key])
+        return crops[0] if keys else None
+
+    def iter_batches(self, batch_size: int = 256) -> Iterator[Tuple[List[int], np.ndarray]]:
+        """
+        Percorre todos os recortes indexados sequencialmente, em blocos.
+        """
+        self._refresh()
+        data = self.memmap()
+        if data is None:
+            return
+        by_position = sorted((position, key) for key, position in self._positions.items())
+        for start in range(0, len(by_position), batch_size):
+            chunk = by_position[start:start + batch_size]
+            positions = np.array([position for position, _ in chunk], dtype=np.int64)
+            yield [key for _, key in chunk], np.array(data[positions])
@@ -3,9 +3,15 @@ Dependências compartilhadas para injeção de dependência no FastAPI.
 """
 import os
 import logging
+import threading
 from ..core.face_processor import FaceProcessor
+from ..core.inference_server import RemoteFaceProcessor
 from ..core.faiss_index import FaissIndex
+from ..core.faiss_shards import ShardedFaissIndex, ShardServer, local_authkey
+from ..core.shared_index import SharedFaissIndex, SnapshotPublisher, acquire_writer_lock
 from ..core.file_processor import FileProcessor
+from ..core.thumbnails import parse_sizes
+from ..config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +20,10 @@ face_processor = None
 faiss_index = None
 file_processor = None
 
+# Servidor e publicador do processo escritor do índice compartilhado (SHARED_INDEX)
+index_writer_server = None
+snapshot_publisher = None
+
 def rebuild_index_from_db(db, faiss_index, file_processor):
     """
     Reconstrói o índice FAISS a partir das imagens armazenadas no banco de dados.
@@ -72,27 +82,89 @@ def rebuild_index_from_db(db, faiss_index, file_processor):
     logger.info(f"Reconstrução do índice FAISS concluída: {success_count} sucesso, {failure_count} falhas")
     return success_count, failure_count
 
-def init_processors(upload_dir, processed_dir, models_dir):
-    """Inicializa os processadores necessários para a aplicação."""
-    global face_processor, faiss_index, file_processor
+def create_faiss_index(processed_dir):
+    """
+    Cria o índice FAISS conforme a configuração: índice único no processo da API,
+    shards em processos locais (FAISS_SHARDS) ou shards remotos (FAISS_SHARD_ADDRESSES).
+    """
+    authkey = settings.FAISS_SHARD_AUTHKEY.encode("utf-8")
+    if settings.FAISS_SHARD_ADDRESSES:
+        # Shards iniciados à parte: o segredo precisa ser configurado nos dois lados
+        if not authkey:
+            raise ValueError("FAISS_SHARD_AUTHKEY must be set when FAISS_SHARD_ADDRESSES is configured")
+        addresses = [address.strip() for address in settings.FAISS_SHARD_ADDRESSES.split(",") if address.strip()]
+        return ShardedFaissIndex(addresses, authkey, shard_key=settings.FAISS_SHARD_KEY, dimension=512)
     
-    # Inicializar processador de faces
-    face_processor = FaceProcessor(model_path=models_dir)
-    logger.info("Face processor initialized")
+    if settings.FAISS_SHARDS > 0:
+        return ShardedFaissIndex.start_local(
+            num_shards=settings.FAISS_SHARDS,
+            base_dir=os.path.join(processed_dir, "shards"),
+            authkey=authkey or None,
+            dimension=512,
+            index_type="L2",
+            delta_max_size=settings.FAISS_DELTA_MAX_SIZE,
+            shard_key=settings.FAISS_SHARD_KEY
+        )
     
-    # Inicializar índice FAISS
-    faiss_index = FaissIndex(
+    if settings.SHARED_INDEX and not acquire_writer_lock(processed_dir):
+        # Outro worker é o escritor: anexar aos snapshots que ele publica
+        return SharedFaissIndex(
+            snapshot_dir=os.path.join(processed_dir, "snapshots"),
+            writer_address=os.path.join(processed_dir, "index_writer.sock"),
+            authkey=authkey or local_authkey(processed_dir),
+            dimension=512
+        )
+    
+    return FaissIndex(
         dimension=512,  # Valor padrão, pode ser configurável
-        index_type="L2"  # Valor padrão, pode ser configurável
+        index_type="L2",  # Valor padrão, pode ser configurável
+        delta_max_size=settings.FAISS_DELTA_MAX_SIZE
     )
-    logger.info("FAISS index initialized")
+
+def start_index_writer(faiss_index, processed_dir):
+    """
+    No processo escritor do índice compartilhado, atende as alterações vindas dos demais
+    workers e publica snapshots para eles.
+    """
+    global index_writer_server, snapshot_publisher
     
-    # Verificar se existe um índice FAISS salvo
+    # Encerrar servidor e publicador de uma inicialização anterior
+    if index_writer_server is not None:
+        index_writer_server.stop()
+    if snapshot_publisher is not None:
+        snapshot_publisher.stop()
+    
+    index_writer_server = ShardServer(
+        address=os.path.join(processed_dir, "index_writer.sock"),
+        authkey=settings.FAISS_SHARD_AUTHKEY.encode("utf-8") or local_authkey(processed_dir),
+        index_dir=processed_dir,
+        faiss_index=faiss_index
+    )
+    threading.Thread(target=index_writer_server.serve_forever, daemon=True).start()
+    
+    snapshot_publisher = SnapshotPublisher(
+        faiss_index,
+        snapshot_dir=os.path.join(processed_dir, "snapshots"),
+        interval=settings.SHARED_INDEX_PUBLISH_SECONDS
+    )
+    snapshot_publisher.start()
+    logger.info(f"This worker (pid {os.getpid()}) is the shared FAISS index writer")
+
+def is_index_writer():
+    """Indica se este processo pode alterar o índice localmente (não é um leitor do índice compartilhado)."""
+    return not isinstance(faiss_index, SharedFaissIndex)
+
+def load_faiss_index(faiss_index, processed_dir):
+    """Carrega o índice FAISS salvo em processed_dir, se existir."""
     try:
         index_path = os.path.join(processed_dir, "faiss_index.bin")
         metadata_path = os.path.join(processed_dir, "faiss_metadata.pkl")
         
-        if os.path.exists(index_path) and os.path.exists(metadata_path):
+        if isinstance(faiss_index, ShardedFaissIndex):
+            # Cada shard carrega seus próprios arquivos; o coordenador carrega apenas seu estado
+            faiss_index.load(index_path, metadata_path)
+            logger.info(f"Sharded FAISS index loaded with {faiss_index.get_total_items()} embeddings")
+        elif os.path.exists(index_path) and os.path.exists(metadata_path):
             logger.info("Existing FAISS index found, attempting to load")
             success = faiss_index.load(index_path, metadata_path)
             
@@ -105,13 +177,55 @@ def init_processors(upload_dir, processed_dir, models_dir):
         logger.error(f"Error loading FAISS index: {str(e)}")
         logger.warning("A new FAISS index will be created")
         logger.info("You may need to rebuild the index using /api/settings/rebuild-index")
+
+def init_processors(upload_dir, processed_dir, models_dir):
+    """Inicializa os processadores necessários para a aplicação."""
+    global face_processor, faiss_index, file_processor
+    
+    # Inicializar processador de faces (local ou cliente do servidor de inferência)
+    if settings.INFERENCE_SERVER_ADDRESS:
+        if not settings.INFERENCE_SERVER_AUTHKEY:
+            raise ValueError("INFERENCE_SERVER_AUTHKEY must be set when INFERENCE_SERVER_ADDRESS is configured")
+        face_processor = RemoteFaceProcessor(
+            settings.INFERENCE_SERVER_ADDRESS,
+            settings.INFERENCE_SERVER_AUTHKEY.encode("utf-8")
+        )
+    else:
+        face_processor = FaceProcessor(model_path=models_dir, decode_target_size=settings.DECODE_TARGET_SIZE)
+    logger.info("Face processor initialized")
+    
+    # Encerrar os shards da configuração anterior antes de iniciar novos
+    if isinstance(faiss_index, ShardedFaissIndex):
+        faiss_index.close()
+    
+    # Inicializar índice FAISS
+    faiss_index = create_faiss_index(processed_dir)
+    logger.info("FAISS index initialized")
+    
+    # Verificar se existe um índice FAISS salvo
+    load_faiss_index(faiss_index, processed_dir)
+    
+    # Compartilhar o índice com os demais workers do uvicorn
+    if settings.SHARED_INDEX and isinstance(faiss_index, FaissIndex):
+        start_index_writer(faiss_index, processed_dir)
     
     # Inicializar processador de arquivos
     file_processor = FileProcessor(
         upload_dir=upload_dir,
         processed_dir=processed_dir,
         face_processor=face_processor,
-        faiss_index=faiss_index
+        faiss_index=faiss_index,
+        file_placement=settings.FILE_PLACEMENT,
+        embedding_cache=settings.EMBEDDING_CACHE,
+        search_cache_size=settings.SEARCH_CACHE_SIZE,
+        search_cache_ttl=settings.SEARCH_CACHE_TTL_SECONDS,
+        query_handle_ttl=settings.QUERY_HANDLE_TTL_SECONDS,
+        search_filter_fetch_factor=settings.SEARCH_FILTER_FETCH_FACTOR,
+        decode_target_size=settings.DECODE_TARGET_SIZE,
+        image_normalization=settings.IMAGE_NORMALIZATION,
+        normalize_max_side=settings.NORMALIZE_MAX_SIDE,
+        normalize_quality=settings.NORMALIZE_QUALITY,
+        thumbnail_sizes=parse_sizes(settings.THUMBNAIL_SIZES) if settings.THUMBNAILS_AT_INGEST else ()
     )
     logger.info("File processor initialized")
     
@@ -0,0 +1,123 @@
+"""
+Varredura de diretórios de imagens em uma única passagem (os.scandir) e observação
+incremental de uma pasta de entrada por polling com marca d'água persistida.
+"""
+import os
+import json
+import time
+import logging
+from typing import List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class ScanEntry(NamedTuple):
+    name: str
+    path: str
+    ctime_ns: int  # Instante em que o arquivo chegou (cópias que preservam o mtime não o alteram)
+
+
+def scan_images(directory: str, prefix: str = "", newer_than_ns: int = 0) -> List[ScanEntry]:
+    """
+    Lista as imagens de um diretório em uma única passagem, sem distinguir maiúsculas
+    de minúsculas na extensão.
+
+    Args:
+        directory: Diretório a ser varrido
+        prefix: Considerar apenas arquivos cujo nome começa com este prefixo
+        newer_than_ns: Considerar apenas arquivos que chegaram depois deste instante (ctime, em ns)
+
+    Returns:
+        Lista de entradas (nome, caminho, ctime em ns)
+    """
+    entries = []
+    try:
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                name = entry.name
+                if not name.startswith(prefix) or not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    ctime_ns = entry.stat().st_ctime_ns
+                except FileNotFoundError:
+                    # Removido durante a varredura
+                    continue
+                if ctime_ns > newer_than_ns:
+                    entries.append(ScanEntry(name, entry.path, ctime_ns))
+    except FileNotFoundError:
+        logger.warning(f"Directory not found: {directory}")
+    return entries
+
+
+class DirectoryWatcher:
+    """
+    Detecta os arquivos novos de uma pasta de entrada entre uma consulta e outra.
+
+    A marca d'água (maior ctime já entregue, e os nomes com esse mesmo ctime) é gravada em
+    um arquivo de estado, de modo que após um reinício apenas os arquivos que chegaram
+    depois dela são considerados. Arquivos alterados há menos de settle_seconds são
+    deixados para a próxima consulta, pois podem ainda estar sendo copiados.
+    """
+    def __init__(self, directory: str, state_path: str, settle_seconds: float = 2.0):
+        """
+        Args:
+            directory: Pasta observada
+            state_path: Arquivo JSON onde a marca d'água é persistida
+            settle_seconds: Idade mínima de um arquivo para ser entregue
+        """
+        self.directory = directory
+        self.state_path = state_path
+        self.settle_ns = int(settle_seconds * 1e9)
+        self.high_water_ns = 0
+        self.names_at_mark = set()
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self.high_water_ns = int(state.get("high_water_ns", 0))
+            self.names_at_mark = set(state.get("names_at_mark", []))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Error reading watch state {self.state_path}: {str(e)}")
+
+    def _save_state(self):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"high_water_ns": self.high_water_ns, "names_at_mark": sorted(self.names_at_mark)}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def poll(self) -> List[ScanEntry]:
+        """
+        Retorna os arquivos que chegaram desde a última consulta confirmada, em ordem de chegada.
+        """
+        settled_before = time.time_ns() - self.settle_ns
+        entries = [
+            entry for entry in scan_images(self.directory, newer_than_ns=self.high_water_ns - 1)
+            if entry.ctime_ns <= settled_before
+            and not (entry.ctime_ns == self.high_water_ns and entry.name in self.names_at_mark)
+        ]
+        entries.sort(key=lambda entry: entry.ctime_ns)
+        return entries
+
+    def commit(self, entries: List[ScanEntry]):
+        """
+        Avança a marca d'água para além das entradas já registradas para ingestão.
+        """
+        if not entries:
+            return
+        mark = max(entry.ctime_ns for entry in entries)
+        names = {entry.name for entry in entries if entry.ctime_ns == mark}
+        if mark == self.high_water_ns:
+            self.names_at_mark |= names
+        else:
+            self.high_water_ns = mark
+            self.names_at_mark = names
+        self._save_state()
+
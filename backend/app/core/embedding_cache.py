@@ -0,0 +1,185 @@
+"""
+Cache persistente do resultado da detecção/embedding, chaveado pelo hash do conteúdo.
+
+Cada registro guarda o SHA-256 da imagem e a face principal detectada (embedding, 5 pontos,
+bounding box, score e as medidas de qualidade) em um arquivo somente para anexação. Uma imagem já vista (o mesmo
+arquivo reenviado com outro nome ou em outra remessa) reaproveita o resultado sem passar
+pela detecção e pelo reconhecimento. O conteúdo vale para o modelo de reconhecimento que o
+gerou: ao trocar de modelo, remova o diretório do cache. As medidas de qualidade são
+guardadas brutas, para que os limites atuais sejam aplicados também às faces em cache.
+Os arquivos do formato anterior (faces.bin, sem as medidas) não são mais lidos.
+
+Um arquivo de índice separado guarda pares (hash, posição), como o crops.idx do
+armazenamento de recortes, de modo que carregar o mapa lê 40 bytes por registro em vez
+do registro inteiro.
+"""
+import os
+import fcntl
+import threading
+import logging
+import numpy as np
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Subdiretório do diretório de processados com o arquivo do cache
+EMBEDDING_CACHE_DIRNAME = "embedding_cache"
+CACHE_FILENAME = "faces.v2.bin"
+INDEX_FILENAME = "faces.v2.idx"
+
+_DIGEST_SIZE = 32
+# Entrada do índice: hash do conteúdo e posição do registro
+_INDEX_ENTRY = np.dtype([("digest", f"V{_DIGEST_SIZE}"), ("position", "<i8")])
+# bbox (4) + kps (5 x 2) + score (1) + qualidade (4)
+_FACE_FIELDS = 19
+# Medidas de face_quality.assess_face guardadas no registro (det_score é o próprio score);
+# NaN quando a avaliação de qualidade estava desativada
+_QUALITY_FIELDS = ("inter_ocular", "sharpness", "yaw", "roll")
+
+
+class EmbeddingCache:
+    """
+    Mapa persistente hash do conteúdo -> face detectada, compartilhável entre processos.
+    """
+    def __init__(self, root_dir: str, dimension: int = 512):
+        """
+        Args:
+            root_dir: Diretório do arquivo do cache
+            dimension: Dimensão dos embeddings
+        """
+        self.dimension = dimension
+        self.path = os.path.join(root_dir, CACHE_FILENAME)
+        self.index_path = os.path.join(root_dir, INDEX_FILENAME)
+        self.record_size = _DIGEST_SIZE + 4 * (dimension + _FACE_FIELDS)
+        self._positions: Dict[bytes, int] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+        os.makedirs(root_dir, exist_ok=True)
+        self._build_index()
+
+    def _build_index(self):
+        """
+        Cria o arquivo de índice de um cache gravado antes dele, lendo apenas os hashes
+        (leitura com passo sobre o arquivo de dados mapeado em memória).
+        """
+        if os.path.exists(self.index_path) or not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.index_path):
+                    return
+                count = os.fstat(f.fileno()).st_size // self.record_size
+                entries = np.zeros(count, dtype=_INDEX_ENTRY)
+                if count:
+                    data = np.memmap(f, dtype=np.uint8, mode="r", shape=(count, self.record_size))
+                    entries["digest"] = np.ascontiguousarray(data[:, :_DIGEST_SIZE]).view(f"V{_DIGEST_SIZE}").ravel()
+                    entries["position"] = np.arange(count, dtype=np.int64)
+                    del data
+                tmp_path = f"{self.index_path}.tmp"
+                entries.tofile(tmp_path)
+                os.replace(tmp_path, self.index_path)
+                logger.info(f"Built embedding cache index with {count} entries")
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """
+        Lê as entradas do índice anexadas desde a última leitura (inclusive por outros processos).
+        """
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            return
+        size -= size % _INDEX_ENTRY.itemsize
+        if size <= self._offset:
+            return
+
+        with self._lock:
+            if size <= self._offset:
+                return
+            with open(self.index_path, "rb") as f:
+                f.seek(self._offset)
+                entries = np.frombuffer(f.read(size - self._offset), dtype=_INDEX_ENTRY)
+            self._positions.update(zip(entries["digest"].tolist(), entries["position"].tolist()))
+            self._offset = size
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        """
+        Retorna a face em cache para o hash (hexadecimal), no formato de FaceProcessor.detect_faces.
+        """
+        self._refresh()
+        position = self._positions.get(bytes.fromhex(digest))
+        if position is None:
+            return None
+
+        with open(self.path, "rb") as f:
+            record = os.pread(f.fileno(), self.record_size, position * self.record_size)
+        values = np.frombuffer(record, dtype=np.float32, offset=_DIGEST_SIZE)
+        embedding = values[:self.dimension]
+        face = values[self.dimension:]
+        quality = None
+        if not np.isnan(face[15]):
+            quality = {"det_score": float(face[14])}
+            quality.update(zip(_QUALITY_FIELDS, face[15:19].tolist()))
+        return {
+            "bbox": face[0:4].astype(int).tolist(),
+            "landmarks": None,
+            "kps": face[4:14].reshape(5, 2).tolist(),
+            "embedding": embedding.tolist(),
+            "score": float(face[14]),
+            "quality": quality,
+            "quality_issues": []
+        }
+
+    def __contains__(self, digest: str) -> bool:
+        self._refresh()
+        return bytes.fromhex(digest) in self._positions
+
+    def put(self, digest: str, face: Dict[str, Any]) -> bool:
+        """
+        Grava a face detectada de uma imagem. Faces sem embedding ou sem os 5 pontos
+        (necessários para o recorte alinhado) não são guardadas.
+
+        Returns:
+            True se a face foi gravada
+        """
+        if face.get("embedding") is None or face.get("kps") is None or len(face["embedding"]) != self.dimension:
+            return False
+        self._refresh()
+        key = bytes.fromhex(digest)
+        if key in self._positions:
+            return False
+
+        quality = face.get("quality")
+        values = np.concatenate([
+            np.asarray(face["embedding"], dtype=np.float32).ravel(),
+            np.asarray(face["bbox"], dtype=np.float32).ravel(),
+            np.asarray(face["kps"], dtype=np.float32).ravel(),
+            np.array([face.get("score", 0.0)], dtype=np.float32),
+            np.array(
+                [quality[field] if quality else np.nan for field in _QUALITY_FIELDS], dtype=np.float32
+            )
+        ])
+        record = key + values.tobytes()
+
+        with self._lock, open(self.path, "a+b") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Um registro incompleto de uma interrupção anterior é sobrescrito
+                position = os.fstat(f.fileno()).st_size // self.record_size
+                f.truncate(position * self.record_size)
+                f.seek(position * self.record_size)
+                f.write(record)
+                f.flush()
+
+                # A entrada do índice é gravada depois do registro completo
+                entry = np.array([(key, position)], dtype=_INDEX_ENTRY)
+                with open(self.index_path, "a+b") as index_file:
+                    entries = os.fstat(index_file.fileno()).st_size // _INDEX_ENTRY.itemsize
+                    index_file.truncate(entries * _INDEX_ENTRY.itemsize)
+                    index_file.write(entry.tobytes())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._positions[key] = position
+        return True
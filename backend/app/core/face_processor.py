@@ -3,33 +3,232 @@ import cv2
 import numpy as np
 import insightface
 from insightface.app import FaceAnalysis
+from insightface.app.common import Face
 from insightface.utils import face_align
-from typing import List, Dict, Tuple, Optional, Any
+from typing import List, Dict, Tuple, Optional, Any, Union
 import logging
 import traceback
+from .face_quality import QualityGate, assess_face
+from .image_decode import read_image, scale_faces
 
 
 logger = logging.getLogger(__name__)
 
+# Índices dos 5 pontos do landmark_2d_106 usados no alinhamento
+ALIGN_LANDMARK_INDICES = [
+    1,   # Olho esquerdo
+    0,   # Olho direito
+    2,   # Nariz
+    14,  # Canto esquerdo da boca
+    18   # Canto direito da boca
+]
+
+# Número máximo de faces por chamada ao modelo de reconhecimento
+RECOGNITION_BATCH_SIZE = 32
+
+# Distância entre os olhos no modelo de alinhamento do ArcFace (recorte de 112 px)
+TEMPLATE_EYE_DISTANCE = float(face_align.arcface_dst[1, 0] - face_align.arcface_dst[0, 0])
+
+
+def align_from_landmarks(img: np.ndarray, landmarks_106, image_size: int = 112) -> np.ndarray:
+    """
+    Recorta e alinha uma face a partir dos landmarks de 106 pontos.
+
+    Args:
+        img: Imagem de entrada
+        landmarks_106: Landmarks de 106 pontos da face
+        image_size: Tamanho do recorte alinhado
+
+    Returns:
+        Imagem da face alinhada (image_size x image_size)
+    """
+    landmarks_106 = np.asarray(landmarks_106, dtype=np.float32)
+    key_landmarks = landmarks_106[ALIGN_LANDMARK_INDICES]
+    return face_align.norm_crop(img, landmark=key_landmarks, image_size=image_size)
+
+
+def recognition_crop(img: np.ndarray, kps, image_size: int = 112) -> np.ndarray:
+    """
+    Recorta a face exatamente como ela é enviada ao modelo de reconhecimento na ingestão:
+    alinhada pelos 5 pontos do detector, com os canais na ordem RGB.
+
+    Args:
+        img: Imagem de entrada (BGR)
+        kps: 5 pontos-chave da face (FaceProcessor.detect_faces)
+        image_size: Tamanho do recorte alinhado
+
+    Returns:
+        Recorte alinhado (image_size x image_size x 3, RGB)
+    """
+    crop = face_align.norm_crop(img, landmark=np.asarray(kps, dtype=np.float32), image_size=image_size)
+    # O alinhamento não mistura canais: recortar em BGR e inverter equivale a recortar em RGB
+    return np.ascontiguousarray(crop[:, :, ::-1])
+
+
+def needs_full_resolution(kps, scale: float, image_size: int = 112) -> bool:
+    """
+    Indica se uma face detectada em uma decodificação reduzida seria ampliada no recorte
+    alinhado: a distância entre os olhos na imagem reduzida é menor que a do modelo de
+    alinhamento. Nesse caso, o recorte e o embedding devem usar a resolução total.
+
+    Args:
+        kps: 5 pontos-chave da face, na resolução original
+        scale: Escala da resolução original em relação à imagem decodificada
+        image_size: Tamanho do recorte alinhado
+    """
+    if scale <= 1.0 or kps is None:
+        return False
+    kps = np.asarray(kps, dtype=np.float32)
+    reduced_distance = float(np.linalg.norm(kps[1] - kps[0])) / scale
+    return reduced_distance < TEMPLATE_EYE_DISTANCE * image_size / 112
+
 
 class FaceProcessor:
     """
     Classe para processar faces usando InsightFace.
     """
-    def __init__(self, model_path: str = None, det_size: Tuple[int, int] = (640, 640)):
+    def __init__(
+        self,
+        model_path: str = None,
+        det_size: Tuple[int, int] = (640, 640),
+        quality_gate: Optional[QualityGate] = None,
+        decode_target_size: int = 0
+    ):
         """
         Inicializa o processador de faces.
         
         Args:
             model_path: Caminho para os modelos pré-treinados (opcional)
             det_size: Tamanho da imagem para detecção
+            quality_gate: Limites de qualidade das faces (padrão: configurações QUALITY_*)
+            decode_target_size: Maior lado mínimo na decodificação reduzida de JPEGs (0 desativa)
         """
+        self.quality_gate = quality_gate or QualityGate.from_settings()
+        self.decode_target_size = decode_target_size
         # Inicializar o analisador de faces do InsightFace
         self.app = FaceAnalysis(name="buffalo_l", root=model_path)
         self.app.prepare(ctx_id=0, det_size=det_size)
         logger.info("Face processor initialized successfully")
 
 
+    def analyze_batch(
+        self,
+        images: List[np.ndarray],
+        gate_quality: Optional[List[bool]] = None,
+        scales: Optional[List[float]] = None
+    ) -> List[list]:
+        """
+        Executa o pipeline do InsightFace em várias imagens, agrupando o reconhecimento.
+
+        Equivale a chamar FaceAnalysis.get em cada imagem, mas os recortes de todas as
+        faces são enviados ao modelo de reconhecimento em lotes. A qualidade de cada face é
+        avaliada antes do reconhecimento; no modo "reject", as faces reprovadas das imagens
+        com gate_quality não são enviadas ao reconhecimento (ficam sem embedding).
+
+        Args:
+            images: Imagens já convertidas para RGB
+            gate_quality: Por imagem, se o modo "reject" se aplica (ingestão, não consultas)
+            scales: Por imagem, a escala da resolução original (decodificação reduzida)
+
+        Returns:
+            Lista (uma por imagem) de faces do InsightFace
+        """
+        recognition = self.app.models.get("recognition")
+        all_faces = []
+        crops = []
+        crop_faces = []
+
+        for image_index, img in enumerate(images):
+            gated = bool(gate_quality and gate_quality[image_index]) and self.quality_gate.rejects
+            bboxes, kpss = self.app.det_model.detect(img, max_num=0, metric="default")
+            faces = []
+            for i in range(bboxes.shape[0]):
+                face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+                for taskname, model in self.app.models.items():
+                    if taskname in ("detection", "recognition"):
+                        continue
+                    model.get(img, face)
+                if recognition is not None and face.kps is not None:
+                    crop = face_align.norm_crop(img, landmark=face.kps, image_size=recognition.input_size[0])
+                    if self.quality_gate.enabled:
+                        scale = scales[image_index] if scales else 1.0
+                        face.quality = assess_face(face.kps, face.det_score, crop, scale)
+                        face.quality_issues = self.quality_gate.issues(face.quality)
+                    # Face reprovada: o reconhecimento não é executado
+                    if not (gated and face.get("quality_issues")):
+                        crops.append(crop)
+                        crop_faces.append(face)
+                faces.append(face)
+            all_faces.append(faces)
+
+        # Reconhecimento em lotes
+        for start in range(0, len(crops), RECOGNITION_BATCH_SIZE):
+            embeddings = recognition.get_feat(crops[start:start + RECOGNITION_BATCH_SIZE])
+            for face, embedding in zip(crop_faces[start:start + RECOGNITION_BATCH_SIZE], embeddings):
+                face.embedding = embedding.flatten()
+
+        return all_faces
+
+    def embed_crops(self, crops: np.ndarray) -> np.ndarray:
+        """
+        Calcula os embeddings de recortes já alinhados (recognition_crop), sem detecção.
+
+        Args:
+            crops: Recortes alinhados (N x S x S x 3, RGB)
+
+        Returns:
+            Embeddings (N x D, float32)
+        """
+        recognition = self.app.models["recognition"]
+        embeddings = [
+            recognition.get_feat(list(crops[start:start + RECOGNITION_BATCH_SIZE]))
+            for start in range(0, len(crops), RECOGNITION_BATCH_SIZE)
+        ]
+        return np.vstack(embeddings).astype(np.float32)
+
+    @staticmethod
+    def face_to_dict(face) -> Dict[str, Any]:
+        """
+        Converte uma face do InsightFace no dicionário retornado por detect_faces.
+        """
+        return {
+            "bbox": face.bbox.astype(int).tolist(), # Bounding box
+            "landmarks": face.landmark_2d_106.astype(int).tolist() if face.get("landmark_2d_106") is not None else None,
+            "kps": face.kps.tolist() if face.get("kps") is not None else None, # 5 pontos usados no reconhecimento
+            "embedding": face.embedding.tolist() if face.get("embedding") is not None else None,
+            "score": float(face.det_score), # Score de confiança da detecção
+            "quality": face.get("quality"), # Medidas de qualidade (face_quality.assess_face)
+            "quality_issues": face.get("quality_issues") or [] # Critérios de qualidade não atendidos
+        }
+
+    def detect_faces_batch(
+        self,
+        images: List[np.ndarray],
+        gate_quality: Union[bool, List[bool]] = False,
+        scales: Optional[List[float]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Detecta faces em várias imagens já carregadas (BGR), em um único lote.
+        
+        Args:
+            images: Imagens no formato BGR do OpenCV
+            gate_quality: Aplicar a rejeição por qualidade (ingestão), para todas ou por imagem
+            scales: Por imagem, a escala da resolução original em relação à imagem decodificada;
+                as coordenadas retornadas ficam na resolução original
+            
+        Returns:
+            Lista (uma por imagem) de faces detectadas com suas informações
+        """
+        if isinstance(gate_quality, bool):
+            gate_quality = [gate_quality] * len(images)
+        scales = scales or [1.0] * len(images)
+        # Converter BGR para RGB (InsightFace espera RGB)
+        rgb_images = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in images]
+        return [
+            scale_faces([self.face_to_dict(face) for face in faces], scale)
+            for faces, scale in zip(self.analyze_batch(rgb_images, gate_quality, scales), scales)
+        ]
+
     def detect_faces(self, image_path: str) -> List[Dict[str, Any]]:
         """
         Detecta faces em uma imagem.
@@ -41,33 +240,14 @@ class FaceProcessor:
             Lista de faces detectadas com suas informações
         """
         try:
-            # Carregar a imagem
-            img = cv2.imread(image_path)
+            # Carregar a imagem (JPEGs grandes em resolução reduzida)
+            img, scale = read_image(image_path, self.decode_target_size)
             if img is None:
                 logger.error(f"Failed to load image: {image_path}")
                 return []
-                
-            # Converter BGR para RGB (InsightFace espera RGB)
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
             
-            # Detectar faces
-            faces = self.app.get(img)
-            
-            # Processar resultados
-            results = []
-            for face in faces:
-                # Extrair informações relevantes
-                bbox = face.bbox.astype(int).tolist() # Bounding box
-                landmarks = face.landmark_2d_106.astype(int).tolist() if face.landmark_2d_106 is not None else None
-                embedding = face.embedding.tolist() if face.embedding is not None else None
-                
-                result = {
-                    "bbox": bbox,
-                    "landmarks": landmarks,
-                    "embedding": embedding,
-                    "score": float(face.det_score) # Score de confiança da detecção
-                }
-                results.append(result)
+            # Detectar faces (coordenadas na resolução original)
+            results = self.detect_faces_batch([img], scales=[scale])[0]
                 
             logger.info(f"Detected {len(results)} faces in {image_path}")
             return results
@@ -146,30 +326,12 @@ class FaceProcessor:
             
             face = faces[0]
             
-            # Selecionar os 5 pontos principais para alinhamento
-            key_landmarks = [
-                face.landmark_2d_106[1],   # Olho esquerdo
-                face.landmark_2d_106[0],   # Olho direito
-                face.landmark_2d_106[2],   # Nariz
-                face.landmark_2d_106[14],  # Canto esquerdo da boca
-                face.landmark_2d_106[18]   # Canto direito da boca
-            ]
-            
-            # Converter para numpy array e garantir que sejam float32
-            key_landmarks = np.array(key_landmarks, dtype=np.float32)
-            
             try:
-                # Adicionar log para diagnóstico
-                logger.info(f"Landmark shape: {key_landmarks.shape}")
-                logger.info(f"Landmark type: {key_landmarks.dtype}")
-                logger.info(f"Landmark values:\n{key_landmarks}")
-                
                 # Usar apenas o primeiro valor da tupla de tamanho (que deve ser 112 ou 128)
                 image_size = size[0]
-                logger.info(f"Using image_size: {image_size}")
                 
-                # Usar os 5 landmarks para alinhamento
-                aligned = face_align.norm_crop(img, landmark=key_landmarks, image_size=image_size)
+                # Usar os 5 landmarks principais para alinhamento
+                aligned = align_from_landmarks(img, face.landmark_2d_106, image_size=image_size)
                 
                 # Salvar a imagem alinhada
                 os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -0,0 +1,111 @@
+"""
+Avaliação de qualidade das faces detectadas, calculada a partir da mesma passagem de
+detecção (score, 5 pontos e recorte alinhado) antes do reconhecimento.
+
+Medidas:
+    det_score: score de confiança da detecção
+    inter_ocular: distância entre os olhos, em pixels da imagem original
+    sharpness: variância do Laplaciano do recorte alinhado em tons de cinza
+    yaw/roll: pose estimada pelos 5 pontos (graus)
+
+No modo "flag" as faces abaixo dos limites são apenas sinalizadas; no modo "reject" elas
+não passam pelo reconhecimento e a imagem não é indexada.
+"""
+import math
+import logging
+import cv2
+import numpy as np
+from typing import Dict, List, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+QUALITY_MODES = ("off", "flag", "reject")
+
+
+class QualityGate(NamedTuple):
+    mode: str = "flag"  # off, flag ou reject
+    min_det_score: float = 0.6
+    min_inter_ocular: float = 20.0
+    min_sharpness: float = 20.0
+    max_yaw: float = 45.0
+
+    @classmethod
+    def from_settings(cls) -> "QualityGate":
+        from ..config import settings
+        mode = settings.QUALITY_GATE if settings.QUALITY_GATE in QUALITY_MODES else "flag"
+        return cls(
+            mode=mode,
+            min_det_score=settings.QUALITY_MIN_DET_SCORE,
+            min_inter_ocular=settings.QUALITY_MIN_INTER_OCULAR,
+            min_sharpness=settings.QUALITY_MIN_SHARPNESS,
+            max_yaw=settings.QUALITY_MAX_YAW
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    @property
+    def rejects(self) -> bool:
+        return self.mode == "reject"
+
+    def issues(self, quality: Dict[str, float]) -> List[str]:
+        """
+        Lista os critérios em que a face ficou abaixo dos limites.
+        """
+        issues = []
+        if quality["det_score"] < self.min_det_score:
+            issues.append("low_score")
+        if quality["inter_ocular"] < self.min_inter_ocular:
+            issues.append("small_face")
+        if quality["sharpness"] < self.min_sharpness:
+            issues.append("blur")
+        if abs(quality["yaw"]) > self.max_yaw:
+            issues.append("pose")
+        return issues
+
+
+def assess_face(kps, det_score: float, crop: np.ndarray, scale: float = 1.0) -> Dict[str, float]:
+    """
+    Calcula as medidas de qualidade de uma face.
+
+    Args:
+        kps: 5 pontos da face (olhos, nariz e cantos da boca)
+        det_score: Score de confiança da detecção
+        crop: Recorte alinhado da face (RGB)
+        scale: Escala da resolução original em relação à imagem decodificada
+
+    Returns:
+        Dicionário com det_score, inter_ocular, sharpness, yaw e roll
+    """
+    kps = np.asarray(kps, dtype=np.float32)
+    left_eye, right_eye, nose = kps[0], kps[1], kps[2]
+    eye_vector = right_eye - left_eye
+    inter_ocular = float(np.linalg.norm(eye_vector))
+
+    # Yaw: deslocamento do nariz em relação ao ponto médio dos olhos, ao longo do eixo dos olhos
+    yaw = 0.0
+    if inter_ocular > 0:
+        offset = float(np.dot(nose - (left_eye + right_eye) / 2, eye_vector / inter_ocular))
+        yaw = math.degrees(math.asin(max(-1.0, min(1.0, offset / (inter_ocular / 2)))))
+    roll = math.degrees(math.atan2(float(eye_vector[1]), float(eye_vector[0])))
+
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    return {
+        "det_score": float(det_score),
+        "inter_ocular": inter_ocular * scale,
+        "sharpness": sharpness,
+        "yaw": yaw,
+        "roll": roll
+    }
+
+
+def ingest_error(faces: List[Dict]) -> str:
+    """
+    Mensagem de falha de uma imagem sem face aproveitável na ingestão.
+    """
+    if faces and faces[0].get("quality_issues"):
+        return f"Face rejected by quality check: {', '.join(faces[0]['quality_issues'])}"
+    return "No face detected"
@@ -2,61 +2,160 @@ import os
 import numpy as np
 import faiss
 import pickle
-from typing import List, Dict, Tuple, Optional, Any
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Tuple, Optional, Any, Iterator
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Máximo de resultados extras pedidos ao índice principal para compensar tombstones;
+# acima disso a fusão é antecipada para removê-los fisicamente
+MAX_TOMBSTONE_OVERFETCH = 256
+
+
+class _ReadWriteLock:
+    """
+    Lock de leitura e escrita (com prioridade para a escrita): várias buscas leem o índice
+    principal em paralelo e a fusão no lugar o altera com acesso exclusivo.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
 class FaissIndex:
     """
     Classe para gerenciar o índice FAISS para busca eficiente de embeddings faciais.
+
+    O índice segue um desenho no estilo LSM: novos embeddings entram em um índice delta
+    plano (barato de atualizar), pesquisado junto com o índice principal, e uma fusão em
+    segundo plano incorpora o delta ao índice principal quando ele atinge o limite de
+    tamanho. Em índices planos a fusão acrescenta o delta diretamente ao índice principal
+    (custo proporcional ao delta); tipos que exigem treinamento ou reconstrução (IVF, HNSW)
+    são fundidos sobre uma cópia, trocada de forma atômica ao final. Remoções de embeddings
+    já incorporados são registradas como tombstones e aplicadas fisicamente na próxima fusão.
     """
-    def __init__(self, dimension: int = 512, index_type: str = "L2"):
+    def __init__(self, dimension: int = 512, index_type: str = "L2", delta_max_size: int = 10000):
         """
         Inicializa o índice FAISS.
         
         Args:
             dimension: Dimensão dos embeddings faciais
             index_type: Tipo de índice FAISS (L2, IVF, HNSW, etc.)
+            delta_max_size: Número de embeddings no delta que dispara a fusão com o índice principal
         """
         self.dimension = dimension
         self.index_type = index_type
-        self.index = None
+        self.delta_max_size = delta_max_size
+        self.index = None  # Índice principal (planos: só recebem acréscimos entre gerações)
+        self.delta = None  # Índice delta plano que recebe as inserções
+        self.merging_delta = None  # Delta congelado durante uma fusão (ainda pesquisável)
+        self.tombstones = set()  # IDs removidos que ainda estão fisicamente no índice principal
         self.id_map = {}  # Mapeia IDs FAISS para metadados (ID da pessoa, nome, etc.)
+        self.next_id = 0  # Próximo ID FAISS a ser atribuído (IDs nunca são reutilizados)
+        self.version = 0  # Incrementado a cada alteração do conteúdo do índice
+        self.generation = 0  # Incrementado quando o índice principal é substituído ou perde linhas
+        self._lock = threading.RLock()
+        self._main_lock = _ReadWriteLock()  # Buscas (leitura) x fusão no lugar (escrita)
+        self._merge_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_main = None  # (caminho, geração, linhas) do último índice principal gravado
         self.create_index()
         logger.info(f"FAISS index initialized with dimension {dimension} and type {index_type}")
     
     def create_index(self):
         """
         Cria um novo índice FAISS baseado no tipo especificado.
+
+        O índice base é envolvido por um IndexIDMap2, de forma que cada embedding
+        mantenha um ID estável mesmo após remoções (o ID é o valor gravado em
+        PersonImage.faiss_id).
+        """
+        self.index = faiss.IndexIDMap2(self._create_base_index())
+        self.delta = self._create_delta_index()
+        self.merging_delta = None
+        self.tombstones = set()
+        self.generation += 1
+        logger.info(f"Created FAISS index of type {self.index_type}")
+
+    def _create_base_index(self):
+        """
+        Cria o índice FAISS base (sem mapeamento de IDs) conforme o tipo configurado.
         """
         if self.index_type == "L2":
             # Índice simples de distância L2 (euclidiana)
-            self.index = faiss.IndexFlatL2(self.dimension)
+            return faiss.IndexFlatL2(self.dimension)
         elif self.index_type == "IVF":
-            # Índice IVF para busca mais rápida em grandes conjuntos de dados
+            # Índice IVF para busca mais rápida em grandes conjuntos de dados.
+            # O treinamento é feito na primeira fusão, com os embeddings reais.
             quantizer = faiss.IndexFlatL2(self.dimension)
             nlist = 100  # Número de clusters (ajuste conforme o tamanho do dataset)
-            self.index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_L2)
-            self.index.train(np.zeros((1, self.dimension), dtype=np.float32))  # Inicialização
+            return faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_L2)
         elif self.index_type == "HNSW":
             # Índice HNSW para busca ainda mais rápida
-            self.index = faiss.IndexHNSWFlat(self.dimension, 32)  # 32 é o número de vizinhos
+            return faiss.IndexHNSWFlat(self.dimension, 32)  # 32 é o número de vizinhos
         else:
             # Padrão para L2
-            self.index = faiss.IndexFlatL2(self.dimension)
-        
-        logger.info(f"Created FAISS index of type {self.index_type}")
+            return faiss.IndexFlatL2(self.dimension)
+
+    def _create_delta_index(self):
+        """
+        Cria o índice delta: plano, com IDs explícitos e inserção O(1).
+        """
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(self.dimension))
     
     def clear(self):
         """
         Limpa o índice FAISS, removendo todos os embeddings.
         """
-        # Recriar o índice
-        self.create_index()
-        # Limpar o mapa de IDs
-        self.id_map = {}
+        with self._merge_lock, self._lock:
+            # Recriar o índice
+            self.create_index()
+            # Limpar o mapa de IDs. next_id não volta a zero: IDs antigos continuam
+            # referenciados fora do índice (ex.: chaves do armazenamento de recortes)
+            self.id_map = {}
+            self.version += 1
         logger.info("FAISS index cleared")
+
+    def reserve_ids(self, next_id: int):
+        """
+        Garante que os próximos IDs atribuídos sejam maiores ou iguais a next_id (ex.: IDs
+        já usados como chaves de recortes, após a perda dos arquivos do índice).
+        """
+        with self._lock:
+            self.next_id = max(self.next_id, int(next_id))
     
     def add_embedding(self, embedding: np.ndarray, metadata: Dict[str, Any]) -> int:
         """
@@ -75,25 +174,36 @@ class FaissIndex:
         # Garantir que o embedding seja float32
         embedding = embedding.astype(np.float32)
         
-        # Obter o próximo ID disponível
-        next_id = self.index.ntotal
-        
-        # Adicionar o embedding ao índice
-        self.index.add(embedding)
-        
-        # Armazenar os metadados
-        self.id_map[next_id] = metadata
+        with self._lock:
+            # Obter o próximo ID disponível
+            next_id = self.next_id
+            self.next_id += 1
+            
+            # Adicionar o embedding ao índice delta
+            self.delta.add_with_ids(embedding, np.array([next_id], dtype=np.int64))
+            
+            # Armazenar os metadados
+            self.id_map[next_id] = metadata
+            self.version += 1
         
         logger.info(f"Added embedding with ID {next_id} to FAISS index")
+        self._maybe_start_merge()
         return next_id
     
-    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict[str, Any]]) -> List[int]:
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        metadatas: List[Dict[str, Any]],
+        ids: Optional[List[int]] = None
+    ) -> List[int]:
         """
         Adiciona múltiplos embeddings ao índice com seus metadados associados.
         
         Args:
             embeddings: Matriz de embeddings faciais
             metadatas: Lista de dicionários com metadados
+            ids: IDs FAISS já atribuídos (ex.: pelo coordenador de shards); se omitido,
+                novos IDs são gerados
             
         Returns:
             Lista de IDs dos embeddings no índice FAISS
@@ -104,23 +214,31 @@ class FaissIndex:
         # Garantir que os embeddings sejam float32
         embeddings = embeddings.astype(np.float32)
         
-        # Obter o próximo ID disponível
-        start_id = self.index.ntotal
-        
-        # Adicionar os embeddings ao índice
-        self.index.add(embeddings)
-        
-        # Armazenar os metadados
-        ids = list(range(start_id, start_id + len(embeddings)))
-        for i, id_val in enumerate(ids):
-            self.id_map[id_val] = metadatas[i]
+        with self._lock:
+            if ids is None:
+                # Obter o próximo ID disponível
+                start_id = self.next_id
+                ids = list(range(start_id, start_id + len(embeddings)))
+            self.next_id = max(self.next_id, max(ids, default=-1) + 1)
+            
+            # Adicionar os embeddings ao índice delta
+            self.delta.add_with_ids(embeddings, np.array(ids, dtype=np.int64))
+            
+            # Armazenar os metadados
+            for i, id_val in enumerate(ids):
+                self.id_map[id_val] = metadatas[i]
+            self.version += 1
         
         logger.info(f"Added {len(embeddings)} embeddings to FAISS index")
+        self._maybe_start_merge()
         return ids
     
     def search(self, query_embedding: np.ndarray, k: int = 5) -> Tuple[List[float], List[Dict[str, Any]]]:
         """
         Busca os k embeddings mais próximos ao embedding de consulta.
+
+        O índice principal e o(s) delta(s) são pesquisados e os resultados são
+        combinados pela distância.
         
         Args:
             query_embedding: Embedding facial de consulta
@@ -129,32 +247,429 @@ class FaissIndex:
         Returns:
             Tupla contendo (distâncias, metadados)
         """
+        return self.search_batch(np.asarray(query_embedding).reshape(1, -1), k)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int = 5) -> List[Tuple[List[float], List[Dict[str, Any]]]]:
+        """
+        Busca os k embeddings mais próximos de várias consultas em uma única chamada ao FAISS.
+
+        Args:
+            query_embeddings: Embeddings de consulta (N x D)
+            k: Número de resultados por consulta
+
+        Returns:
+            Lista (uma por consulta) de tuplas (distâncias, metadados)
+        """
+        # Garantir que os embeddings sejam float32
+        query_embedding = np.asarray(query_embeddings, dtype=np.float32)
         if query_embedding.ndim == 1:
             query_embedding = query_embedding.reshape(1, -1)
         
-        # Garantir que o embedding seja float32
-        query_embedding = query_embedding.astype(np.float32)
+        with self._lock:
+            main_index = self.index
+            tombstones = len(self.tombstones)
+            # Os deltas são pequenos e mutáveis: pesquisá-los sob o lock
+            candidates = [self.delta.search(query_embedding, k)]
+            if self.merging_delta is not None:
+                candidates.append(self.merging_delta.search(query_embedding, k))
+        
+        # O índice principal é pesquisado fora do lock das inserções; apenas a fusão no lugar
+        # (breve) o bloqueia. Buscar k + tombstones (limitado) compensa as remoções
+        # pendentes; o limite é mantido pela fusão antecipada em remove_ids.
+        with self._main_lock.reading():
+            if main_index.ntotal > 0:
+                candidates.append(main_index.search(query_embedding, k + min(tombstones, MAX_TOMBSTONE_OVERFETCH)))
+        
+        # Combinar os resultados de cada consulta pela distância
+        results = []
+        for row in range(len(query_embedding)):
+            merged = {}
+            for distances, indices in candidates:
+                for distance, idx in zip(distances[row].tolist(), indices[row].tolist()):
+                    # -1 indica que não foram encontrados k resultados
+                    if idx == -1 or idx not in self.id_map:
+                        continue
+                    if idx not in merged or distance < merged[idx]:
+                        merged[idx] = distance
+            best = sorted(merged.items(), key=lambda item: item[1])[:k]
+            results.append((
+                [distance for _, distance in best],
+                [self.id_map.get(idx) for idx, _ in best]
+            ))
+        
+        logger.info(f"Search completed for {len(results)} queries, found {sum(len(r[1]) for r in results)} matches")
+        return results
+    
+    def remove_ids(self, ids: List[int]) -> int:
+        """
+        Remove embeddings do índice a partir de seus IDs FAISS.
+
+        Embeddings ainda no delta são removidos imediatamente; os que já estão no índice
+        principal viram tombstones e são descartados fisicamente na próxima fusão.
+        
+        Args:
+            ids: Lista de IDs FAISS a remover
+            
+        Returns:
+            Número de embeddings removidos do índice
+        """
+        if len(ids) == 0:
+            return 0
+        
+        id_array = np.asarray(ids, dtype=np.int64)
         
-        # Buscar os k vizinhos mais próximos
-        distances, indices = self.index.search(query_embedding, k)
+        with self._lock:
+            self.delta.remove_ids(id_array)
+            
+            removed = 0
+            for id_val in id_array.tolist():
+                if self.id_map.pop(id_val, None) is None:
+                    continue
+                removed += 1
+                if not self._delta_contains(self.delta, id_val):
+                    self.tombstones.add(id_val)
+            self.version += 1
         
-        # Extrair os metadados correspondentes
-        distances = distances[0].tolist()
-        indices = indices[0].tolist()
+        logger.info(f"Removed {removed} embeddings from FAISS index ({len(id_array)} requested)")
+        self._maybe_start_merge()
+        return removed
+
+    @staticmethod
+    def _delta_contains(delta, id_val: int) -> bool:
+        """
+        Verifica se um ID está presente em um índice com IndexIDMap2.
+        """
+        try:
+            delta.reconstruct(int(id_val))
+            return True
+        except RuntimeError:
+            return False
+    
+    def get_metadata(self, faiss_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Retorna os metadados associados a um ID FAISS, ou None se o ID não existir.
+        """
+        return self.id_map.get(faiss_id)
+
+    def get_embeddings(self, ids: List[int]) -> Tuple[List[int], np.ndarray]:
+        """
+        Reconstrói os embeddings armazenados de alguns IDs (deltas e índice principal).
+        IDs removidos, inexistentes ou em índices que não permitem reconstrução são ignorados.
+
+        Returns:
+            Tupla contendo (IDs encontrados, matriz de embeddings)
+        """
+        with self._lock:
+            segments = [segment for segment in (self.delta, self.merging_delta, self.index) if segment is not None]
+            live_ids = [int(id_val) for id_val in ids if int(id_val) in self.id_map]
+
+        found = []
+        vectors = []
+        with self._main_lock.reading():
+            for id_val in live_ids:
+                for segment in segments:
+                    try:
+                        vectors.append(segment.reconstruct(id_val))
+                    except RuntimeError:
+                        continue
+                    found.append(id_val)
+                    break
+        if not vectors:
+            return [], np.zeros((0, self.dimension), dtype=np.float32)
+        return found, np.vstack(vectors).astype(np.float32)
+    
+    def get_ids(self) -> np.ndarray:
+        """
+        Retorna os IDs FAISS que possuem metadados no índice.
+        
+        Returns:
+            Array numpy (int64) ordenado com os IDs presentes
+        """
+        with self._lock:
+            ids = np.fromiter(self.id_map.keys(), dtype=np.int64, count=len(self.id_map))
+        return np.sort(ids)
+
+    def _maybe_start_merge(self):
+        """
+        Inicia a fusão do delta em segundo plano quando ele atinge o limite de tamanho.
+        """
+        pending = self.delta.ntotal >= self.delta_max_size or len(self.tombstones) >= MAX_TOMBSTONE_OVERFETCH
+        if not pending or self._merge_lock.locked():
+            return
+        threading.Thread(target=self.merge_delta, daemon=True).start()
+
+    def merge_delta(self) -> int:
+        """
+        Incorpora o delta ao índice principal e remove fisicamente os tombstones.
+
+        O delta atual é congelado (e continua sendo pesquisado) enquanto novas inserções vão
+        para um delta vazio. Em índices planos o delta é acrescentado ao índice principal no
+        lugar, com as buscas bloqueadas apenas durante a inserção (e a compactação, quando há
+        tombstones). Nos demais tipos a fusão é feita sobre uma cópia do índice principal,
+        que substitui o original ao final; nesse caso a memória do índice principal é
+        temporariamente duplicada.
         
-        metadatas = []
-        for idx in indices:
-            if idx != -1 and idx in self.id_map:  # -1 indica que não foram encontrados k resultados
-                metadatas.append(self.id_map[idx])
+        Returns:
+            Número de embeddings incorporados ao índice principal
+        """
+        if not self._merge_lock.acquire(blocking=False):
+            return 0
+        try:
+            with self._lock:
+                if self.delta.ntotal == 0 and not self.tombstones:
+                    return 0
+                frozen = self.delta
+                self.merging_delta = frozen
+                self.delta = self._create_delta_index()
+                purge_ids = set(self.tombstones)
+                main_index = self.index
+            
+            ids, vectors = self._get_vectors(frozen)
+            purge_array = np.fromiter(purge_ids, dtype=np.int64, count=len(purge_ids))
+            
+            if self._merges_in_place(main_index):
+                # O salvamento grava o índice principal sem o lock de leitura: não alterá-lo
+                # enquanto um salvamento estiver em andamento
+                with self._save_lock, self._main_lock.writing():
+                    if purge_ids:
+                        main_index.remove_ids(purge_array)
+                        with self._lock:
+                            # As posições mudaram: salvamento e snapshots regravam o índice inteiro
+                            self.generation += 1
+                    main_index.add_with_ids(vectors, ids)
+                    self._finish_merge(ids, purge_ids)
+                new_index = main_index
             else:
-                metadatas.append(None)
+                new_index = self._merge_into_copy(main_index, ids, vectors, purge_ids, purge_array)
+                if new_index is None:
+                    # Índice principal ainda não pode ser treinado: devolver os vetores ao delta
+                    with self._lock:
+                        self.delta.add_with_ids(vectors, ids)
+                        self.merging_delta = None
+                    return 0
+            
+            logger.info(f"Merged {len(ids)} delta embeddings into the main FAISS index ({new_index.ntotal} total)")
+            return len(ids)
+        finally:
+            self._merge_lock.release()
+
+    def _merge_into_copy(self, main_index, ids: np.ndarray, vectors: np.ndarray, purge_ids: set, purge_array: np.ndarray):
+        """
+        Fusão para índices que exigem treinamento ou reconstrução: aplica as remoções e o
+        delta sobre uma cópia do índice principal e a torna o novo índice principal.
+
+        Returns:
+            Novo índice principal, ou None se ele ainda não pode ser treinado
+        """
+        new_index = faiss.clone_index(main_index)
+        
+        # Aplicar fisicamente as remoções pendentes
+        if purge_ids:
+            try:
+                new_index.remove_ids(purge_array)
+            except RuntimeError:
+                # Índices sem remoção (ex.: HNSW): reconstruir sem os IDs removidos
+                new_index = self._rebuild_without(main_index, purge_array)
+                if new_index is None:
+                    logger.warning("FAISS index could not be rebuilt without removed IDs, keeping tombstones")
+                    new_index = faiss.clone_index(main_index)
+                    purge_ids = set()
+        
+        if not self._add_to_index(new_index, vectors, ids):
+            return None
         
-        logger.info(f"Search completed, found {len([m for m in metadatas if m is not None])} matches")
-        return distances, metadatas
+        with self._lock:
+            self.index = new_index
+            self.generation += 1
+            self._finish_merge(ids, purge_ids)
+        return new_index
+
+    def _finish_merge(self, ids: np.ndarray, purge_ids: set):
+        """
+        Descarta o delta congelado e atualiza os tombstones ao final de uma fusão.
+        """
+        with self._lock:
+            self.merging_delta = None
+            self.tombstones -= purge_ids
+            # IDs removidos durante a fusão já tinham sido congelados: virar tombstones
+            self.tombstones.update(id_val for id_val in ids.tolist() if id_val not in self.id_map)
+
+    @staticmethod
+    def _merges_in_place(index) -> bool:
+        """
+        Indica se a fusão pode alterar o índice principal no lugar (índices planos).
+        """
+        return isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+
+    def _main_tail_limit(self, rows: int) -> int:
+        """
+        Número de linhas acrescentadas ao índice principal a partir do qual o salvamento e
+        os snapshots o regravam por inteiro, em vez de gravar as novas linhas junto do delta.
+        O limite cresce com o índice, de modo que o custo das regravações é amortizado.
+        """
+        return max(self.delta_max_size, rows // 8)
+
+    def export_deltas(self, base_generation: Optional[int] = None, base_rows: int = 0) -> Dict[str, Any]:
+        """
+        Estado para a publicação incremental de snapshots, relativo a uma base já publicada
+        (as primeiras base_rows linhas do índice principal na geração base_generation).
+
+        Se a base ainda vale, as linhas acrescentadas ao índice principal desde então são
+        exportadas junto dos deltas; senão (outra geração ou muitas linhas novas), rebase é
+        True e os IDs do índice principal são exportados para que uma nova base seja gravada.
+
+        Returns:
+            Dicionário com generation, rebase, main_index, main_rows, main_ids (apenas no
+            rebase), delta_ids, delta_vectors, delta_metadatas e tombstones
+        """
+        while True:
+            with self._main_lock.reading():
+                with self._lock:
+                    main_index = self.index
+                    generation = self.generation
+                main_rows = main_index.ntotal
+                rebase = (
+                    generation != base_generation
+                    or main_rows < base_rows
+                    or main_rows - base_rows > self._main_tail_limit(base_rows)
+                )
+                main_ids = None
+                segments = []
+                if rebase:
+                    main_ids = faiss.vector_to_array(main_index.id_map).astype(np.int64)
+                elif main_rows > base_rows:
+                    segments.append(self._get_rows(main_index, base_rows, main_rows))
+                
+                # Os deltas são pequenos: copiá-los sob o lock, ainda com o índice principal
+                # bloqueado para que uma fusão no lugar não mova embeddings entre as leituras
+                with self._lock:
+                    if self.index is not main_index or self.generation != generation:
+                        # Fusão por cópia concluída no meio da leitura: recomeçar
+                        continue
+                    segments.append(self._get_vectors(self.delta))
+                    if self.merging_delta is not None:
+                        segments.append(self._get_vectors(self.merging_delta))
+                    ids = np.concatenate([part[0] for part in segments])
+                    vectors = np.vstack([part[1] for part in segments])
+                    # Descartar IDs removidos e duplicatas (fusão em andamento), ordenando por ID
+                    ids, positions = np.unique(ids, return_index=True)
+                    live = np.array([id_val in self.id_map for id_val in ids.tolist()], dtype=bool)
+                    ids = ids[live]
+                    return {
+                        "generation": generation,
+                        "rebase": rebase,
+                        "main_index": main_index,
+                        "main_rows": main_rows,
+                        "main_ids": main_ids,
+                        "delta_ids": ids,
+                        "delta_vectors": np.ascontiguousarray(vectors[positions[live]], dtype=np.float32),
+                        "delta_metadatas": [self.id_map[id_val] for id_val in ids.tolist()],
+                        "tombstones": np.array(sorted(self.tombstones), dtype=np.int64)
+                    }
+
+    def iter_main_vectors(
+        self,
+        main_index,
+        generation: int,
+        main_ids: np.ndarray,
+        chunk_size: int = 65536
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Percorre os embeddings das primeiras linhas de um índice principal (de export_deltas,
+        com rebase) em blocos ordenados por ID, sem reconstruir todos os vetores de uma vez
+        na memória. Cada bloco é lido com o índice bloqueado para fusões; fusões no lugar
+        só acrescentam linhas, que não afetam as já exportadas.
+
+        Yields:
+            Tuplas (IDs, vetores) de cada bloco
+
+        Raises:
+            RuntimeError: Se o índice principal foi substituído ou compactado no meio do percurso
+        """
+        base_index = faiss.downcast_index(main_index.index)
+        order = np.argsort(main_ids, kind="stable")
+        for start in range(0, len(order), chunk_size):
+            positions = order[start:start + chunk_size]
+            first = int(positions[0])
+            with self._main_lock.reading():
+                if self.index is not main_index or self.generation != generation:
+                    raise RuntimeError("Main FAISS index changed while its vectors were being exported")
+                if int(positions[-1]) - first + 1 == len(positions) and np.all(np.diff(positions) == 1):
+                    # Caso comum: IDs já em ordem de inserção
+                    vectors = base_index.reconstruct_n(first, len(positions))
+                else:
+                    vectors = np.vstack([base_index.reconstruct(int(position)) for position in positions])
+            yield main_ids[positions], np.asarray(vectors, dtype=np.float32)
+
+    def _rebuild_without(self, main_index, purge_ids: np.ndarray):
+        """
+        Reconstrói o índice principal sem os IDs informados, para tipos de índice que não
+        permitem remoção. O custo é o de reinserir todos os vetores, pago apenas na fusão.
+
+        Returns:
+            Novo índice, ou None se os vetores não puderam ser reconstruídos
+        """
+        try:
+            ids, vectors = self._get_vectors(main_index)
+        except RuntimeError as e:
+            logger.error(f"Failed to reconstruct FAISS vectors for rebuild: {str(e)}")
+            return None
+        keep = ~np.isin(ids, purge_ids)
+        new_index = faiss.IndexIDMap2(self._create_base_index())
+        if not self._add_to_index(new_index, np.ascontiguousarray(vectors[keep]), ids[keep]):
+            return None
+        logger.info(f"Rebuilt main FAISS index without {int((~keep).sum())} removed embeddings")
+        return new_index
+
+    @staticmethod
+    def _get_vectors(index) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Extrai IDs e vetores de um índice plano com IndexIDMap2.
+        """
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+        base_index = faiss.downcast_index(index.index)
+        vectors = base_index.reconstruct_n(0, base_index.ntotal) if len(ids) > 0 else np.zeros((0, index.d), dtype=np.float32)
+        return ids, vectors
+
+    @staticmethod
+    def _get_rows(index, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Extrai IDs e vetores das linhas [start, end) de um índice plano com IndexIDMap2.
+        """
+        if end <= start:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, index.d), dtype=np.float32)
+        ids = faiss.rev_swig_ptr(index.id_map.data(), index.id_map.size())[start:end].astype(np.int64)
+        vectors = faiss.downcast_index(index.index).reconstruct_n(start, end - start)
+        return ids, vectors
+
+    @staticmethod
+    def _add_to_index(index, vectors: np.ndarray, ids: np.ndarray) -> bool:
+        """
+        Adiciona vetores a um índice, treinando-o antes se necessário.
+
+        Returns:
+            False se o índice exige treinamento e não há vetores suficientes
+        """
+        if len(vectors) == 0:
+            return True
+        if not index.is_trained:
+            base_index = faiss.downcast_index(index.index)
+            nlist = getattr(base_index, "nlist", 1)
+            if len(vectors) < nlist:
+                return False
+            index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        return True
     
     def save(self, index_path: str, metadata_path: str):
         """
         Salva o índice FAISS e os metadados em arquivos.
+
+        O delta é salvo em um arquivo separado, ao lado do índice principal. O índice
+        principal só é regravado quando foi substituído ou compactado desde o último
+        salvamento (ou quando acumulou muitas linhas novas); as linhas acrescentadas por
+        fusões no lugar são gravadas junto do delta. Cada arquivo é gravado em um temporário
+        e substituído com os.replace, sem manter o lock do índice durante a gravação.
         
         Args:
             index_path: Caminho para salvar o índice FAISS
@@ -164,19 +679,76 @@ class FaissIndex:
         os.makedirs(os.path.dirname(index_path), exist_ok=True)
         os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
         
-        # Salvar o índice FAISS
-        faiss.write_index(self.index, index_path)
-        
-        # Salvar os metadados
-        with open(metadata_path, 'wb') as f:
-            pickle.dump({
-                'id_map': self.id_map,
-                'dimension': self.dimension,
-                'index_type': self.index_type
-            }, f)
+        with self._save_lock:
+            # Copiar o estado sob o lock: os deltas são pequenos e o índice principal não muda
+            # enquanto o _save_lock é mantido (as fusões no lugar esperam por ele)
+            with self._lock:
+                main_index = self.index
+                generation = self.generation
+                main_rows = main_index.ntotal
+                saved = self._saved_main
+                write_main = (
+                    saved is None
+                    or saved[:2] != (index_path, generation)
+                    or not os.path.exists(index_path)
+                    or main_rows - saved[2] > self._main_tail_limit(saved[2])
+                )
+                delta = self._create_delta_index()
+                for segment in (self.merging_delta, self.delta):
+                    if segment is not None:
+                        ids, vectors = self._get_vectors(segment)
+                        # IDs removidos durante uma fusão ainda estão no delta congelado
+                        live = np.array([id_val in self.id_map for id_val in ids.tolist()], dtype=bool)
+                        self._add_to_index(delta, np.ascontiguousarray(vectors[live]), ids[live])
+                metadata = pickle.dumps({
+                    'id_map': self.id_map,
+                    'next_id': self.next_id,
+                    'tombstones': self.tombstones,
+                    'dimension': self.dimension,
+                    'index_type': self.index_type
+                })
+                total_items = self.get_total_items()
+            
+            if write_main:
+                # Gravar o índice principal antes do delta e dos metadados que dependem dele
+                self._replace_file(index_path, lambda path: faiss.write_index(main_index, path))
+                self._saved_main = (index_path, generation, main_rows)
+            else:
+                # Linhas acrescentadas desde a última gravação do índice principal (incluindo
+                # tombstones, que continuam fisicamente no índice ao carregar)
+                tail_ids, tail_vectors = self._get_rows(main_index, saved[2], main_rows)
+                self._add_to_index(delta, np.ascontiguousarray(tail_vectors), tail_ids)
+            self._replace_file(self._delta_path(index_path), lambda path: faiss.write_index(delta, path))
+            self._replace_file(metadata_path, lambda path: self._write_bytes(path, metadata))
         
         logger.info(f"FAISS index saved to {index_path} and metadata to {metadata_path}")
-        logger.info(f"Saved index contains {self.index.ntotal} embeddings and {len(self.id_map)} metadata entries")
+        logger.info(f"Saved index contains {total_items} embeddings and {len(self.id_map)} metadata entries")
+
+    @staticmethod
+    def _replace_file(path: str, write):
+        """
+        Grava um arquivo por meio de um temporário no mesmo diretório e os.replace.
+        """
+        tmp_path = f"{path}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _write_bytes(path: str, data: bytes):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    @staticmethod
+    def _delta_path(index_path: str) -> str:
+        """
+        Retorna o caminho do arquivo do delta correspondente a um arquivo de índice.
+        """
+        base, ext = os.path.splitext(index_path)
+        return f"{base}_delta{ext}"
     
     def load(self, index_path: str, metadata_path: str):
         """
@@ -199,19 +771,47 @@ class FaissIndex:
                 logger.error(f"Arquivo de metadados FAISS não encontrado: {metadata_path}")
                 return False
             
-            # Carregar o índice FAISS
-            self.index = faiss.read_index(index_path)
-            
-            # Carregar os metadados
-            with open(metadata_path, 'rb') as f:
-                metadata = pickle.load(f)
-                self.id_map = metadata['id_map']
-                self.dimension = metadata['dimension']
-                self.index_type = metadata['index_type']
+            with self._merge_lock, self._lock:
+                # Carregar o índice FAISS
+                self.index = faiss.read_index(index_path)
+                delta_path = self._delta_path(index_path)
+                if os.path.exists(delta_path):
+                    self.delta = faiss.read_index(delta_path)
+                else:
+                    self.delta = self._create_delta_index()
+                self.merging_delta = None
+                
+                # Carregar os metadados
+                with open(metadata_path, 'rb') as f:
+                    metadata = pickle.load(f)
+                    self.id_map = metadata['id_map']
+                    self.tombstones = metadata.get('tombstones', set())
+                    self.dimension = metadata['dimension']
+                    self.index_type = metadata['index_type']
+                
+                # Índices salvos antes do uso de IDs explícitos usam a posição como ID
+                if not isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+                    self._migrate_sequential_index()
+                else:
+                    # Uma gravação interrompida após o índice principal pode deixar no delta
+                    # embeddings que a fusão já levou para ele
+                    main_ids = faiss.vector_to_array(self.index.id_map).astype(np.int64)
+                    delta_ids = faiss.vector_to_array(self.delta.id_map).astype(np.int64)
+                    duplicated = delta_ids[np.isin(delta_ids, main_ids)]
+                    if len(duplicated) > 0:
+                        self.delta.remove_ids(duplicated)
+                        logger.warning(f"Dropped {len(duplicated)} delta embeddings already in the main FAISS index")
+                
+                self.next_id = metadata.get('next_id', max(self.id_map.keys(), default=-1) + 1)
+                self.version += 1
+                self.generation += 1
+                # O índice principal carregado é o que está em index_path
+                self._saved_main = (index_path, self.generation, self.index.ntotal)
             
             logger.info(f"FAISS index loaded from {index_path} and metadata from {metadata_path}")
-            logger.info(f"Loaded index contains {self.index.ntotal} embeddings and {len(self.id_map)} metadata entries")
+            logger.info(f"Loaded index contains {self.get_total_items()} embeddings and {len(self.id_map)} metadata entries")
             
+            self._maybe_start_merge()
             return True
             
         except Exception as e:
@@ -221,6 +821,21 @@ class FaissIndex:
             self.id_map = {}
             return False
     
+    def _migrate_sequential_index(self):
+        """
+        Converte um índice legado (IDs sequenciais implícitos) para IndexIDMap2,
+        preservando os IDs já gravados em PersonImage.faiss_id. Os vetores vão para o
+        delta e são incorporados ao índice principal pela próxima fusão.
+        """
+        legacy_index = self.index
+        vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+        
+        self.index = faiss.IndexIDMap2(self._create_base_index())
+        if len(vectors) > 0:
+            self.delta.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        
+        logger.info(f"Migrated legacy FAISS index with {len(vectors)} embeddings to explicit IDs")
+    
     def get_total_items(self) -> int:
         """
         Retorna o número total de embeddings no índice.
@@ -228,4 +843,8 @@ class FaissIndex:
         Returns:
             Número total de embeddings
         """
-        return self.index.ntotal
\ No newline at end of file
+        with self._lock:
+            total = self.index.ntotal + self.delta.ntotal - len(self.tombstones)
+            if self.merging_delta is not None:
+                total += self.merging_delta.ntotal
+        return total
@@ -0,0 +1,601 @@
+"""
+Índice FAISS particionado (sharded) entre processos, com busca scatter-gather.
+
+Cada shard é um processo que possui seu próprio FaissIndex e seus próprios arquivos de
+índice, atendendo requisições por multiprocessing.connection (socket Unix local ou TCP).
+O coordenador (ShardedFaissIndex) expõe a mesma interface de FaissIndex: distribui os
+embeddings entre os shards, espalha as consultas para todos eles e combina os top-k.
+
+Um shard remoto pode ser iniciado em outro nó com:
+    FAISS_SHARD_AUTHKEY=<segredo> python -m app.core.faiss_shards --address 0.0.0.0:7001 --index-dir /dados/shard0
+
+O protocolo de multiprocessing.connection desserializa (pickle) as mensagens recebidas:
+quem se autentica pode executar código no processo. Por isso endereços TCP exigem uma
+chave secreta configurada, e shards locais usam sockets Unix com chave aleatória.
+"""
+import os
+import time
+import zlib
+import pickle
+import argparse
+import threading
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+from queue import Queue, Empty
+from typing import List, Dict, Tuple, Optional, Any, Union
+from .faiss_index import FaissIndex
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "faiss_index.bin"
+METADATA_FILENAME = "faiss_metadata.pkl"
+# Arquivo (permissão 0600) com a chave aleatória dos sockets Unix locais
+LOCAL_AUTHKEY_FILENAME = ".index_authkey"
+
+# Métodos do FaissIndex que podem ser chamados remotamente em um shard
+SHARD_METHODS = {
+    "add_embeddings",
+    "search",
+    "search_batch",
+    "get_embeddings",
+    "remove_ids",
+    "get_ids",
+    "get_metadata",
+    "get_total_items",
+    "merge_delta",
+    "clear",
+}
+
+# Chamadas que podem ser repetidas com segurança após uma conexão perdida: a requisição
+# pode ter sido executada pelo shard antes da falha, então alterações não são repetidas
+IDEMPOTENT_SHARD_METHODS = {
+    "search",
+    "search_batch",
+    "get_embeddings",
+    "get_ids",
+    "get_metadata",
+    "get_total_items",
+    "save",
+    "ping",
+}
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """
+    Converte um endereço "host:porta" em tupla TCP; qualquer outro valor é tratado
+    como caminho de socket Unix.
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return (host, int(port))
+    return address
+
+
+def check_authkey(address: str, authkey: Optional[bytes]):
+    """
+    Recusa endereços TCP sem chave secreta: as mensagens são desserializadas com pickle.
+    """
+    if not authkey and isinstance(parse_address(address), tuple):
+        raise ValueError(f"A secret authkey is required for TCP address {address}")
+
+
+def local_authkey(directory: str) -> bytes:
+    """
+    Chave aleatória compartilhada pelos processos locais (ex.: workers do uvicorn), criada
+    uma única vez em um arquivo legível apenas pelo usuário do serviço.
+    """
+    path = os.path.join(directory, LOCAL_AUTHKEY_FILENAME)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+        try:
+            # Publicação atômica: outro processo pode ter criado a chave antes
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class ShardServer:
+    """
+    Processo servidor de um shard: possui um FaissIndex e atende chamadas remotas.
+    """
+    def __init__(
+        self,
+        address: str,
+        authkey: bytes,
+        index_dir: str,
+        dimension: int = 512,
+        index_type: str = "L2",
+        delta_max_size: int = 10000,
+        faiss_index: Optional[FaissIndex] = None
+    ):
+        """
+        Inicializa o shard e carrega seu índice, se existir.
+
+        Args:
+            address: Endereço de escuta ("host:porta" ou caminho de socket Unix)
+            authkey: Chave de autenticação compartilhada com o coordenador
+            index_dir: Diretório com os arquivos de índice deste shard
+            dimension: Dimensão dos embeddings faciais
+            index_type: Tipo de índice FAISS
+            delta_max_size: Tamanho do delta que dispara a fusão
+            faiss_index: Índice já carregado a ser servido (em vez de carregar de index_dir)
+        """
+        check_authkey(address, authkey)
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.index_dir = index_dir
+        self.index_path = os.path.join(index_dir, INDEX_FILENAME)
+        self.metadata_path = os.path.join(index_dir, METADATA_FILENAME)
+        self.running = True
+
+        os.makedirs(index_dir, exist_ok=True)
+        if faiss_index is not None:
+            self.faiss_index = faiss_index
+        else:
+            self.faiss_index = FaissIndex(dimension=dimension, index_type=index_type, delta_max_size=delta_max_size)
+            if os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
+                self.faiss_index.load(self.index_path, self.metadata_path)
+
+    def serve_forever(self):
+        """
+        Aceita conexões e atende cada uma em uma thread até receber "shutdown".
+        """
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+        self.listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"FAISS shard listening on {self.address} with {self.faiss_index.get_total_items()} embeddings")
+
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                # Listener fechado pelo comando "shutdown"
+                break
+            except Exception as e:
+                logger.error(f"Error accepting shard connection: {str(e)}")
+                continue
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def stop(self):
+        """
+        Para de aceitar conexões (sem salvar o índice).
+        """
+        self.running = False
+        if hasattr(self, "listener"):
+            self.listener.close()
+
+    def _handle_connection(self, conn):
+        """
+        Atende as requisições de uma conexão: cada mensagem é (método, args, kwargs).
+        """
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    result = self._dispatch(method, args, kwargs)
+                    conn.send(("ok", result))
+                except Exception as e:
+                    logger.error(f"Error in shard call {method}: {str(e)}")
+                    conn.send(("error", str(e)))
+
+                if method == "shutdown":
+                    return
+
+    def _dispatch(self, method: str, args: tuple, kwargs: dict) -> Any:
+        """
+        Executa um método no índice do shard.
+        """
+        if method == "save":
+            self.faiss_index.save(self.index_path, self.metadata_path)
+            return True
+        if method == "shutdown":
+            self.faiss_index.save(self.index_path, self.metadata_path)
+            self.running = False
+            self.listener.close()
+            return True
+        if method == "ping":
+            return True
+        if method not in SHARD_METHODS:
+            raise ValueError(f"Unknown shard method: {method}")
+        return getattr(self.faiss_index, method)(*args, **kwargs)
+
+
+def run_shard_server(address: str, authkey: bytes, index_dir: str, dimension: int, index_type: str, delta_max_size: int):
+    """
+    Ponto de entrada de um processo de shard.
+    """
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ShardServer(address, authkey, index_dir, dimension, index_type, delta_max_size).serve_forever()
+
+
+class ShardClient:
+    """
+    Cliente de um shard com um pool de conexões reutilizáveis (uma por chamada simultânea).
+    """
+    def __init__(self, address: str, authkey: bytes):
+        check_authkey(address, authkey)
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._pool: Queue = Queue()
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        """
+        Executa um método remoto no shard. Em caso de conexão perdida, apenas chamadas
+        idempotentes (IDEMPOTENT_SHARD_METHODS) são repetidas, uma vez, em nova conexão.
+        """
+        attempts = 2 if method in IDEMPOTENT_SHARD_METHODS else 1
+        for attempt in range(attempts):
+            conn = self._connection()
+            try:
+                conn.send((method, args, kwargs))
+                status, result = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                if attempt + 1 < attempts:
+                    continue
+                raise
+
+            self._pool.put(conn)
+            if status == "error":
+                raise RuntimeError(f"Shard {self.address} failed on {method}: {result}")
+            return result
+
+    def _connection(self):
+        """
+        Retira uma conexão do pool, descartando as fechadas pelo shard enquanto estavam
+        ociosas (o shard nunca envia dados sem uma requisição), ou abre uma nova.
+        """
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except Empty:
+                return Client(self.address, authkey=self.authkey)
+            try:
+                if not conn.poll():
+                    return conn
+            except (EOFError, OSError):
+                pass
+            conn.close()
+
+    def wait_ready(self, timeout: float = 60.0):
+        """
+        Aguarda até que o shard aceite conexões.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.call("ping")
+            except (OSError, EOFError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def close(self):
+        """
+        Fecha as conexões do pool.
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except Empty:
+                return
+
+
+class ShardedFaissIndex:
+    """
+    Coordenador de um índice FAISS particionado entre vários shards.
+
+    Os IDs FAISS são atribuídos pelo coordenador (continuam globais e estáveis) e cada
+    embedding é enviado a um shard escolhido pelo hash do ID ou da origem. As buscas são
+    enviadas em paralelo a todos os shards e os top-k são combinados pela distância.
+    """
+    def __init__(
+        self,
+        shard_addresses: List[str],
+        authkey: bytes,
+        shard_key: str = "id",
+        processes: Optional[List[multiprocessing.Process]] = None,
+        dimension: int = 512
+    ):
+        """
+        Inicializa o coordenador.
+
+        Args:
+            shard_addresses: Endereços dos shards
+            authkey: Chave de autenticação compartilhada com os shards
+            shard_key: Critério de particionamento ("id" ou "origin")
+            processes: Processos locais dos shards (encerrados por close())
+            dimension: Dimensão dos embeddings
+        """
+        self.shards = [ShardClient(address, authkey) for address in shard_addresses]
+        self.dimension = dimension
+        self.shard_key = shard_key
+        self.processes = processes or []
+        self.next_id = 0
+        self.version = 0  # Incrementado a cada alteração feita por este coordenador
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards))
+
+        for shard in self.shards:
+            shard.wait_ready()
+        logger.info(f"Sharded FAISS index initialized with {len(self.shards)} shards (key: {shard_key})")
+
+    @classmethod
+    def start_local(
+        cls,
+        num_shards: int,
+        base_dir: str,
+        authkey: Optional[bytes] = None,
+        dimension: int = 512,
+        index_type: str = "L2",
+        delta_max_size: int = 10000,
+        shard_key: str = "id"
+    ) -> "ShardedFaissIndex":
+        """
+        Inicia shards como processos locais (sockets Unix em base_dir) e retorna o coordenador.
+        Sem authkey, uma chave aleatória é gerada e passada aos processos filhos.
+        """
+        authkey = authkey or os.urandom(32)
+        context = multiprocessing.get_context("spawn")
+        addresses = []
+        processes = []
+        for shard_num in range(num_shards):
+            index_dir = os.path.join(base_dir, f"shard_{shard_num}")
+            address = os.path.join(base_dir, f"shard_{shard_num}.sock")
+            process = context.Process(
+                target=run_shard_server,
+                args=(address, authkey, index_dir, dimension, index_type, delta_max_size),
+                daemon=True
+            )
+            process.start()
+            addresses.append(address)
+            processes.append(process)
+
+        return cls(addresses, authkey, shard_key=shard_key, processes=processes, dimension=dimension)
+
+    def _shard_for(self, faiss_id: int, metadata: Dict[str, Any]) -> int:
+        """
+        Escolhe o shard de um embedding.
+        """
+        if self.shard_key == "origin":
+            origin = (metadata or {}).get("origin", "")
+            return zlib.crc32(origin.encode("utf-8")) % len(self.shards)
+        return faiss_id % len(self.shards)
+
+    def _scatter(self, method: str, *args, **kwargs) -> List[Any]:
+        """
+        Chama o mesmo método em todos os shards em paralelo.
+        """
+        futures = [self._executor.submit(shard.call, method, *args, **kwargs) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    def clear(self):
+        """
+        Limpa todos os shards.
+        """
+        self._scatter("clear")
+        with self._lock:
+            # next_id não volta a zero: IDs antigos continuam referenciados fora do índice
+            self.version += 1
+
+    def reserve_ids(self, next_id: int):
+        """
+        Garante que os próximos IDs atribuídos sejam maiores ou iguais a next_id.
+        """
+        with self._lock:
+            self.next_id = max(self.next_id, int(next_id))
+
+    def add_embedding(self, embedding: np.ndarray, metadata: Dict[str, Any]) -> int:
+        """
+        Adiciona um embedding ao shard correspondente.
+        """
+        if embedding.ndim == 1:
+            embedding = embedding.reshape(1, -1)
+        return self.add_embeddings(embedding, [metadata])[0]
+
+    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict[str, Any]]) -> List[int]:
+        """
+        Atribui IDs globais e distribui os embeddings entre os shards.
+        """
+        if len(embeddings) != len(metadatas):
+            raise ValueError("Number of embeddings and metadatas must match")
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        with self._lock:
+            start_id = self.next_id
+            self.next_id += len(embeddings)
+        ids = list(range(start_id, start_id + len(embeddings)))
+
+        by_shard: Dict[int, List[int]] = {}
+        for position, (faiss_id, metadata) in enumerate(zip(ids, metadatas)):
+            by_shard.setdefault(self._shard_for(faiss_id, metadata), []).append(position)
+
+        futures = [
+            self._executor.submit(
+                self.shards[shard_num].call,
+                "add_embeddings",
+                embeddings[positions],
+                [metadatas[p] for p in positions],
+                ids=[ids[p] for p in positions]
+            )
+            for shard_num, positions in by_shard.items()
+        ]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            with self._lock:
+                self.version += 1
+
+        logger.info(f"Added {len(ids)} embeddings to {len(by_shard)} FAISS shards")
+        return ids
+
+    def search(self, query_embedding: np.ndarray, k: int = 5) -> Tuple[List[float], List[Dict[str, Any]]]:
+        """
+        Busca em todos os shards em paralelo e combina os k resultados mais próximos.
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        merged = []
+        for distances, metadatas in self._scatter("search", query_embedding, k):
+            merged.extend(zip(distances, metadatas))
+        merged.sort(key=lambda item: item[0])
+        merged = merged[:k]
+        return [distance for distance, _ in merged], [metadata for _, metadata in merged]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int = 5) -> List[Tuple[List[float], List[Dict[str, Any]]]]:
+        """
+        Busca várias consultas em todos os shards (uma chamada por shard) e combina os
+        k resultados mais próximos de cada consulta.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        merged = [[] for _ in range(len(query_embeddings))]
+        for shard_results in self._scatter("search_batch", query_embeddings, k):
+            for row, (distances, metadatas) in enumerate(shard_results):
+                merged[row].extend(zip(distances, metadatas))
+        results = []
+        for candidates in merged:
+            candidates.sort(key=lambda item: item[0])
+            candidates = candidates[:k]
+            results.append(([distance for distance, _ in candidates], [metadata for _, metadata in candidates]))
+        return results
+
+    def remove_ids(self, ids: List[int]) -> int:
+        """
+        Remove IDs de todos os shards (cada shard ignora os IDs que não possui).
+        """
+        ids = [int(faiss_id) for faiss_id in ids]
+        if not ids:
+            return 0
+        try:
+            return sum(self._scatter("remove_ids", ids))
+        finally:
+            with self._lock:
+                self.version += 1
+
+    def get_metadata(self, faiss_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Retorna os metadados de um ID FAISS.
+        """
+        if self.shard_key == "id":
+            return self.shards[faiss_id % len(self.shards)].call("get_metadata", faiss_id)
+        for metadata in self._scatter("get_metadata", faiss_id):
+            if metadata is not None:
+                return metadata
+        return None
+
+    def get_embeddings(self, ids: List[int]) -> Tuple[List[int], np.ndarray]:
+        """
+        Reconstrói os embeddings de alguns IDs a partir dos shards que os possuem.
+        """
+        ids = [int(faiss_id) for faiss_id in ids]
+        found = []
+        vectors = []
+        for shard_found, shard_vectors in self._scatter("get_embeddings", ids):
+            found.extend(shard_found)
+            if len(shard_found):
+                vectors.append(np.asarray(shard_vectors, dtype=np.float32))
+        if not vectors:
+            return [], np.empty((0, self.dimension), dtype=np.float32)
+        return found, np.vstack(vectors)
+
+    def get_ids(self) -> np.ndarray:
+        """
+        Retorna os IDs FAISS de todos os shards, ordenados.
+        """
+        return np.sort(np.concatenate([np.asarray(ids, dtype=np.int64) for ids in self._scatter("get_ids")]))
+
+    def merge_delta(self) -> int:
+        """
+        Força a fusão do delta em todos os shards.
+        """
+        return sum(self._scatter("merge_delta"))
+
+    def save(self, index_path: str, metadata_path: str):
+        """
+        Pede a cada shard que salve seu índice e grava o estado do coordenador em metadata_path.
+        """
+        self._scatter("save")
+        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+        with open(metadata_path, 'wb') as f:
+            pickle.dump({
+                'sharded': True,
+                'next_id': self.next_id,
+                'num_shards': len(self.shards),
+                'shard_key': self.shard_key
+            }, f)
+        logger.info(f"Sharded FAISS index saved ({len(self.shards)} shards), coordinator metadata at {metadata_path}")
+
+    def load(self, index_path: str, metadata_path: str) -> bool:
+        """
+        Carrega o estado do coordenador; cada shard carrega seus próprios arquivos ao iniciar.
+        """
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'rb') as f:
+                metadata = pickle.load(f)
+            if metadata.get('sharded') and metadata.get('num_shards') != len(self.shards):
+                logger.warning(
+                    f"Coordinator metadata was written for {metadata.get('num_shards')} shards, "
+                    f"running with {len(self.shards)}: embeddings will not be redistributed"
+                )
+            if metadata.get('sharded'):
+                self.next_id = metadata.get('next_id', 0)
+
+        # Garantir que novos IDs não colidam com os já presentes nos shards
+        ids = self.get_ids()
+        if len(ids) > 0:
+            self.next_id = max(self.next_id, int(ids[-1]) + 1)
+        with self._lock:
+            self.version += 1
+        return True
+
+    def get_total_items(self) -> int:
+        """
+        Retorna o número total de embeddings em todos os shards.
+        """
+        return sum(self._scatter("get_total_items"))
+
+    def close(self):
+        """
+        Encerra os shards locais (salvando seus índices) e fecha as conexões.
+        """
+        if self.processes:
+            try:
+                self._scatter("shutdown")
+            except Exception as e:
+                logger.error(f"Error shutting down FAISS shards: {str(e)}")
+            for process in self.processes:
+                process.join(timeout=30)
+        for shard in self.shards:
+            shard.close()
+        self._executor.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor de shard do índice FAISS")
+    parser.add_argument("--address", required=True, help="host:porta ou caminho de socket Unix")
+    parser.add_argument("--index-dir", required=True, help="Diretório dos arquivos de índice do shard")
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--index-type", default="L2")
+    parser.add_argument("--delta-max-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    authkey = os.getenv("FAISS_SHARD_AUTHKEY", "").encode("utf-8")
+    if not authkey:
+        parser.error("FAISS_SHARD_AUTHKEY must be set to a secret shared with the coordinator")
+    run_shard_server(args.address, authkey, args.index_dir, args.dimension, args.index_type, args.delta_max_size)
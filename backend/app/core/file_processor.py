@@ -1,13 +1,20 @@
 import os
 import re
-import shutil
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Callable
 import logging
 from datetime import datetime
-import concurrent.futures
-from pathlib import Path
-from .face_processor import FaceProcessor
+import numpy as np
+from .face_processor import FaceProcessor, recognition_crop, needs_full_resolution
 from .faiss_index import FaissIndex
+from .ingest_pipeline import IngestPipeline
+from .directory_scanner import scan_images
+from .image_store import content_digest, content_filename, resolve_filename, store_file
+from .crop_store import CropStore, CROPS_DIRNAME
+from .embedding_cache import EmbeddingCache, EMBEDDING_CACHE_DIRNAME
+from .search_cache import SearchCache, QueryHandleStore, QUERY_HANDLES_DIRNAME
+from .face_quality import QualityGate, ingest_error
+from .thumbnails import thumbnail_path, write_thumbnail
+from .image_decode import NORMALIZED_FORMATS, decode_image, read_image, fit_long_edge, encode_image
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +27,18 @@ class FileProcessor:
         upload_dir: str,
         processed_dir: str,
         face_processor: FaceProcessor,
-        faiss_index: FaissIndex
+        faiss_index: FaissIndex,
+        file_placement: str = "auto",
+        embedding_cache: bool = True,
+        search_cache_size: int = 1024,
+        search_cache_ttl: float = 600.0,
+        query_handle_ttl: float = 1800.0,
+        search_filter_fetch_factor: int = 16,
+        decode_target_size: int = 0,
+        image_normalization: str = "off",
+        normalize_max_side: int = 2048,
+        normalize_quality: int = 90,
+        thumbnail_sizes: Tuple[int, ...] = ()
     ):
         """Inicializa o processador de arquivos.
         Args:
@@ -28,11 +46,45 @@ class FileProcessor:
             processed_dir: Diretório para imagens processadas
             face_processor: Instância do processador de faces
             faiss_index: Instância do índice FAISS
+            file_placement: Estratégia de colocação das imagens processadas (ver image_store.place_file)
+            embedding_cache: Reaproveitar a detecção/embedding de imagens com o mesmo conteúdo
+            search_cache_size: Entradas dos caches de consultas e de resultados (0 desativa)
+            search_cache_ttl: Tempo de vida (em segundos) das entradas desses caches
+            query_handle_ttl: Tempo de vida (em segundos) dos identificadores de consulta
+            search_filter_fetch_factor: Candidatos examinados por resultado pedido em buscas com filtros
+            decode_target_size: Maior lado mínimo na decodificação reduzida de JPEGs (0 desativa)
+            image_normalization: Regravar as imagens processadas em "jpeg" ou "webp" ("off" mantém o original)
+            normalize_max_side: Maior lado das imagens normalizadas (0 = sem limite)
+            normalize_quality: Qualidade do codificador das imagens normalizadas
+            thumbnail_sizes: Tamanhos das miniaturas geradas na ingestão (vazio = sob demanda)
         """
         self.upload_dir = upload_dir
         self.processed_dir = processed_dir
         self.face_processor = face_processor
         self.faiss_index = faiss_index
+        self.file_placement = file_placement
+        self.decode_target_size = decode_target_size
+        self.image_normalization = image_normalization if image_normalization in NORMALIZED_FORMATS else "off"
+        self.normalize_max_side = normalize_max_side
+        self.normalize_quality = normalize_quality
+        self.thumbnail_sizes = thumbnail_sizes
+        self.search_filter_fetch_factor = max(1, search_filter_fetch_factor)
+        # Recortes alinhados em um único arquivo compactado, indexado pelo faiss_id
+        self.crop_store = CropStore(os.path.join(processed_dir, CROPS_DIRNAME))
+        # Um faiss_id com recorte nunca é reatribuído, mesmo se os arquivos do índice se perderam
+        # (leitores do índice compartilhado não atribuem IDs)
+        reserve_ids = getattr(faiss_index, "reserve_ids", None)
+        if reserve_ids is not None:
+            reserve_ids(self.crop_store.max_key() + 1)
+        self.embedding_cache = (
+            EmbeddingCache(os.path.join(processed_dir, EMBEDDING_CACHE_DIRNAME)) if embedding_cache else None
+        )
+        # Limites de qualidade aplicados também às faces em cache (o cliente remoto não os possui)
+        self.quality_gate = getattr(face_processor, "quality_gate", None) or QualityGate.from_settings()
+        self.search_cache = SearchCache(search_cache_size, search_cache_ttl)
+        self.query_handles = QueryHandleStore(
+            os.path.join(upload_dir, "temp", QUERY_HANDLES_DIRNAME), query_handle_ttl, search_cache_size
+        )
 
         # Mapa de origens completo com todos os órgãos disponíveis
         self.origin_map = {
@@ -125,12 +177,240 @@ class FileProcessor:
                 "error": str(e)
             }
 
-    def process_image(self, image_path: str) -> Dict[str, Any]:
+    def save_index(self):
+        """Salva o índice FAISS e os metadados no diretório de processados."""
+        index_path = os.path.join(self.processed_dir, "faiss_index.bin")
+        metadata_path = os.path.join(self.processed_dir, "faiss_metadata.pkl")
+        self.faiss_index.save(index_path, metadata_path)
+
+    def normalized_content(
+        self,
+        img: np.ndarray,
+        scale: float,
+        image_path: str,
+        data: Optional[bytes] = None
+    ) -> Optional[Tuple[bytes, str]]:
+        """Conteúdo normalizado de uma imagem para o armazenamento: orientação EXIF aplicada,
+        maior lado limitado a normalize_max_side e codificação em JPEG/WebP.
+
+        A imagem já decodificada para a detecção é reaproveitada quando tem resolução
+        suficiente; caso contrário, o original é decodificado de novo (em resolução reduzida
+        até o limite). O original é mantido quando não precisa ser reduzido e a nova
+        codificação não o deixaria menor.
+
+        Args:
+            img: Imagem decodificada para a detecção (BGR)
+            scale: Escala da resolução original em relação a img
+            image_path: Caminho da imagem original
+            data: Conteúdo do arquivo, se já em memória
+
+        Returns:
+            (conteúdo, extensão), ou None para gravar o original sem alterações
+        """
+        if self.image_normalization == "off":
+            return None
+        if data is None:
+            with open(image_path, "rb") as f:
+                data = f.read()
+
+        decoded_side = max(img.shape[:2])
+        original_side = decoded_side * scale
+        limit = self.normalize_max_side if self.normalize_max_side > 0 else original_side
+        if decoded_side < min(limit, original_side):
+            img, _ = decode_image(data, self.normalize_max_side)
+            if img is None:
+                return None
+
+        content = encode_image(
+            fit_long_edge(img, self.normalize_max_side), self.image_normalization, self.normalize_quality
+        )
+        if original_side <= limit and len(content) >= len(data):
+            return None
+        return content, NORMALIZED_FORMATS[self.image_normalization][0]
+
+    def persist_face(
+        self,
+        image_path: str,
+        file_info: Dict[str, Any],
+        img: np.ndarray,
+        face: Dict[str, Any],
+        data: Optional[bytes] = None,
+        digest: Optional[str] = None,
+        scale: float = 1.0
+    ) -> Dict[str, Any]:
+        """Persiste uma face já detectada: grava a imagem (normalizada, se configurado) no
+        armazenamento endereçado por conteúdo do diretório de processados, adiciona o
+        embedding ao índice FAISS e anexa o recorte alinhado ao armazenamento compactado de
+        recortes (chave: faiss_id). O nome do arquivo e o content_hash usam o hash do original.
+
+        Args:
+            image_path: Caminho da imagem original
+            file_info: Informações extraídas do nome do arquivo (parse_filename)
+            img: Imagem decodificada (BGR), possivelmente em resolução reduzida
+            face: Face detectada (formato de FaceProcessor.detect_faces, coordenadas na resolução original)
+            data: Conteúdo do arquivo, quando a imagem não está no disco (ex.: membro de um zip/tar)
+            digest: SHA-256 do conteúdo, se já calculado na leitura
+            scale: Escala da resolução original em relação a img (ver image_decode.decode_image)
+
+        Returns:
+            Dicionário com os resultados do processamento
+        """
+        original_filename = file_info["filename"]
+        img, scale = self.realign_full_resolution(img, scale, face, image_path, data)
+        embedding = np.array(face["embedding"], dtype=np.float32)
+
+        # Nome e caminho endereçados pelo conteúdo (sem colisões entre lotes paralelos)
+        if digest is None:
+            digest = content_digest(path=image_path, data=data)
+        normalized = self.normalized_content(img, scale, image_path, data)
+        if normalized is not None:
+            content, extension = normalized
+            unique_filename = content_filename(digest, original_filename, extension)
+            processed_path = resolve_filename(self.processed_dir, unique_filename)
+            store_file(processed_path, data=content)
+        else:
+            unique_filename = content_filename(digest, original_filename)
+            processed_path = resolve_filename(self.processed_dir, unique_filename)
+            store_file(processed_path, source_path=image_path, data=data, strategy=self.file_placement)
+
+        # Miniaturas a partir da imagem já decodificada (ao menos DECODE_TARGET_SIZE de lado)
+        for size in self.thumbnail_sizes:
+            write_thumbnail(img, thumbnail_path(self.processed_dir, unique_filename, size), size)
+
+        # Criar metadados para o índice FAISS
+        metadata = {
+            "person_id": file_info["person_id"],
+            "cpf": file_info["cpf"],
+            "person_name": file_info["person_name"],
+            "origin": file_info["origin"],
+            "filename": unique_filename,
+            "original_filename": original_filename,
+            "processed_date": datetime.now().isoformat()
+        }
+
+        # Adicionar embedding ao índice FAISS
+        faiss_id = self.faiss_index.add_embedding(embedding, metadata)
+
+        # Recorte alinhado pelos pontos já detectados, igual à entrada do reconhecimento
+        if face.get("kps") is not None:
+            kps = np.asarray(face["kps"], dtype=np.float32) / scale
+            self.crop_store.append(faiss_id, recognition_crop(img, kps))
+
+        if self.embedding_cache is not None:
+            self.embedding_cache.put(digest, face)
+
+        logger.info(f"Successfully processed {original_filename} as {unique_filename}, FAISS ID: {faiss_id}")
+
+        return {
+            "success": True,
+            "filename": unique_filename,
+            "file_path": processed_path,
+            "content_hash": digest,
+            "original_filename": original_filename,
+            "source_path": image_path,
+            "person_id": file_info["person_id"],
+            "cpf": file_info["cpf"],
+            "person_name": file_info["person_name"],
+            "origin": file_info["origin"],
+            "faiss_id": faiss_id,
+            "quality_issues": face.get("quality_issues") or [],
+            # Com a estratégia "move", a origem é removida após o registro no banco
+            "move_source": self.file_placement == "move"
+        }
+
+    def realign_full_resolution(
+        self,
+        img: np.ndarray,
+        scale: float,
+        face: Dict[str, Any],
+        image_path: str,
+        data: Optional[bytes] = None
+    ) -> Tuple[np.ndarray, float]:
+        """
+        Refaz o alinhamento e o embedding de uma face pequena na resolução total.
+
+        A detecção na decodificação reduzida localiza bem a face, mas quando a distância entre
+        os olhos na imagem reduzida é menor que a do recorte de 112 px, o recorte seria
+        ampliado (perdendo detalhe). Nesse caso o original é decodificado em resolução total,
+        o recorte é refeito com os pontos já detectados e o embedding é recalculado (sem
+        nova detecção). O embedding da face é substituído.
+
+        Args:
+            img: Imagem decodificada para a detecção (BGR)
+            scale: Escala da resolução original em relação a img
+            face: Face detectada (coordenadas na resolução original)
+            image_path: Caminho da imagem original
+            data: Conteúdo do arquivo, se já em memória
+
+        Returns:
+            Imagem e escala a usar no restante da persistência (a original, se não mudou)
+        """
+        return self.realign_faces_full_resolution(img, scale, [face], image_path, data)
+
+    def realign_faces_full_resolution(
+        self,
+        img: np.ndarray,
+        scale: float,
+        faces: List[Dict[str, Any]],
+        image_path: str,
+        data: Optional[bytes] = None
+    ) -> Tuple[np.ndarray, float]:
+        """
+        Como realign_full_resolution, para todas as faces pequenas de uma imagem (ex.: fotos
+        de grupo): o original é decodificado uma vez e os recortes vão em um único lote.
+
+        Returns:
+            Imagem e escala em resolução total, ou as recebidas se nenhuma face foi realinhada
+        """
+        small = [face for face in faces if needs_full_resolution(face.get("kps"), scale)]
+        if not small:
+            return img, scale
+        if data is None:
+            with open(image_path, "rb") as f:
+                data = f.read()
+        full_img, full_scale = decode_image(data)
+        if full_img is None:
+            return img, scale
+
+        crops = np.stack([recognition_crop(full_img, face["kps"]) for face in small])
+        for face, embedding in zip(small, self.face_processor.embed_crops(crops)):
+            face["embedding"] = embedding.tolist()
+        logger.debug(f"Realigned {len(small)} small faces in {image_path} at full resolution")
+        return full_img, full_scale
+
+    def cached_face(self, digest: str, gate_quality: bool = False) -> Optional[Dict[str, Any]]:
+        """Retorna a face já detectada em uma imagem com o mesmo conteúdo, se houver.
+
+        Args:
+            digest: SHA-256 do conteúdo
+            gate_quality: Aplicar os limites de qualidade atuais (ingestão): a face recebe
+                quality_issues e, no modo "reject", fica sem embedding se reprovada
+
+        Returns:
+            Face no formato de detect_faces, ou None (sem cache, ou face gravada sem as
+            medidas de qualidade quando a avaliação está ativa)
+        """
+        if self.embedding_cache is None:
+            return None
+        face = self.embedding_cache.get(digest)
+        if face is None or not gate_quality or not self.quality_gate.enabled:
+            return face
+        if face["quality"] is None:
+            # Gravada com a avaliação desativada: detectar de novo para avaliar a face
+            return None
+        face["quality_issues"] = self.quality_gate.issues(face["quality"])
+        if self.quality_gate.rejects and face["quality_issues"]:
+            face["embedding"] = None
+        return face
+
+    def process_image(self, image_path: str, digest: Optional[str] = None) -> Dict[str, Any]:
         """Processa uma única imagem: extrai informações do nome, detecta faces,
-        extrai embeddings e adiciona ao índice FAISS.
+        extrai embeddings e adiciona ao índice FAISS. Imagens com conteúdo já processado
+        reaproveitam a face em cache, sem detecção nem reconhecimento.
 
         Args:
             image_path: Caminho completo para a imagem
+            digest: SHA-256 do conteúdo, se já calculado (ex.: durante o upload)
 
         Returns:
             Dicionário com os resultados do processamento
@@ -147,62 +427,36 @@ class FileProcessor:
                     "error": "Invalid filename format"
                 }
 
-            # Extrair embedding facial
-            embedding = self.face_processor.extract_embedding(image_path)
-            if embedding is None:
-                logger.warning(f"No face detected in {original_filename}")
+            with open(image_path, "rb") as f:
+                data = f.read()
+            if digest is None:
+                digest = content_digest(data=data)
+            img, scale = decode_image(data, self.decode_target_size)
+
+            # Detectar faces e extrair embeddings em uma única passagem (ou reaproveitar do cache)
+            cached = self.cached_face(digest, gate_quality=True) if img is not None else None
+            if cached is not None:
+                faces = [cached]
+            else:
+                faces = (
+                    self.face_processor.detect_faces_batch([img], gate_quality=True, scales=[scale])[0]
+                    if img is not None else []
+                )
+            if not faces or not faces[0].get("embedding"):
+                error = ingest_error(faces)
+                logger.warning(f"{error} in {original_filename}")
                 return {
                     "success": False,
                     "filename": original_filename,
-                    "error": "No face detected"
+                    "error": error
                 }
 
-            # Gerar um nome de arquivo único com timestamp
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            base_name, ext = os.path.splitext(original_filename)
-            unique_filename = f"{base_name}_{timestamp}{ext}"
-
-            # Criar metadados para o índice FAISS
-            metadata = {
-                "person_id": file_info["person_id"],
-                "cpf": file_info["cpf"],
-                "person_name": file_info["person_name"],
-                "origin": file_info["origin"],
-                "filename": unique_filename,
-                "original_filename": original_filename,
-                "processed_date": datetime.now().isoformat()
-            }
-
-            # Adicionar embedding ao índice FAISS
-            faiss_id = self.faiss_index.add_embedding(embedding, metadata)
-
-            # Mover a imagem para o diretório de processados com o nome único
-            processed_path = os.path.join(self.processed_dir, unique_filename)
-            shutil.copy2(image_path, processed_path)
-
-            # Alinhar a face e salvar com nome único
-            aligned_dir = os.path.join(self.processed_dir, "aligned")
-            os.makedirs(aligned_dir, exist_ok=True)
-            aligned_path = os.path.join(aligned_dir, unique_filename)
-            self.face_processor.align_face(image_path, aligned_path)
-
-            logger.info(f"Successfully processed {original_filename} as {unique_filename}, FAISS ID: {faiss_id}")
+            result = self.persist_face(image_path, file_info, img, faces[0], digest=digest, scale=scale)
 
             # Salvar o índice FAISS após cada processamento
-            index_path = os.path.join(self.processed_dir, "faiss_index.bin")
-            metadata_path = os.path.join(self.processed_dir, "faiss_metadata.pkl")
-            self.faiss_index.save(index_path, metadata_path)
+            self.save_index()
 
-            return {
-                "success": True,
-                "filename": unique_filename,
-                "original_filename": original_filename,
-                "person_id": file_info["person_id"],
-                "cpf": file_info["cpf"],
-                "person_name": file_info["person_name"],
-                "origin": file_info["origin"],
-                "faiss_id": faiss_id
-            }
+            return result
         except Exception as e:
             logger.error(f"Error processing image {image_path}: {str(e)}")
             return {
@@ -211,94 +465,213 @@ class FileProcessor:
                 "error": str(e)
             }
 
-    def process_batch(self, max_workers: int = 4) -> Dict[str, Any]:
-        """Processa todas as imagens no diretório de upload em paralelo.
+    def list_images(self):
+        """Lista as imagens do diretório de upload em uma única varredura."""
+        return [entry.path for entry in scan_images(self.upload_dir)]
+
+    def process_batch(
+        self,
+        max_workers: int = 4,
+        sink: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        collect_details: bool = True
+    ) -> Dict[str, Any]:
+        """Processa todas as imagens no diretório de upload com o pipeline em estágios
+        (listagem, decodificação, detecção/embedding e persistência).
 
         Args:
-            max_workers: Número máximo de workers para processamento paralelo
+            max_workers: Número de workers de decodificação (a persistência usa metade)
+            sink: Função chamada com blocos de resultados (ex.: gravação no banco)
+            collect_details: Se os resultados individuais devem ser retornados em "details"
 
         Returns:
             Dicionário com estatísticas do processamento
         """
-        start_time = datetime.now()
+        logger.info(f"Processing images in {self.upload_dir}")
+        return self.process_files(self.list_images(), max_workers=max_workers, sink=sink, collect_details=collect_details)
 
-        # Listar todos os arquivos no diretório de upload
-        image_files = []
-        for ext in ['.jpg', '.jpeg', '.png', '.bmp']:
-            image_files.extend(list(Path(self.upload_dir).glob(f'*{ext}')))
-            image_files.extend(list(Path(self.upload_dir).glob(f'*{ext.upper()}')))
+    def process_files(
+        self,
+        paths,
+        max_workers: int = 4,
+        sink: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        collect_details: bool = True,
+        sink_chunk_size: int = 500
+    ) -> Dict[str, Any]:
+        """Processa um conjunto de arquivos com o pipeline em estágios.
 
-        total_files = len(image_files)
-        logger.info(f"Found {total_files} images to process in {self.upload_dir}")
+        Args:
+            paths: Iterável de caminhos, ou de tuplas (caminho, nome original do arquivo)
+            max_workers: Número de workers de decodificação (a persistência usa metade)
+            sink: Função chamada com blocos de resultados (ex.: gravação no banco)
+            collect_details: Se os resultados individuais devem ser retornados em "details"
+            sink_chunk_size: Tamanho dos blocos entregues ao sink
 
-        if total_files == 0:
-            return {
-                "success": True,
-                "total_files": 0,
-                "processed": 0,
-                "failed": 0,
-                "elapsed_time": 0,
-                "details": []
-            }
+        Returns:
+            Dicionário com estatísticas do processamento
+        """
+        pipeline = IngestPipeline(
+            self,
+            decode_workers=max_workers,
+            persist_workers=max(1, max_workers // 2),
+            queue_size=max(16, max_workers * 8)
+        )
+        return pipeline.run(paths, sink=sink, sink_chunk_size=sink_chunk_size, collect_details=collect_details)
+
+    def query_embedding(self, image_path: str, digest: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        Embedding de uma imagem de consulta. Consultas repetidas (mesmo conteúdo) usam o
+        cache de consultas, e imagens já ingeridas usam o cache de faces, sem detecção.
+        Args:
+            image_path: Caminho para a imagem de consulta
+            digest: SHA-256 do conteúdo, se já calculado
+        Returns:
+            Embedding da primeira face, ou None se nenhuma face for detectada
+        """
+        if digest is None:
+            digest = content_digest(path=image_path)
+        return self.query_embeddings([image_path], [digest])[0]
 
-        # Processar imagens em paralelo
+    def _search_index_batch(
+        self,
+        embeddings: np.ndarray,
+        k: int,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[List[Tuple[float, Dict[str, Any]]]]:
+        """
+        Busca no índice, para cada consulta, os k vizinhos mais próximos cujos metadados
+        atendem aos filtros, em uma única chamada ao índice. Com filtros, a busca das
+        consultas ainda incompletas é ampliada até encontrar k resultados, percorrer o índice
+        ou examinar k * search_filter_fetch_factor candidatos; nesse último caso o resultado
+        é parcial (filtros muito seletivos não percorrem o índice inteiro a cada busca).
+        O k recebido já é limitado pelas rotas (SEARCH_MAX_OFFSET + SEARCH_MAX_K).
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        total_items = self.faiss_index.get_total_items() if filters else 0
+        max_fetch = min(total_items, k * self.search_filter_fetch_factor)
+        matches: List[Optional[List[Tuple[float, Dict[str, Any]]]]] = [None] * len(embeddings)
+        pending = list(range(len(embeddings)))
+        fetch = k
+        while pending:
+            incomplete = []
+            for row, (distances, metadatas) in zip(pending, self.faiss_index.search_batch(embeddings[pending], fetch)):
+                found = [
+                    (distance, metadata)
+                    for distance, metadata in zip(distances, metadatas)
+                    if metadata is not None and all(metadata.get(key) == value for key, value in (filters or {}).items())
+                ]
+                if not filters or len(found) >= k or len(distances) < fetch or fetch >= max_fetch:
+                    if filters and len(found) < k and fetch < total_items:
+                        logger.info(f"Filtered search stopped after {fetch} candidates with {len(found)} of {k} results")
+                    matches[row] = found[:k]
+                else:
+                    incomplete.append(row)
+            pending = incomplete
+            fetch = min(fetch * 4, max_fetch)
+        return matches
+
+    def _build_results(self, matches: List[Tuple[float, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Monta os resultados de busca (rank, distância, similaridade e metadados).
+        """
         results = []
-        successful = 0
-        failed = 0
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_file = {executor.submit(self.process_image, str(file)): file for file in image_files}
-            for future in concurrent.futures.as_completed(future_to_file):
-                file = future_to_file[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    if result["success"]:
-                        successful += 1
-                    else:
-                        failed += 1
-
-                    # Log progresso a cada 100 arquivos
-                    if (successful + failed) % 100 == 0:
-                        logger.info(f"Progress: {successful + failed}/{total_files} files processed")
-                except Exception as e:
-                    logger.error(f"Error processing {file}: {str(e)}")
-                    failed += 1
-                    results.append({
-                        "success": False,
-                        "filename": os.path.basename(str(file)),
-                        "error": str(e)
-                    })
-
-        # Salvar o índice FAISS após o processamento
-        index_path = os.path.join(self.processed_dir, "faiss_index.bin")
-        metadata_path = os.path.join(self.processed_dir, "faiss_metadata.pkl")
-        self.faiss_index.save(index_path, metadata_path)
+        for i, (distance, metadata) in enumerate(matches):
+            if metadata is not None:
+                # Log para depuração
+                logger.info(f"Distância para resultado {i+1}: {distance}")
+                                
+                # Normalizar similaridade
+                min_distance = 500
+                max_distance = 1000
+                                
+                if distance <= min_distance:
+                    similarity = 1.0
+                elif distance >= max_distance:
+                    similarity = 0.0
+                else:
+                    similarity = 1.0 - ((distance - min_distance) / (max_distance - min_distance))
+                                
+                # Montar o caminho completo da imagem
+                image_filename = metadata.get("filename", "")
+                image_full_path = resolve_filename(self.processed_dir, image_filename)
+                                
+                results.append({
+                    "rank": i + 1,
+                    "distance": float(distance),
+                    "similarity": float(similarity),
+                    "person_id": metadata["person_id"],
+                    "cpf": metadata.get("cpf", "N/A"),
+                    "person_name": metadata["person_name"],
+                    "origin": metadata["origin"],
+                    "filename": metadata["filename"],
+                    "file_path": image_full_path,  # Adiciona o caminho completo do arquivo
+                    "processed_date": metadata["processed_date"]
+                })
+        return results
+
+    def search_embedding(
+        self,
+        embedding: np.ndarray,
+        k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Busca os k embeddings mais próximos no índice FAISS. A lista mais longa já calculada
+        fica em cache por (embedding, filtros, versão do índice) até a próxima alteração do
+        índice; buscas com k menor são atendidas por uma fatia dela.
+        Args:
+            embedding: Embedding de consulta
+            k: Número de resultados a retornar
+            filters: Valores exigidos nos metadados (ex.: {"origin": "pc"})
+        Returns:
+            Lista de resultados (rank, distância, similaridade e metadados)
+        """
+        index_version = getattr(self.faiss_index, "version", None)
+        results = self.search_cache.get_results(embedding, k, index_version, filters)
+        if results is not None:
+            return results
 
-        elapsed_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"Batch processing completed: {successful} successful, {failed} failed, {elapsed_time:.2f} seconds")
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        results = self._build_results(self._search_index_batch(embedding, k, filters)[0])
+        self.search_cache.put_results(embedding, k, index_version, results, filters)
+        return results
 
-        return {
-            "success": True,
-            "total_files": total_files,
-            "processed": successful,
-            "failed": failed,
-            "elapsed_time": elapsed_time,
-            "details": results
-        }
+    def search_page(
+        self,
+        embedding: np.ndarray,
+        offset: int = 0,
+        k: int = 5,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Retorna a página [offset, offset + k) dos resultados de uma busca. As páginas
+        anteriores a uma já buscada saem da lista ranqueada em cache (ver search_embedding).
+        Returns:
+            Resultados da página e se há resultados além dela
+        """
+        ranked = self.search_embedding(embedding, offset + k + 1, filters)
+        return ranked[offset:offset + k], len(ranked) > offset + k
 
-    def search_similar_faces(self, image_path: str, k: int = 5) -> Dict[str, Any]:
+    def search_similar_faces(
+        self,
+        image_path: str,
+        k: int = 5,
+        digest: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """
-        Busca faces similares a uma imagem de consulta.
+        Busca faces similares a uma imagem de consulta. O resultado inclui um identificador
+        de consulta (query_handle) para buscar as páginas seguintes sem reenviar a imagem.
         Args:
             image_path: Caminho para a imagem de consulta
             k: Número de resultados a retornar
+            digest: SHA-256 do conteúdo, se já calculado (ex.: durante o upload)
+            filters: Valores exigidos nos metadados (ex.: {"origin": "pc"})
         Returns:
             Dicionário com os resultados da busca
         """
         try:
             # Extrair embedding facial da imagem de consulta
-            embedding = self.face_processor.extract_embedding(image_path)
+            embedding = self.query_embedding(image_path, digest)
                     
             if embedding is None:
                 logger.warning(f"No face detected in query image {image_path}")
@@ -307,49 +680,17 @@ class FileProcessor:
                     "error": "No face detected in query image"
                 }
                     
-            # Buscar faces similares no índice FAISS
-            distances, metadatas = self.faiss_index.search(embedding, k)
-                    
-            # Filtrar resultados inválidos (None)
-            results = []
-            for i, (distance, metadata) in enumerate(zip(distances, metadatas)):
-                if metadata is not None:
-                    # Log para depuração
-                    logger.info(f"Distância para resultado {i+1}: {distance}")
-                                    
-                    # Normalizar similaridade
-                    min_distance = 500
-                    max_distance = 1000
-                                    
-                    if distance <= min_distance:
-                        similarity = 1.0
-                    elif distance >= max_distance:
-                        similarity = 0.0
-                    else:
-                        similarity = 1.0 - ((distance - min_distance) / (max_distance - min_distance))
-                                    
-                    # Montar o caminho completo da imagem
-                    image_filename = metadata.get("filename", "")
-                    image_full_path = os.path.join(self.processed_dir, image_filename)
-                                    
-                    results.append({
-                        "rank": i + 1,
-                        "distance": float(distance),
-                        "similarity": float(similarity),
-                        "person_id": metadata["person_id"],
-                        "cpf": metadata.get("cpf", "N/A"),
-                        "person_name": metadata["person_name"],
-                        "origin": metadata["origin"],
-                        "filename": metadata["filename"],
-                        "file_path": image_full_path,  # Adiciona o caminho completo do arquivo
-                        "processed_date": metadata["processed_date"]
-                    })
+            results, has_more = self.search_page(embedding, 0, k, filters)
+            query_image = os.path.basename(image_path)
                     
             logger.info(f"Search completed for {image_path}, found {len(results)} matches")
                     
             return {
                 "success": True,
-                "query_image": os.path.basename(image_path),
+                "query_image": query_image,
+                "query_handle": self.query_handles.create(embedding, query_image),
+                "offset": 0,
+                "has_more": has_more,
                 "results": results
             }
         except Exception as e:
@@ -359,3 +700,252 @@ class FileProcessor:
                 "query_image": os.path.basename(image_path),
                 "error": str(e)
             }
+
+    def query_embeddings(self, image_paths: List[str], digests: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Embeddings (primeira face) de várias imagens de consulta. As que não estão em cache
+        são detectadas em um único lote.
+        Args:
+            image_paths: Caminhos das imagens de consulta
+            digests: SHA-256 do conteúdo de cada imagem
+        Returns:
+            Lista de embeddings (None para imagens sem face)
+        """
+        embeddings: List[Optional[np.ndarray]] = []
+        pending = []
+        for position, digest in enumerate(digests):
+            embedding = self.search_cache.get_probe(digest)
+            if embedding is None:
+                cached = self.cached_face(digest)
+                if cached is not None:
+                    embedding = np.array(cached["embedding"], dtype=np.float32)
+                    self.search_cache.put_probe(digest, embedding)
+                else:
+                    pending.append(position)
+            embeddings.append(embedding)
+
+        decoded = [read_image(image_paths[position], self.decode_target_size) for position in pending]
+        loaded = [(position, img, scale) for position, (img, scale) in zip(pending, decoded) if img is not None]
+        if loaded:
+            all_faces = self.face_processor.detect_faces_batch(
+                [img for _, img, _ in loaded], scales=[scale for _, _, scale in loaded]
+            )
+            for (position, img, scale), faces in zip(loaded, all_faces):
+                if faces and faces[0].get("embedding"):
+                    self.realign_full_resolution(img, scale, faces[0], image_paths[position])
+                    embeddings[position] = np.array(faces[0]["embedding"], dtype=np.float32)
+                    self.search_cache.put_probe(digests[position], embeddings[position])
+        return embeddings
+
+    @staticmethod
+    def fuse_embeddings(embeddings: np.ndarray) -> np.ndarray:
+        """
+        Média das direções (embeddings normalizados) de várias imagens da mesma pessoa.
+        O índice compara embeddings não normalizados por distância L2, então a média é
+        reescalada para a norma média das consultas, mantendo as distâncias comparáveis.
+        """
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        mean = (embeddings / np.maximum(norms, 1e-12)).mean(axis=0)
+        return (mean / max(float(np.linalg.norm(mean)), 1e-12) * float(norms.mean())).astype(np.float32)
+
+    def search_fused(
+        self,
+        image_paths: List[str],
+        digests: List[str],
+        k: int = 5,
+        filters: Optional[Dict[str, Any]] = None,
+        fusion: str = "mean"
+    ) -> Dict[str, Any]:
+        """
+        Busca com várias imagens da mesma pessoa, fundidas em uma única consulta.
+        Args:
+            image_paths: Caminhos das imagens de consulta
+            digests: SHA-256 do conteúdo de cada imagem
+            k: Número de resultados a retornar
+            filters: Valores exigidos nos metadados (ex.: {"origin": "pc"})
+            fusion: "mean" (busca com a média dos embeddings normalizados; o resultado tem
+                query_handle) ou "max" (buscas por imagem em um único lote, cada candidato
+                com a menor distância entre elas)
+        Returns:
+            Dicionário com os resultados da busca
+        """
+        query_image = ", ".join(os.path.basename(path) for path in image_paths)
+        try:
+            embeddings = self.query_embeddings(image_paths, digests)
+            used = [embedding for embedding in embeddings if embedding is not None]
+            skipped = [os.path.basename(path) for path, embedding in zip(image_paths, embeddings) if embedding is None]
+            if not used:
+                logger.warning(f"No face detected in query images {query_image}")
+                return {
+                    "success": False,
+                    "query_image": query_image,
+                    "error": "No face detected in query images"
+                }
+
+            query_handle = None
+            if fusion == "max":
+                best = {}
+                for matches in self._search_index_batch(np.vstack(used), k + 1, filters):
+                    for distance, metadata in matches:
+                        key = metadata.get("filename")
+                        if key not in best or distance < best[key][0]:
+                            best[key] = (distance, metadata)
+                ranked = self._build_results(sorted(best.values(), key=lambda item: item[0])[:k + 1])
+            else:
+                fused = self.fuse_embeddings(np.vstack(used))
+                ranked = self.search_embedding(fused, k + 1, filters)
+                query_handle = self.query_handles.create(fused, query_image)
+
+            logger.info(f"Fused search ({fusion}) completed for {len(used)} images, found {len(ranked[:k])} matches")
+            return {
+                "success": True,
+                "query_image": query_image,
+                "query_handle": query_handle,
+                "fusion": fusion,
+                "skipped_images": skipped,
+                "offset": 0,
+                "has_more": len(ranked) > k,
+                "results": ranked[:k]
+            }
+        except Exception as e:
+            logger.error(f"Error in fused search for {query_image}: {str(e)}")
+            return {
+                "success": False,
+                "query_image": query_image,
+                "error": str(e)
+            }
+
+    def stored_embeddings(self, images: List[Tuple[Optional[int], Optional[str]]]) -> Tuple[List[int], np.ndarray]:
+        """
+        Embeddings já armazenados de imagens ingeridas, sem inferência: do cache de faces
+        (pelo hash do conteúdo) ou, para imagens anteriores ao cache, do índice (pelo faiss_id).
+        Args:
+            images: Pares (faiss_id, content_hash) das imagens
+        Returns:
+            Posições (em images) das imagens encontradas e a matriz dos embeddings
+        """
+        positions = []
+        vectors = []
+        missing = {}
+        for position, (faiss_id, content_hash) in enumerate(images):
+            cached = self.cached_face(content_hash) if content_hash else None
+            if cached is not None:
+                positions.append(position)
+                vectors.append(np.array(cached["embedding"], dtype=np.float32))
+            elif faiss_id is not None:
+                missing[int(faiss_id)] = position
+
+        if missing and hasattr(self.faiss_index, "get_embeddings"):
+            found, index_vectors = self.faiss_index.get_embeddings(list(missing))
+            for faiss_id, vector in zip(found, index_vectors):
+                positions.append(missing[faiss_id])
+                vectors.append(np.asarray(vector, dtype=np.float32))
+
+        if not vectors:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        return positions, np.vstack(vectors)
+
+    @staticmethod
+    def cosine_scores(probe: np.ndarray, gallery: np.ndarray) -> np.ndarray:
+        """
+        Similaridade de cosseno entre um embedding e cada linha de uma matriz (produto
+        escalar vetorizado dos embeddings normalizados).
+        """
+        probe = np.asarray(probe, dtype=np.float32).ravel()
+        gallery = np.asarray(gallery, dtype=np.float32).reshape(-1, probe.shape[0])
+        probe = probe / max(float(np.linalg.norm(probe)), 1e-12)
+        gallery = gallery / np.maximum(np.linalg.norm(gallery, axis=1, keepdims=True), 1e-12)
+        return gallery @ probe
+
+    def query_faces(self, image_path: str, digest: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Todas as faces detectadas em uma imagem de consulta (com cache pelo hash do conteúdo).
+        As faces pequenas na decodificação reduzida são realinhadas em resolução total, como
+        na ingestão, para que consulta e galeria usem recortes equivalentes.
+        """
+        if digest is None:
+            digest = content_digest(path=image_path)
+        key = f"{digest}:faces"
+        faces = self.search_cache.get_probe(key)
+        if faces is None:
+            img, scale = read_image(image_path, self.decode_target_size)
+            if img is None:
+                logger.error(f"Failed to load query image: {image_path}")
+                return []
+            faces = self.face_processor.detect_faces_batch([img], scales=[scale])[0]
+            self.realign_faces_full_resolution(
+                img, scale, [face for face in faces if face.get("embedding")], image_path
+            )
+            if faces:
+                self.search_cache.put_probe(key, faces)
+        return faces
+
+    def search_all_faces(
+        self,
+        image_path: str,
+        k: int = 5,
+        digest: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        min_face_size: int = 0,
+        min_score: float = 0.0
+    ) -> Dict[str, Any]:
+        """
+        Busca faces similares a cada face detectada na imagem de consulta (ex.: fotos de
+        grupo), com todas as consultas em uma única busca em lote no índice.
+        Args:
+            image_path: Caminho para a imagem de consulta
+            k: Número de resultados por face
+            digest: SHA-256 do conteúdo, se já calculado (ex.: durante o upload)
+            filters: Valores exigidos nos metadados (ex.: {"origin": "pc"})
+            min_face_size: Menor lado mínimo do bounding box (em pixels) de uma face pesquisada
+            min_score: Score mínimo de detecção de uma face pesquisada
+        Returns:
+            Dicionário com os resultados agrupados por face (bbox, score, query_handle e resultados)
+        """
+        query_image = os.path.basename(image_path)
+        try:
+            faces = [
+                face for face in self.query_faces(image_path, digest)
+                if face.get("embedding")
+                and face["score"] >= min_score
+                and min(face["bbox"][2] - face["bbox"][0], face["bbox"][3] - face["bbox"][1]) >= min_face_size
+            ]
+            if not faces:
+                logger.warning(f"No face detected in query image {image_path}")
+                return {
+                    "success": False,
+                    "query_image": query_image,
+                    "error": "No face detected in query image"
+                }
+
+            embeddings = np.array([face["embedding"] for face in faces], dtype=np.float32)
+            index_version = getattr(self.faiss_index, "version", None)
+            # k + 1 resultados: indica se há mais páginas e coincide com a primeira página de search_page
+            all_matches = self._search_index_batch(embeddings, k + 1, filters)
+
+            grouped = []
+            for face_index, (face, embedding, matches) in enumerate(zip(faces, embeddings, all_matches)):
+                ranked = self._build_results(matches)
+                self.search_cache.put_results(embedding.reshape(1, -1), k + 1, index_version, ranked, filters)
+                grouped.append({
+                    "face_index": face_index,
+                    "bbox": face["bbox"],
+                    "score": face["score"],
+                    "query_handle": self.query_handles.create(embedding, query_image),
+                    "has_more": len(ranked) > k,
+                    "results": ranked[:k]
+                })
+
+            logger.info(f"Multi-face search completed for {image_path}: {len(grouped)} faces")
+            return {
+                "success": True,
+                "query_image": query_image,
+                "faces": grouped
+            }
+        except Exception as e:
+            logger.error(f"Error searching faces for {image_path}: {str(e)}")
+            return {
+                "success": False,
+                "query_image": query_image,
+                "error": str(e)
+            }
@@ -0,0 +1,160 @@
+"""
+Decodificação de imagens em resolução reduzida para a detecção.
+
+O detector trabalha em det_size (640 x 640), então decodificar uma foto de 12 MP em
+resolução total só para reduzi-la em seguida desperdiça a maior parte do tempo. Para JPEG,
+o OpenCV decodifica diretamente em 1/2, 1/4 ou 1/8 da resolução (IMREAD_REDUCED_COLOR_*,
+escala feita na DCT, bem mais rápida que decodificar e redimensionar). O fator é escolhido
+pelas dimensões do cabeçalho, de modo que o maior lado continue com pelo menos target_size
+pixels; as coordenadas das faces são convertidas de volta para a resolução original.
+
+A normalização opcional das imagens armazenadas (ver FileProcessor) usa fit_long_edge e
+encode_image: a orientação EXIF já é aplicada pelo cv2.imdecode, então a imagem gravada
+fica na orientação correta e sem EXIF.
+"""
+import struct
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+# Fatores de redução do decodificador JPEG, do maior para o menor
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Marcadores SOF (início de quadro) com as dimensões da imagem
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Lê a largura e a altura do cabeçalho de um JPEG, sem decodificar a imagem.
+
+    Returns:
+        (largura, altura), ou None se o conteúdo não é um JPEG válido
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+    position = 2
+    size = len(data)
+    while position + 4 <= size:
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        # Bytes de preenchimento e marcadores sem segmento
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        if marker in _SOF_MARKERS:
+            if position + 9 > size:
+                return None
+            height, width = struct.unpack(">HH", data[position + 5:position + 9])
+            return width, height
+        if marker == 0xDA:  # Início dos dados comprimidos sem SOF
+            return None
+        position += 2 + length
+    return None
+
+
+def reduction_factor(width: int, height: int, target_size: int) -> int:
+    """
+    Maior fator de redução (8, 4 ou 2) que mantém o maior lado com pelo menos target_size pixels.
+
+    Returns:
+        Fator de redução (1 = resolução total)
+    """
+    if target_size <= 0:
+        return 1
+    longest = max(width, height)
+    for factor, _ in _REDUCED_FLAGS:
+        if longest // factor >= target_size:
+            return factor
+    return 1
+
+
+def decode_image(data: bytes, target_size: int = 0) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Decodifica uma imagem (BGR), em resolução reduzida quando é um JPEG grande.
+
+    Args:
+        data: Conteúdo do arquivo
+        target_size: Tamanho mínimo do maior lado após a redução (0 desativa a redução)
+
+    Returns:
+        Imagem decodificada (ou None) e a escala da resolução original em relação a ela
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    dimensions = jpeg_dimensions(data) if target_size > 0 else None
+    if dimensions is not None:
+        factor = reduction_factor(dimensions[0], dimensions[1], target_size)
+        if factor > 1:
+            flag = dict(_REDUCED_FLAGS)[factor]
+            img = cv2.imdecode(buffer, flag)
+            if img is not None:
+                return img, float(factor)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1.0
+
+
+def read_image(path: str, target_size: int = 0) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Lê e decodifica uma imagem do disco (ver decode_image).
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None, 1.0
+    return decode_image(data, target_size)
+
+
+def scale_faces(faces: List[Dict[str, Any]], scale: float) -> List[Dict[str, Any]]:
+    """
+    Converte as coordenadas das faces (bbox, 5 pontos e landmarks) da imagem decodificada
+    para a resolução original. Altera e retorna a própria lista.
+    """
+    if scale == 1.0:
+        return faces
+    for face in faces:
+        face["bbox"] = [int(round(value * scale)) for value in face["bbox"]]
+        if face.get("kps") is not None:
+            face["kps"] = (np.asarray(face["kps"], dtype=np.float32) * scale).tolist()
+        if face.get("landmarks") is not None:
+            face["landmarks"] = np.round(np.asarray(face["landmarks"], dtype=np.float32) * scale).astype(int).tolist()
+    return faces
+
+
+# Formatos de normalização: extensão e parâmetro de qualidade do codificador
+NORMALIZED_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def fit_long_edge(img: np.ndarray, max_side: int) -> np.ndarray:
+    """
+    Reduz a imagem para que o maior lado tenha no máximo max_side pixels (0 = sem limite).
+    """
+    height, width = img.shape[:2]
+    longest = max(height, width)
+    if max_side <= 0 or longest <= max_side:
+        return img
+    ratio = max_side / longest
+    size = (max(1, int(round(width * ratio))), max(1, int(round(height * ratio))))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def encode_image(img: np.ndarray, image_format: str = "jpeg", quality: int = 90) -> bytes:
+    """
+    Codifica uma imagem (BGR) no formato de normalização (jpeg ou webp), sem metadados EXIF.
+    """
+    extension, quality_flag = NORMALIZED_FORMATS[image_format]
+    ok, buffer = cv2.imencode(extension, img, [quality_flag, int(quality)])
+    if not ok:
+        raise ValueError(f"Failed to encode image as {image_format}")
+    return buffer.tobytes()
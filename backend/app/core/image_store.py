@@ -0,0 +1,149 @@
+"""
+Armazenamento endereçado por conteúdo das imagens processadas.
+
+Cada imagem é gravada como <sha256>.<ext> em subdiretórios formados pelos primeiros
+caracteres do hash (raiz/ab/cd/abcd...jpg). Os recortes alinhados de versões anteriores
+seguem a mesma estrutura em raiz/aligned (os novos ficam em core/crop_store). Assim nenhum
+diretório acumula milhões de entradas, nomes não colidem entre lotes paralelos e o caminho
+de um arquivo pode ser calculado a partir do nome.
+"""
+import os
+import re
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+ALIGNED_DIRNAME = "aligned"
+
+# ioctl de clonagem de arquivo do Linux (linux/fs.h)
+FICLONE = 0x40049409
+
+_CONTENT_NAME = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+
+def content_digest(path: Optional[str] = None, data: Optional[bytes] = None) -> str:
+    """
+    Calcula o SHA-256 (hexadecimal) do conteúdo em memória ou de um arquivo.
+    """
+    if data is not None:
+        return hashlib.sha256(data).hexdigest()
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def content_filename(digest: str, original_filename: str, extension: Optional[str] = None) -> str:
+    """
+    Nome de armazenamento de um conteúdo: o hash com a extensão original em minúsculas
+    (ou a extensão informada, quando a imagem foi normalizada para outro formato).
+    """
+    if extension is None:
+        extension = os.path.splitext(original_filename)[1]
+    return f"{digest}{extension.lower()}"
+
+
+def is_content_addressed(filename: str) -> bool:
+    return bool(_CONTENT_NAME.match(filename))
+
+
+def resolve_filename(root: str, filename: str) -> str:
+    """
+    Caminho de uma imagem a partir do nome: nomes endereçados por conteúdo ficam em
+    subdiretórios do hash; nomes antigos (anteriores a este layout) ficam na raiz.
+    """
+    if is_content_addressed(filename):
+        return os.path.join(root, filename[:2], filename[2:4], filename)
+    return os.path.join(root, filename)
+
+
+def aligned_path(root: str, filename: str) -> str:
+    """
+    Caminho do recorte alinhado de uma imagem.
+    """
+    return resolve_filename(os.path.join(root, ALIGNED_DIRNAME), filename)
+
+
+def _reflink(source_path: str, target_path: str):
+    """
+    Clona o arquivo com FICLONE (cópia sob demanda em btrfs, XFS e similares).
+    """
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def place_file(source_path: str, target_path: str, strategy: str = "auto") -> str:
+    """
+    Coloca um arquivo já existente no destino sem copiar os bytes quando possível.
+
+    Estratégias:
+        move: como hardlink (ou cópia entre sistemas de arquivos), mantendo a origem; quem
+            chama a remove depois que o resultado foi registrado (remove_ingested_sources),
+            de modo que uma falha antes do commit não perde o arquivo
+        hardlink: cria um link físico para a origem (mesmo sistema de arquivos)
+        reflink: clona a origem com FICLONE (sistemas de arquivos com cópia sob demanda)
+        copy: copia os bytes
+        auto: tenta hardlink, depois reflink e, por fim, copy
+
+    Com hardlink ou reflink a origem pode ser removida depois, sem afetar o destino.
+
+    Returns:
+        Estratégia efetivamente usada
+    """
+    tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if strategy == "auto":
+        attempts = ["hardlink", "reflink", "copy"]
+    elif strategy == "move":
+        attempts = ["hardlink", "copy"]
+    else:
+        attempts = [strategy]
+    for attempt in attempts:
+        try:
+            if attempt == "hardlink":
+                os.link(source_path, tmp_path)
+            elif attempt == "reflink":
+                _reflink(source_path, tmp_path)
+            elif attempt == "copy":
+                shutil.copyfile(source_path, tmp_path)
+            else:
+                raise ValueError(f"Unknown file placement strategy: {attempt}")
+        except OSError as e:
+            # Sistemas de arquivos diferentes ou sem suporte: tentar a próxima estratégia
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if attempt == attempts[-1]:
+                raise
+            logger.debug(f"File placement {attempt} failed for {source_path}: {str(e)}")
+            continue
+        os.replace(tmp_path, target_path)
+        return "move" if strategy == "move" else attempt
+
+
+def store_file(
+    target_path: str,
+    source_path: Optional[str] = None,
+    data: Optional[bytes] = None,
+    strategy: str = "auto"
+) -> Optional[str]:
+    """
+    Grava o conteúdo no caminho de destino, a partir dos bytes em memória ou de um arquivo
+    (colocado com place_file). A escrita termina com uma renomeação, de modo que leitores
+    nunca veem um arquivo parcial. Se o destino já existe, o conteúdo (idêntico) não é regravado.
+
+    Returns:
+        Estratégia usada ("write" para bytes em memória), ou None se o destino já existia
+    """
+    if os.path.exists(target_path):
+        return None
+
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    if data is not None:
+        tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target_path)
+        return "write"
+    return place_file(source_path, target_path, strategy)
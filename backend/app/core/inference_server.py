@@ -0,0 +1,318 @@
+"""
+Servidor de inferência dedicado, separado dos processos da API.
+
+O servidor possui os modelos do InsightFace (carregados uma vez por host) e atende
+chamadas de detecção/embedding por multiprocessing.connection (socket Unix ou TCP),
+agrupando em lotes as requisições que chegam simultaneamente. A API usa o
+RemoteFaceProcessor, um cliente leve com a mesma interface de FaceProcessor e conexões
+reutilizáveis, quando INFERENCE_SERVER_ADDRESS está configurado.
+
+Iniciar o servidor:
+    INFERENCE_SERVER_AUTHKEY=<segredo> python -m app.core.inference_server \
+        --address /tmp/sif-inference.sock --models-dir ./data/models
+
+A chave INFERENCE_SERVER_AUTHKEY é obrigatória nos dois lados. O protocolo desserializa
+(pickle) as mensagens recebidas, então quem conhece a chave pode executar código no
+servidor: use uma chave secreta e não exponha a porta fora de uma rede confiável
+(prefira socket Unix ou uma rede privada entre a API e o host de GPU).
+"""
+import os
+import time
+import argparse
+import threading
+import logging
+import cv2
+import numpy as np
+from multiprocessing.connection import Listener
+from queue import Queue, Empty
+from typing import List, Dict, Tuple, Optional, Any
+from .faiss_shards import ShardClient, parse_address
+from .image_decode import decode_image
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingImage:
+    """
+    Imagem aguardando processamento no lote, com o evento que sinaliza o resultado.
+    """
+    __slots__ = ("image", "gate_quality", "scale", "result", "error", "done")
+
+    def __init__(self, image: np.ndarray, gate_quality: bool = False, scale: float = 1.0):
+        self.image = image
+        self.gate_quality = gate_quality
+        self.scale = scale  # Escala da resolução original em relação à imagem decodificada
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceServer:
+    """
+    Servidor que possui o FaceProcessor e processa as imagens recebidas em lotes.
+    """
+    def __init__(
+        self,
+        address: str,
+        authkey: bytes,
+        models_dir: str,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        decode_target_size: int = 0
+    ):
+        """
+        Args:
+            address: Endereço de escuta ("host:porta" ou caminho de socket Unix)
+            authkey: Chave de autenticação compartilhada com os clientes
+            models_dir: Diretório dos modelos do InsightFace
+            max_batch_size: Número máximo de imagens por lote
+            max_wait_ms: Tempo máximo de espera para completar um lote
+            decode_target_size: Maior lado mínimo na decodificação reduzida de JPEGs (0 desativa)
+        """
+        from .face_processor import FaceProcessor
+
+        if not authkey:
+            raise ValueError("INFERENCE_SERVER_AUTHKEY must be set to a secret shared with the API")
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.face_processor = FaceProcessor(model_path=models_dir, decode_target_size=decode_target_size)
+        self._queue: Queue = Queue()
+
+    def serve_forever(self):
+        """
+        Inicia a thread de lotes e atende as conexões.
+        """
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"Inference server listening on {self.address}")
+
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.error(f"Error accepting inference connection: {str(e)}")
+                continue
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    def _handle_connection(self, conn):
+        """
+        Atende as requisições de uma conexão: cada mensagem é (método, args, kwargs).
+        """
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    if method == "ping":
+                        result = True
+                    elif method == "detect_faces":
+                        result = self._detect([args[0]])[0]
+                    elif method == "detect_faces_batch":
+                        result = self._detect(args[0], kwargs.get("gate_quality", False), kwargs.get("scales"))
+                    elif method == "embed_crops":
+                        result = self.face_processor.embed_crops(args[0])
+                    else:
+                        raise ValueError(f"Unknown inference method: {method}")
+                    conn.send(("ok", result))
+                except Exception as e:
+                    logger.error(f"Error in inference call {method}: {str(e)}")
+                    conn.send(("error", str(e)))
+
+    def _detect(
+        self,
+        images: List[Any],
+        gate_quality: bool = False,
+        scales: Optional[List[float]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Enfileira as imagens para o lote e aguarda os resultados, com as coordenadas na
+        resolução original. Imagens codificadas (bytes do arquivo) são decodificadas aqui,
+        JPEGs grandes em resolução reduzida; arrays já decodificados são usados como estão.
+
+        Args:
+            images: Conteúdo das imagens (bytes) ou imagens BGR já decodificadas (uint8)
+            gate_quality: Aplicar a rejeição por qualidade (ingestão)
+            scales: Escala de cada imagem já reduzida pelo cliente antes do envio
+        """
+        pending = []
+        for position, data in enumerate(images):
+            if isinstance(data, np.ndarray):
+                img, scale = (data if data.size else None), 1.0
+            else:
+                img, scale = decode_image(data, self.face_processor.decode_target_size)
+            if scales:
+                scale *= scales[position]
+            item = _PendingImage(img, gate_quality, scale)
+            if img is None:
+                item.result = []
+                item.done.set()
+            else:
+                self._queue.put(item)
+            pending.append(item)
+
+        results = []
+        for item in pending:
+            item.done.wait()
+            if item.error is not None:
+                raise RuntimeError(item.error)
+            results.append(item.result)
+        return results
+
+    def _batch_loop(self):
+        """
+        Agrupa as imagens enfileiradas (até max_batch_size ou max_wait_ms) e as processa juntas.
+        """
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            try:
+                # Imagens de ingestão e de consulta podem dividir o mesmo lote
+                results = self.face_processor.detect_faces_batch(
+                    [item.image for item in batch],
+                    gate_quality=[item.gate_quality for item in batch],
+                    scales=[item.scale for item in batch]
+                )
+                for item, result in zip(batch, results):
+                    item.result = result
+            except Exception as e:
+                logger.error(f"Error processing inference batch of {len(batch)} images: {str(e)}")
+                for item in batch:
+                    item.error = str(e)
+            finally:
+                for item in batch:
+                    item.done.set()
+
+
+class RemoteFaceProcessor:
+    """
+    Cliente do servidor de inferência com a mesma interface de FaceProcessor.
+    """
+    def __init__(self, address: str, authkey: bytes):
+        """
+        Args:
+            address: Endereço do servidor de inferência
+            authkey: Chave de autenticação do servidor
+        """
+        if not authkey:
+            raise ValueError("INFERENCE_SERVER_AUTHKEY must be set to connect to the inference server")
+        self.client = ShardClient(address, authkey)
+        logger.info(f"Using remote inference server at {address}")
+
+    def detect_faces_bytes(self, data: bytes) -> List[Dict[str, Any]]:
+        """
+        Detecta faces em uma imagem codificada (bytes do arquivo).
+        """
+        return self.client.call("detect_faces", data)
+
+    def detect_faces_batch(
+        self,
+        images: List[np.ndarray],
+        gate_quality: bool = False,
+        scales: Optional[List[float]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Detecta faces em várias imagens já carregadas (BGR), em um único lote no servidor.
+        Os pixels são enviados como arrays uint8 (com a forma), sem recodificar as imagens.
+        """
+        arrays = [np.ascontiguousarray(img, dtype=np.uint8) for img in images]
+        return self.client.call("detect_faces_batch", arrays, gate_quality=gate_quality, scales=scales)
+
+    def embed_crops(self, crops: np.ndarray) -> np.ndarray:
+        """
+        Calcula no servidor os embeddings de recortes já alinhados (sem detecção).
+        """
+        return self.client.call("embed_crops", np.ascontiguousarray(crops, dtype=np.uint8))
+
+    def detect_faces(self, image_path: str) -> List[Dict[str, Any]]:
+        """
+        Detecta faces em uma imagem, enviando o arquivo ao servidor de inferência.
+        """
+        try:
+            with open(image_path, "rb") as f:
+                results = self.detect_faces_bytes(f.read())
+            logger.info(f"Detected {len(results)} faces in {image_path}")
+            return results
+        except Exception as e:
+            logger.error(f"Error detecting faces in {image_path}: {str(e)}")
+            return []
+
+    def extract_embedding(self, image_path: str) -> Optional[np.ndarray]:
+        """
+        Extrai o embedding facial da primeira face detectada em uma imagem.
+        """
+        faces = self.detect_faces(image_path)
+        if not faces or not faces[0].get("embedding"):
+            return None
+        return np.array(faces[0]["embedding"], dtype=np.float32)
+
+    def extract_all_embeddings(self, image_path: str) -> List[np.ndarray]:
+        """
+        Extrai embeddings faciais de todas as faces detectadas em uma imagem.
+        """
+        return [
+            np.array(face["embedding"], dtype=np.float32)
+            for face in self.detect_faces(image_path)
+            if face.get("embedding")
+        ]
+
+    def align_face(self, image_path: str, output_path: str, size: Tuple[int, int] = (112, 112)) -> bool:
+        """
+        Alinha a primeira face detectada (landmarks calculados no servidor) e salva a imagem alinhada.
+        """
+        from .face_processor import align_from_landmarks
+
+        try:
+            img = cv2.imread(image_path)
+            if img is None:
+                logger.error(f"Failed to load image: {image_path}")
+                return False
+
+            faces = self.detect_faces(image_path)
+            if not faces or faces[0].get("landmarks") is None:
+                logger.warning(f"No faces detected in {image_path}")
+                return False
+
+            aligned = align_from_landmarks(img, faces[0]["landmarks"], image_size=size[0])
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            cv2.imwrite(output_path, aligned)
+            logger.info(f"Face aligned and saved to {output_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Error processing {image_path}: {str(e)}")
+            return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor de inferência facial (InsightFace)")
+    parser.add_argument("--address", required=True, help="host:porta ou caminho de socket Unix")
+    parser.add_argument("--models-dir", default=os.path.join(os.getcwd(), "data", "models"))
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--decode-target-size", type=int, default=int(os.getenv("DECODE_TARGET_SIZE", "1280")),
+                        help="Maior lado mínimo na decodificação reduzida de JPEGs (0 desativa)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    authkey = os.getenv("INFERENCE_SERVER_AUTHKEY", "").encode("utf-8")
+    if not authkey:
+        parser.error("INFERENCE_SERVER_AUTHKEY must be set to a secret shared with the API")
+    InferenceServer(
+        args.address, authkey, args.models_dir, args.max_batch_size, args.max_wait_ms, args.decode_target_size
+    ).serve_forever()
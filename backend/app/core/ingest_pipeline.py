@@ -0,0 +1,375 @@
+"""
+Pipeline de ingestão em estágios conectados por filas limitadas.
+
+    listagem -> decodificação -> detecção/embedding -> persistência -> coleta
+
+Cada estágio tem seu próprio número de workers e as filas entre eles têm tamanho fixo,
+de forma que leitura de disco, inferência e gravação se sobrepõem e a memória fica
+constante independentemente do tamanho do lote.
+"""
+import os
+import tarfile
+import zipfile
+import threading
+import logging
+from datetime import datetime
+from queue import Queue, Empty
+from typing import Iterable, Iterator, Callable, List, Dict, Optional, Any
+from .directory_scanner import IMAGE_EXTENSIONS
+from .image_store import content_digest
+from .face_quality import ingest_error
+from .image_decode import decode_image
+
+logger = logging.getLogger(__name__)
+
+# Marcador de fim de fila
+_DONE = object()
+
+
+class IngestItem:
+    """
+    Arquivo em processamento, passado de um estágio para o seguinte.
+    """
+    __slots__ = ("path", "filename", "data", "digest", "file_info", "image", "scale", "face")
+
+    def __init__(self, path: str, filename: Optional[str] = None, data: Optional[bytes] = None):
+        self.path = path
+        # Nome original do arquivo (quando difere do nome no disco, ex.: prefixo do lote)
+        self.filename = filename or os.path.basename(path)
+        # Conteúdo do arquivo, quando lido de um arquivo compactado (sem caminho no disco)
+        self.data = data
+        self.digest = None  # SHA-256 do conteúdo, calculado na decodificação
+        self.file_info = None
+        self.image = None
+        self.scale = 1.0  # Escala da resolução original em relação à imagem decodificada
+        self.face = None
+
+
+class IngestPipeline:
+    """
+    Executa a ingestão de um fluxo de arquivos de imagem usando o FileProcessor.
+    """
+    def __init__(
+        self,
+        file_processor,
+        decode_workers: int = 4,
+        inference_workers: int = 1,
+        persist_workers: int = 2,
+        queue_size: int = 64,
+        inference_batch_size: int = 16,
+        save_every: int = 1000
+    ):
+        """
+        Args:
+            file_processor: Instância do FileProcessor (processador de faces, índice e diretórios)
+            decode_workers: Threads de leitura e decodificação
+            inference_workers: Threads de detecção/embedding
+            persist_workers: Threads de persistência (cópia, recorte, índice)
+            queue_size: Tamanho máximo de cada fila entre estágios
+            inference_batch_size: Número máximo de imagens por lote de inferência
+            save_every: Intervalo (em arquivos) para salvar o índice (delta e metadados) durante a ingestão
+        """
+        self.file_processor = file_processor
+        self.decode_workers = decode_workers
+        self.inference_workers = inference_workers
+        self.persist_workers = persist_workers
+        self.queue_size = queue_size
+        self.inference_batch_size = inference_batch_size
+        self.save_every = save_every
+
+    def run(
+        self,
+        paths: Iterable[str],
+        sink: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        sink_chunk_size: int = 500,
+        collect_details: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Processa os arquivos e retorna as estatísticas no formato de FileProcessor.process_batch.
+
+        Args:
+            paths: Iterável (pode ser um gerador) com os caminhos das imagens, tuplas
+                (caminho, nome original do arquivo) ou IngestItem (ex.: iter_archive)
+            sink: Função chamada com blocos de resultados (ex.: gravação no banco)
+            sink_chunk_size: Tamanho dos blocos entregues ao sink
+            collect_details: Se os resultados individuais devem ser retornados em "details"
+
+        Returns:
+            Dicionário com estatísticas do processamento
+        """
+        start_time = datetime.now()
+
+        decode_q: Queue = Queue(maxsize=self.queue_size)
+        infer_q: Queue = Queue(maxsize=self.queue_size)
+        persist_q: Queue = Queue(maxsize=self.queue_size)
+        result_q: Queue = Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._list, args=(paths, decode_q), daemon=True)]
+        threads += self._start_stage(self._decode, decode_q, infer_q, result_q, self.decode_workers, self.inference_workers)
+        threads += self._start_stage(self._infer, infer_q, persist_q, result_q, self.inference_workers, self.persist_workers)
+        threads += self._start_stage(self._persist, persist_q, None, result_q, self.persist_workers, 1)
+        threads[0].start()
+
+        # Coletar resultados na thread atual
+        details = []
+        chunk = []
+        successful = 0
+        failed = 0
+        while True:
+            result = result_q.get()
+            if result is _DONE:
+                break
+
+            if result["success"]:
+                successful += 1
+            else:
+                failed += 1
+            if collect_details:
+                details.append(result)
+
+            if sink is not None:
+                chunk.append(result)
+                if len(chunk) >= sink_chunk_size:
+                    self._flush(sink, chunk)
+                    chunk = []
+
+            processed = successful + failed
+            if processed % self.save_every == 0:
+                self.file_processor.save_index()
+            # Log progresso a cada 100 arquivos
+            if processed % 100 == 0:
+                logger.info(f"Progress: {processed} files processed ({successful} successful, {failed} failed)")
+
+        if sink is not None and chunk:
+            self._flush(sink, chunk)
+
+        for thread in threads:
+            thread.join()
+
+        # Salvar o índice FAISS após o processamento
+        self.file_processor.save_index()
+
+        elapsed_time = (datetime.now() - start_time).total_seconds()
+        total_files = successful + failed
+        logger.info(f"Ingest pipeline completed: {successful} successful, {failed} failed, {elapsed_time:.2f} seconds")
+
+        return {
+            "success": True,
+            "total_files": total_files,
+            "processed": successful,
+            "failed": failed,
+            "elapsed_time": elapsed_time,
+            "details": details
+        }
+
+    def _flush(self, sink: Callable, chunk: List[Dict[str, Any]]):
+        """
+        Entrega um bloco de resultados ao sink, sem interromper a ingestão em caso de erro.
+        """
+        # O índice não é salvo a cada bloco: embeddings gravados após o último salvamento
+        # (save_every) e perdidos numa queda são refeitos pela reconciliação do índice
+        try:
+            sink(chunk)
+        except Exception as e:
+            logger.error(f"Error in ingest sink for {len(chunk)} results: {str(e)}")
+
+    def _start_stage(
+        self,
+        target: Callable,
+        in_q: Queue,
+        out_q: Optional[Queue],
+        result_q: Queue,
+        workers: int,
+        downstream_workers: int
+    ) -> List[threading.Thread]:
+        """
+        Inicia os workers de um estágio e uma thread que, ao final de todos eles, envia
+        um marcador de fim para cada worker do estágio seguinte.
+        """
+        stage_threads = [
+            threading.Thread(target=target, args=(in_q, out_q, result_q), daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in stage_threads:
+            thread.start()
+
+        next_q = out_q if out_q is not None else result_q
+
+        def close():
+            for thread in stage_threads:
+                thread.join()
+            for _ in range(downstream_workers):
+                next_q.put(_DONE)
+
+        closer = threading.Thread(target=close, daemon=True)
+        closer.start()
+        return stage_threads + [closer]
+
+    def _list(self, paths: Iterable[str], decode_q: Queue):
+        """
+        Estágio de listagem: alimenta a fila de decodificação.
+        """
+        try:
+            for path in paths:
+                if isinstance(path, IngestItem):
+                    decode_q.put(path)
+                elif isinstance(path, tuple):
+                    decode_q.put(IngestItem(str(path[0]), path[1]))
+                else:
+                    decode_q.put(IngestItem(str(path)))
+        except Exception as e:
+            logger.error(f"Error listing files for ingest: {str(e)}")
+        finally:
+            for _ in range(self.decode_workers):
+                decode_q.put(_DONE)
+
+    @staticmethod
+    def _failure(item: IngestItem, error: str) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "filename": item.filename,
+            "source_path": item.path,
+            "error": error
+        }
+
+    def _decode(self, in_q: Queue, out_q: Queue, result_q: Queue):
+        """
+        Estágio de decodificação: valida o nome do arquivo, lê o conteúdo (uma única leitura
+        para o hash e a decodificação), carrega a imagem e consulta o cache de faces.
+        """
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                return
+            try:
+                item.file_info = self.file_processor.parse_filename(item.filename)
+                if not item.file_info["valid"]:
+                    logger.warning(f"Skipping invalid file: {item.filename}")
+                    result_q.put(self._failure(item, "Invalid filename format"))
+                    continue
+
+                data = item.data
+                if data is None:
+                    with open(item.path, "rb") as f:
+                        data = f.read()
+                item.digest = content_digest(data=data)
+                item.image, item.scale = decode_image(data, self.file_processor.decode_target_size)
+                if item.image is None:
+                    logger.error(f"Failed to load image: {item.path}")
+                    result_q.put(self._failure(item, "Failed to load image"))
+                    continue
+
+                # Conteúdo já processado: a inferência é dispensada
+                item.face = self.file_processor.cached_face(item.digest, gate_quality=True)
+                if item.face is not None and not item.face.get("embedding"):
+                    # Face em cache reprovada pelos limites de qualidade atuais
+                    error = ingest_error([item.face])
+                    logger.warning(f"{error} in {item.filename}")
+                    result_q.put(self._failure(item, error))
+                    continue
+                out_q.put(item)
+            except Exception as e:
+                logger.error(f"Error decoding {item.path}: {str(e)}")
+                result_q.put(self._failure(item, str(e)))
+
+    def _infer(self, in_q: Queue, out_q: Queue, result_q: Queue):
+        """
+        Estágio de inferência: agrupa as imagens decodificadas em lotes para detecção e embedding.
+        Imagens com a face em cache passam direto para a persistência.
+        """
+        finished = False
+        while not finished:
+            item = in_q.get()
+            if item is _DONE:
+                return
+            batch = [item]
+            while len(batch) < self.inference_batch_size:
+                try:
+                    item = in_q.get_nowait()
+                except Empty:
+                    break
+                if item is _DONE:
+                    finished = True
+                    break
+                batch.append(item)
+
+            pending = []
+            for item in batch:
+                if item.face is not None:
+                    out_q.put(item)
+                else:
+                    pending.append(item)
+            batch = pending
+            if not batch:
+                continue
+
+            try:
+                all_faces = self.file_processor.face_processor.detect_faces_batch(
+                    [item.image for item in batch], gate_quality=True, scales=[item.scale for item in batch]
+                )
+            except Exception as e:
+                logger.error(f"Error in inference batch of {len(batch)} images: {str(e)}")
+                for item in batch:
+                    result_q.put(self._failure(item, str(e)))
+                continue
+
+            for item, faces in zip(batch, all_faces):
+                if not faces or not faces[0].get("embedding"):
+                    error = ingest_error(faces)
+                    logger.warning(f"{error} in {item.filename}")
+                    item.image = None
+                    item.data = None
+                    result_q.put(self._failure(item, error))
+                    continue
+                # Usar a primeira face (a mais proeminente)
+                item.face = faces[0]
+                out_q.put(item)
+
+    def _persist(self, in_q: Queue, out_q: Optional[Queue], result_q: Queue):
+        """
+        Estágio de persistência: cópia do arquivo, recorte alinhado e inclusão no índice.
+        """
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                return
+            try:
+                result = self.file_processor.persist_face(
+                    item.path, item.file_info, item.image, item.face,
+                    data=item.data, digest=item.digest, scale=item.scale
+                )
+            except Exception as e:
+                logger.error(f"Error persisting {item.path}: {str(e)}")
+                result = self._failure(item, str(e))
+            item.image = None
+            item.data = None
+            result_q.put(result)
+
+
+def iter_archive(path: str) -> Iterator[IngestItem]:
+    """
+    Lê as imagens de um arquivo zip ou tar (inclusive .tar.gz/.tgz) como fluxo, sem extraí-lo.
+    O tar é lido sequencialmente; cada item carrega o conteúdo do arquivo em memória e o
+    caminho "arquivo!membro" para identificação nos resultados.
+
+    Args:
+        path: Caminho do arquivo compactado
+
+    Returns:
+        Gerador de IngestItem com o conteúdo de cada imagem
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                yield IngestItem(f"{path}!{info.filename}", os.path.basename(info.filename), archive.read(info))
+    elif tarfile.is_tarfile(path):
+        with tarfile.open(path, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                member_file = archive.extractfile(member)
+                yield IngestItem(f"{path}!{member.name}", os.path.basename(member.name), member_file.read())
+    else:
+        raise ValueError(f"Unsupported archive format: {path}")
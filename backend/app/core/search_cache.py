@@ -0,0 +1,244 @@
+"""
+Caches em memória das buscas por imagem.
+
+Operadores repetem a mesma imagem de consulta com outro k ou ao paginar. O embedding da
+consulta fica em cache pelo hash do conteúdo (sem nova detecção) e a lista ranqueada mais
+longa já calculada fica em cache pelo hash do embedding, filtros e versão do índice: um k
+menor (ou uma página anterior) é uma fatia dela. Qualquer alteração do índice muda a
+versão e descarta os resultados anteriores. Os identificadores de consulta permitem paginar
+e refinar uma busca sem reenviar a imagem.
+"""
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Cache LRU limitado com expiração por tempo, seguro para uso entre threads.
+    """
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 600.0):
+        """
+        Args:
+            max_size: Número máximo de entradas
+            ttl_seconds: Tempo de vida de cada entrada
+        """
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def embedding_key(embedding: np.ndarray) -> str:
+    """
+    Chave de um embedding de consulta (hash dos bytes em float32).
+    """
+    return hashlib.sha1(np.ascontiguousarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+
+class SearchCache:
+    """
+    Cache dos embeddings de consulta (por hash do conteúdo) e dos resultados de busca.
+    """
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 600.0):
+        """
+        Args:
+            max_size: Número máximo de entradas de cada cache
+            ttl_seconds: Tempo de vida das entradas
+        """
+        self.probes = TTLCache(max_size, ttl_seconds)
+        self.results = TTLCache(max_size, ttl_seconds)
+        self._index_version = None
+        self._lock = threading.Lock()
+
+    def get_probe(self, digest: str) -> Optional[np.ndarray]:
+        return self.probes.get(digest)
+
+    def put_probe(self, digest: str, embedding: np.ndarray):
+        self.probes.put(digest, embedding)
+
+    def _check_version(self, index_version: Any):
+        """
+        Descarta os resultados quando a versão do índice muda (libera a memória das
+        entradas que não seriam mais encontradas).
+        """
+        with self._lock:
+            if index_version != self._index_version:
+                self.results.clear()
+                self._index_version = index_version
+
+    @staticmethod
+    def _result_key(embedding: np.ndarray, filters: Optional[Dict[str, Any]], index_version: Any) -> tuple:
+        return (embedding_key(embedding), tuple(sorted((filters or {}).items())), index_version)
+
+    def get_results(
+        self,
+        embedding: np.ndarray,
+        k: int,
+        index_version: Any,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Retorna uma cópia dos k primeiros resultados, se a lista em cache foi calculada com
+        ao menos k resultados (ou se esgotou o índice), ou None.
+        """
+        if index_version is None:
+            return None
+        self._check_version(index_version)
+        cached = self.results.get(self._result_key(embedding, filters, index_version))
+        if cached is None:
+            return None
+        cached_k, results = cached
+        if cached_k < k and len(results) >= cached_k:
+            return None
+        return [dict(result) for result in results[:k]]
+
+    def put_results(
+        self,
+        embedding: np.ndarray,
+        k: int,
+        index_version: Any,
+        results: List[Dict[str, Any]],
+        filters: Optional[Dict[str, Any]] = None
+    ):
+        if index_version is None:
+            return
+        self._check_version(index_version)
+        key = self._result_key(embedding, filters, index_version)
+        cached = self.results.get(key)
+        # Manter a lista mais longa: as buscas com k menor são fatias dela
+        if cached is not None and cached[0] >= k:
+            return
+        self.results.put(key, (k, [dict(result) for result in results]))
+
+
+# Subdiretório (do diretório temporário de uploads) com os embeddings das consultas
+QUERY_HANDLES_DIRNAME = "queries"
+
+_HANDLE_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class QueryHandleStore:
+    """
+    Identificadores de consulta: o embedding de uma busca por imagem fica guardado no
+    servidor por um tempo, e as páginas seguintes (ou a mesma busca com filtros) usam o
+    identificador em vez de enviar e processar a imagem de novo.
+
+    Os embeddings ficam em memória e em arquivos pequenos no diretório informado, de modo
+    que o identificador vale em qualquer worker da API.
+    """
+    def __init__(self, directory: str, ttl_seconds: float = 1800.0, max_size: int = 1024):
+        """
+        Args:
+            directory: Diretório dos arquivos das consultas
+            ttl_seconds: Tempo de vida de um identificador
+            max_size: Número máximo de consultas mantidas em memória
+        """
+        self.directory = directory
+        self.ttl = ttl_seconds
+        self._memory = TTLCache(max_size, ttl_seconds)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, handle: str) -> str:
+        return os.path.join(self.directory, f"{handle}.npz")
+
+    def create(self, embedding: np.ndarray, query_image: str) -> str:
+        """
+        Guarda o embedding de uma consulta e retorna o identificador.
+        """
+        handle = uuid.uuid4().hex
+        embedding = np.ascontiguousarray(embedding, dtype=np.float32)
+        path = self._path(handle)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, embedding=embedding, query_image=np.array(query_image))
+        os.replace(tmp_path, path)
+        self._memory.put(handle, (embedding, query_image))
+        return handle
+
+    def get(self, handle: str) -> Optional[Tuple[np.ndarray, str]]:
+        """
+        Retorna (embedding, nome da imagem de consulta), ou None se o identificador não
+        existe ou expirou.
+        """
+        if not _HANDLE_PATTERN.match(handle or ""):
+            return None
+        item = self._memory.get(handle)
+        if item is not None:
+            return item
+
+        # Consulta criada em outro worker
+        path = self._path(handle)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                item = (data["embedding"], str(data["query_image"]))
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        self._memory.put(handle, item)
+        return item
+
+    def purge_expired(self) -> int:
+        """
+        Remove os arquivos das consultas expiradas.
+
+        Returns:
+            Número de consultas removidas
+        """
+        return purge_expired_handles(self.directory, self.ttl)
+
+
+def purge_expired_handles(directory: str, ttl_seconds: float) -> int:
+    """
+    Remove os arquivos de consultas mais antigos que o tempo de vida.
+    """
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+    return removed
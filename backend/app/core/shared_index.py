@@ -0,0 +1,445 @@
+"""
+Índice FAISS compartilhado entre workers do uvicorn por meio de snapshots mapeados em memória.
+
+Apenas um processo (o escritor, eleito por um lock de arquivo) mantém o FaissIndex mutável.
+Ele publica periodicamente um snapshot somente leitura (IDs, vetores e metadados em arquivos
+.npy/.bin) que os demais workers abrem com mmap: as páginas ficam no cache do sistema
+operacional e são compartilhadas, de modo que a memória do índice é paga uma vez por host.
+A base (índice principal) só é regravada quando o índice principal é substituído ou
+compactado, ou quando acumulou muitas linhas novas; as demais publicações gravam apenas as
+linhas acrescentadas pelas fusões, os deltas e os tombstones.
+Os workers leitores fazem a busca localmente sobre o snapshot e encaminham as alterações
+(inclusões, remoções, gravação) ao escritor pelo mesmo protocolo usado pelos shards.
+
+O snapshot guarda os vetores brutos e a busca dos leitores é exata (força bruta), o mesmo
+que um índice plano: por isso este modo só aceita escritores com índice plano (L2). Um
+índice IVF ou HNSW no escritor seria pesquisado de forma diferente pelos leitores.
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import threading
+import logging
+import numpy as np
+import faiss
+from typing import List, Dict, Tuple, Optional, Any, Iterable
+from .faiss_index import FaissIndex
+from .faiss_shards import ShardClient
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILENAME = "CURRENT"
+
+# Descritor do lock de escritor, mantido aberto durante toda a vida do processo
+_writer_lock_file = None
+
+
+def acquire_writer_lock(processed_dir: str) -> bool:
+    """
+    Tenta tornar este processo o escritor do índice compartilhado.
+
+    Returns:
+        True se este processo detém (ou já detinha) o lock de escritor
+    """
+    global _writer_lock_file
+    if _writer_lock_file is not None:
+        return True
+
+    os.makedirs(processed_dir, exist_ok=True)
+    lock_file = open(os.path.join(processed_dir, "index_writer.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _writer_lock_file = lock_file
+    return True
+
+
+def _write_segment(
+    directory: str,
+    ids: np.ndarray,
+    vector_chunks: Iterable[np.ndarray],
+    metadatas: Iterable[Dict[str, Any]],
+    dimension: int
+):
+    """
+    Grava um segmento do snapshot (IDs ordenados, vetores e metadados JSON com offsets).
+    Os vetores são gravados em blocos, sem montar a matriz completa na memória.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "ids.npy"), ids)
+
+    vectors_path = os.path.join(directory, "vectors.npy")
+    if len(ids) == 0:
+        np.save(vectors_path, np.zeros((0, dimension), dtype=np.float32))
+    else:
+        vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=np.float32, shape=(len(ids), dimension))
+        position = 0
+        for chunk in vector_chunks:
+            vectors[position:position + len(chunk)] = chunk
+            position += len(chunk)
+        vectors.flush()
+        del vectors
+
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    with open(os.path.join(directory, "metadata.bin"), "wb") as f:
+        for position, metadata in enumerate(metadatas):
+            record = json.dumps(metadata, default=str).encode("utf-8")
+            f.write(record)
+            offsets[position + 1] = offsets[position] + len(record)
+    np.save(os.path.join(directory, "metadata_offsets.npy"), offsets)
+
+
+class _Segment:
+    """
+    Segmento de um snapshot aberto por um leitor: o segmento base é mapeado em memória e
+    o delta (pequeno) é carregado.
+    """
+    def __init__(self, directory: str, mmap: bool):
+        mmap_mode = "r" if mmap else None
+        self.metadata_offsets = np.load(os.path.join(directory, "metadata_offsets.npy"))
+        if len(self.metadata_offsets) > 1:
+            self.ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode=mmap_mode)
+            self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode=mmap_mode)
+            metadata_path = os.path.join(directory, "metadata.bin")
+            if mmap:
+                self.metadata_blob = np.memmap(metadata_path, dtype=np.uint8, mode="r")
+            else:
+                with open(metadata_path, "rb") as f:
+                    self.metadata_blob = np.frombuffer(f.read(), dtype=np.uint8)
+        else:
+            # Arquivos vazios não podem ser mapeados em memória
+            self.ids, self.vectors, self.metadata_blob = np.zeros(0, dtype=np.int64), None, None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def metadata_at(self, position: int) -> Dict[str, Any]:
+        start, end = int(self.metadata_offsets[position]), int(self.metadata_offsets[position + 1])
+        return json.loads(bytes(self.metadata_blob[start:end]))
+
+    def positions(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Posições dos IDs presentes no segmento (busca binária nos IDs ordenados).
+
+        Returns:
+            Máscara dos IDs encontrados e suas posições
+        """
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), dtype=bool), np.zeros(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        present = self.ids[positions] == ids
+        return present, positions[present]
+
+    def knn(self, queries: np.ndarray, k: int):
+        if self.vectors is None or k <= 0:
+            return None
+        return faiss.knn(queries, self.vectors, min(k, len(self.ids)))
+
+
+class SnapshotPublisher:
+    """
+    Publica snapshots do índice do escritor sempre que o conteúdo muda.
+
+    O snapshot tem duas partes: a base (linhas do índice principal, gravada em blocos) e o
+    delta (linhas acrescentadas ao índice principal desde a base, deltas e tombstones,
+    regravado a cada publicação). A base só é regravada quando o índice principal é
+    substituído ou compactado, ou quando o acréscimo passa do limite de FaissIndex; as
+    demais publicações não custam O(tamanho do índice).
+    """
+    def __init__(self, faiss_index: FaissIndex, snapshot_dir: str, interval: float = 5.0):
+        """
+        Args:
+            faiss_index: Índice mutável do escritor
+            snapshot_dir: Diretório onde os snapshots são publicados
+            interval: Intervalo mínimo, em segundos, entre publicações
+
+        Raises:
+            ValueError: Se o índice do escritor não é plano (os leitores fazem busca exata)
+        """
+        base_index = faiss.downcast_index(faiss_index.index.index)
+        if not isinstance(base_index, faiss.IndexFlat):
+            raise ValueError(
+                f"Shared index snapshots require a flat FAISS index, got index type {faiss_index.index_type}"
+            )
+        self.faiss_index = faiss_index
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self.published_version = None
+        self.base_generation = None
+        self.base_rows = 0
+        self.base_name = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Publica o snapshot inicial e inicia a thread de publicação.
+        """
+        self.publish()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.faiss_index.version != self.published_version:
+                    self.publish()
+            except Exception as e:
+                logger.error(f"Error publishing index snapshot: {str(e)}")
+
+    def _publish_base(self, generation: int, main_index, ids: np.ndarray) -> str:
+        """
+        Grava as linhas atuais do índice principal como segmento base.
+        """
+        name = f"base_{int(time.time() * 1000)}_{generation}"
+        tmp_dir = os.path.join(self.snapshot_dir, f".{name}.tmp")
+        chunks = self.faiss_index.iter_main_vectors(main_index, generation, ids)
+        sorted_ids = np.sort(ids)
+        # Metadados dos IDs removidos ficam vazios: eles são mascarados pelos tombstones
+        metadatas = (self.faiss_index.get_metadata(int(id_val)) or {} for id_val in sorted_ids.tolist())
+        _write_segment(tmp_dir, sorted_ids, (vectors for _, vectors in chunks), metadatas, self.faiss_index.dimension)
+        os.replace(tmp_dir, os.path.join(self.snapshot_dir, name))
+        logger.info(f"Published index snapshot base {name} with {len(ids)} embeddings")
+        return name
+
+    def publish(self):
+        """
+        Grava o delta (e a base, se necessário) e os torna atuais de forma atômica.
+        """
+        version = self.faiss_index.version
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        state = self.faiss_index.export_deltas(self.base_generation, self.base_rows)
+        if state["rebase"]:
+            self.base_name = self._publish_base(state["generation"], state["main_index"], state["main_ids"])
+            self.base_generation, self.base_rows = state["generation"], state["main_rows"]
+            # Exportar de novo em relação à nova base (linhas acrescentadas enquanto ela era gravada)
+            state = self.faiss_index.export_deltas(self.base_generation, self.base_rows)
+            if state["rebase"]:
+                raise RuntimeError("Main FAISS index changed while the snapshot base was being published")
+
+        name = f"delta_{int(time.time() * 1000)}_{version}"
+        tmp_dir = os.path.join(self.snapshot_dir, f".{name}.tmp")
+        _write_segment(
+            tmp_dir, state["delta_ids"], [state["delta_vectors"]], state["delta_metadatas"], self.faiss_index.dimension
+        )
+        np.save(os.path.join(tmp_dir, "removed.npy"), state["tombstones"])
+        os.replace(tmp_dir, os.path.join(self.snapshot_dir, name))
+
+        current_tmp = os.path.join(self.snapshot_dir, f".{CURRENT_FILENAME}.tmp")
+        with open(current_tmp, "w") as f:
+            json.dump({"base": self.base_name, "delta": name}, f)
+        os.replace(current_tmp, os.path.join(self.snapshot_dir, CURRENT_FILENAME))
+        self.published_version = version
+
+        self._remove_old_snapshots(keep={self.base_name, name})
+        logger.info(f"Published index snapshot {name} with {len(state['delta_ids'])} delta embeddings")
+
+    def _remove_old_snapshots(self, keep: set):
+        """
+        Remove snapshots antigos. Workers que ainda os mapeiam continuam acessando os
+        arquivos até reabrirem o snapshot atual (arquivos removidos seguem mapeados).
+        """
+        for entry in os.scandir(self.snapshot_dir):
+            if entry.is_dir() and entry.name not in keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class SharedFaissIndex:
+    """
+    Visão somente leitura do índice para workers leitores, com a mesma interface de FaissIndex.
+
+    As buscas são exatas (L2) sobre a base mapeada em memória e o delta, descartando os
+    IDs removidos, equivalentes às do índice plano do escritor; as alterações são encaminhadas ao processo escritor e ficam visíveis
+    após a próxima publicação.
+    """
+    def __init__(self, snapshot_dir: str, writer_address: str, authkey: bytes, dimension: int = 512):
+        """
+        Args:
+            snapshot_dir: Diretório dos snapshots publicados pelo escritor
+            writer_address: Endereço do servidor de índice do escritor
+            authkey: Chave de autenticação do servidor de índice
+            dimension: Dimensão dos embeddings
+        """
+        self.snapshot_dir = snapshot_dir
+        self.dimension = dimension
+        self.writer = ShardClient(writer_address, authkey)
+        self.snapshot_name = None
+        self.base_name = None
+        self.base = None
+        self.delta = None
+        self.removed = np.zeros(0, dtype=np.int64)
+        self._current_mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @property
+    def version(self) -> Optional[str]:
+        """
+        Versão do índice visível neste worker (nome do delta atual).
+        """
+        self.refresh()
+        return self.snapshot_name
+
+    def refresh(self):
+        """
+        Reabre o snapshot atual se o escritor publicou um novo (verificação por stat). A
+        base só é remapeada quando muda (após uma fusão).
+        """
+        current_path = os.path.join(self.snapshot_dir, CURRENT_FILENAME)
+        try:
+            mtime = os.stat(current_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._current_mtime:
+            return
+
+        with self._lock:
+            if mtime == self._current_mtime:
+                return
+            try:
+                with open(current_path) as f:
+                    current = json.load(f)
+                base = self.base
+                if current["base"] != self.base_name:
+                    base = _Segment(os.path.join(self.snapshot_dir, current["base"]), mmap=True)
+                delta_path = os.path.join(self.snapshot_dir, current["delta"])
+                delta = _Segment(delta_path, mmap=False)
+                removed = np.load(os.path.join(delta_path, "removed.npy"))
+            except (FileNotFoundError, ValueError, KeyError):
+                # Snapshot substituído durante a leitura (ou de um formato anterior):
+                # tentar novamente na próxima busca
+                return
+
+            self.base, self.delta, self.removed = base, delta, removed
+            self.base_name = current["base"]
+            self.snapshot_name = current["delta"]
+            self._current_mtime = mtime
+        logger.info(
+            f"Attached to index snapshot {self.snapshot_name} "
+            f"({len(base)} base and {len(delta)} delta embeddings, {len(removed)} removed)"
+        )
+
+    def _locate(self, faiss_id: int) -> Optional[Tuple["_Segment", int]]:
+        """
+        Segmento e posição de um ID ativo no snapshot.
+        """
+        ids = np.array([faiss_id], dtype=np.int64)
+        for segment in (self.delta, self.base):
+            if segment is None:
+                continue
+            if segment is self.base and np.isin(ids, self.removed)[0]:
+                return None
+            present, positions = segment.positions(ids)
+            if present[0]:
+                return segment, int(positions[0])
+        return None
+
+    def search(self, query_embedding: np.ndarray, k: int = 5) -> Tuple[List[float], List[Dict[str, Any]]]:
+        """
+        Busca os k embeddings mais próximos no snapshot mapeado em memória.
+        """
+        return self.search_batch(np.asarray(query_embedding).reshape(1, -1), k)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int = 5) -> List[Tuple[List[float], List[Dict[str, Any]]]]:
+        """
+        Busca várias consultas de uma vez na base e no delta do snapshot.
+        """
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32)
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        self.refresh()
+        base, delta, removed = self.base, self.delta, self.removed
+        if base is None:
+            return [([], []) for _ in range(len(query_embeddings))]
+
+        # Buscar k + removidos na base compensa os IDs descartados (limitado pelas fusões)
+        candidates = [
+            (segment, found, mask)
+            for segment, found, mask in (
+                (base, base.knn(query_embeddings, k + len(removed)), True),
+                (delta, delta.knn(query_embeddings, k), False),
+            )
+            if found is not None
+        ]
+
+        results = []
+        for row in range(len(query_embeddings)):
+            merged = []
+            for segment, (distances, positions), mask in candidates:
+                row_positions = positions[row]
+                row_positions = row_positions[row_positions != -1]
+                keep = ~np.isin(segment.ids[row_positions], removed) if mask and len(removed) else slice(None)
+                for distance, position in zip(distances[row][:len(row_positions)][keep].tolist(), row_positions[keep].tolist()):
+                    merged.append((distance, segment, position))
+            merged.sort(key=lambda item: item[0])
+            best = merged[:k]
+            results.append((
+                [distance for distance, _, _ in best],
+                [segment.metadata_at(position) for _, segment, position in best]
+            ))
+        return results
+
+    def get_metadata(self, faiss_id: int) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        located = self._locate(int(faiss_id))
+        return located[0].metadata_at(located[1]) if located else None
+
+    def get_embeddings(self, ids: List[int]) -> Tuple[List[int], np.ndarray]:
+        """
+        Lê os embeddings de alguns IDs no snapshot (delta e base mapeada em memória).
+        """
+        self.refresh()
+        found = []
+        vectors = []
+        for faiss_id in ids:
+            located = self._locate(int(faiss_id))
+            if located is not None:
+                segment, position = located
+                found.append(int(faiss_id))
+                vectors.append(np.asarray(segment.vectors[position], dtype=np.float32))
+        if not vectors:
+            return [], np.empty((0, self.dimension), dtype=np.float32)
+        return found, np.vstack(vectors)
+
+    def get_total_items(self) -> int:
+        self.refresh()
+        if self.base is None:
+            return 0
+        return len(self.base) - len(self.removed) + len(self.delta)
+
+    # Alterações e consultas autoritativas são feitas no processo escritor
+
+    def add_embedding(self, embedding: np.ndarray, metadata: Dict[str, Any]) -> int:
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        return self.writer.call("add_embeddings", embedding, [metadata])[0]
+
+    def add_embeddings(self, embeddings: np.ndarray, metadatas: List[Dict[str, Any]]) -> List[int]:
+        return self.writer.call("add_embeddings", np.asarray(embeddings, dtype=np.float32), metadatas)
+
+    def remove_ids(self, ids: List[int]) -> int:
+        return self.writer.call("remove_ids", [int(faiss_id) for faiss_id in ids])
+
+    def get_ids(self) -> np.ndarray:
+        return self.writer.call("get_ids")
+
+    def merge_delta(self) -> int:
+        return self.writer.call("merge_delta")
+
+    def clear(self):
+        self.writer.call("clear")
+
+    def save(self, index_path: str, metadata_path: str):
+        # O escritor grava nos seus próprios caminhos (os mesmos em PROCESSED_DIR)
+        self.writer.call("save")
+
+    def load(self, index_path: str, metadata_path: str) -> bool:
+        self.refresh()
+        return self.snapshot_name is not None
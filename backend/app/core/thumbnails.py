@@ -0,0 +1,76 @@
+"""
+Miniaturas das imagens processadas, em alguns tamanhos fixos.
+
+As miniaturas ficam em <processados>/thumbnails/<tamanho>/, com o mesmo layout por hash
+das imagens (image_store.resolve_filename), sempre em JPEG. São geradas na ingestão
+(THUMBNAILS_AT_INGEST) ou na primeira requisição, a partir da imagem decodificada em
+resolução reduzida (image_decode), e depois servidas diretamente do disco.
+"""
+import os
+import logging
+import numpy as np
+from typing import Optional, Tuple
+from .image_store import resolve_filename, store_file, is_content_addressed
+from .image_decode import read_image, fit_long_edge, encode_image
+
+logger = logging.getLogger(__name__)
+
+# Subdiretório do diretório de processados com as miniaturas
+THUMBNAILS_DIRNAME = "thumbnails"
+THUMBNAIL_QUALITY = 85
+
+
+def parse_sizes(value: str) -> Tuple[int, ...]:
+    """
+    Tamanhos de miniatura configurados ("128,256,512"), em ordem crescente.
+    """
+    return tuple(sorted({int(size) for size in value.split(",") if size.strip() and int(size) > 0}))
+
+
+def configured_sizes() -> Tuple[int, ...]:
+    """
+    Tamanhos de miniatura das configurações (THUMBNAIL_SIZES).
+    """
+    from ..config import settings
+    return parse_sizes(settings.THUMBNAIL_SIZES)
+
+
+def thumbnail_path(root: str, filename: str, size: int) -> str:
+    """
+    Caminho da miniatura de uma imagem processada.
+    """
+    # Nomes antigos mantêm a extensão original (evita colisão entre foto.png e foto.jpg)
+    name = f"{os.path.splitext(filename)[0]}.jpg" if is_content_addressed(filename) else f"{filename}.jpg"
+    return resolve_filename(os.path.join(root, THUMBNAILS_DIRNAME, str(size)), name)
+
+
+def write_thumbnail(img: np.ndarray, path: str, size: int):
+    """
+    Grava a miniatura (maior lado com no máximo size pixels) de uma imagem já decodificada.
+    """
+    store_file(path, data=encode_image(fit_long_edge(img, size), "jpeg", THUMBNAIL_QUALITY))
+
+
+def get_thumbnail(source_path: str, root: str, filename: str, size: int) -> Optional[str]:
+    """
+    Caminho da miniatura de uma imagem, gerando-a se ainda não existe.
+
+    Args:
+        source_path: Caminho da imagem processada
+        root: Diretório de processados
+        filename: Nome da imagem processada
+        size: Tamanho da miniatura (maior lado)
+
+    Returns:
+        Caminho da miniatura, ou None se a imagem não pôde ser decodificada
+    """
+    path = thumbnail_path(root, filename, size)
+    if os.path.exists(path):
+        return path
+
+    img, _ = read_image(source_path, size)
+    if img is None:
+        logger.error(f"Failed to load image for thumbnail: {source_path}")
+        return None
+    write_thumbnail(img, path, size)
+    return path
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from .config import settings
@@ -22,4 +22,43 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Colunas adicionadas a tabelas já existentes (create_all não altera tabelas criadas)
+SCHEMA_UPGRADES = {
+    "batch_uploads": {
+        "failed_files": "INTEGER DEFAULT 0",
+        "start_processed_files": "INTEGER DEFAULT 0",
+        "error": "VARCHAR",
+        "started_at": "TIMESTAMP",
+        "finished_at": "TIMESTAMP",
+        "runner_id": "VARCHAR",
+        "heartbeat_at": "TIMESTAMP",
+    },
+    "batch_files": {
+        "source_ctime_ns": "BIGINT",
+    },
+    "person_images": {
+        "content_hash": "VARCHAR",
+        "quality_flags": "VARCHAR",
+    },
+}
+
+# Índices adicionados a colunas de tabelas já existentes
+SCHEMA_INDEXES = {
+    "ix_person_images_filename": ("person_images", "filename"),
+    "ix_person_images_content_hash": ("person_images", "content_hash"),
+}
+
+def upgrade_schema():
+    """Adiciona as colunas e índices novos que ainda não existem nas tabelas do banco."""
+    with engine.begin() as connection:
+        for table_name, columns in SCHEMA_UPGRADES.items():
+            for column_name, column_type in columns.items():
+                connection.execute(text(
+                    f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column_name} {column_type}"
+                ))
+        for index_name, (table_name, column_name) in SCHEMA_INDEXES.items():
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_name})"
+            ))
@@ -7,9 +7,10 @@ import logging
 
 from .api.router import api_router
 from .config import settings
-from .database import engine, Base, SessionLocal
-from .core.dependencies import init_processors
+from .database import engine, Base, SessionLocal, upgrade_schema
+from .core.dependencies import init_processors, is_index_writer
 from .tasks.scheduled_tasks import start_scheduler
+from .tasks.batch_jobs import start_job_runner
 from .models.user import User, UserType
 from .core.security import hash_password
 from .models.local import Estado, Orgao
@@ -46,6 +47,9 @@ try:
     Base.metadata.create_all(bind=engine)
     logger.info("Database tables created or already exist")
     
+    # Adicionar colunas novas às tabelas existentes
+    upgrade_schema()
+    
     # Verificar tabelas após a criação
     inspector = inspect(engine)
     tables = inspector.get_table_names()
@@ -119,8 +123,13 @@ async def startup_event():
         models_dir=settings.MODELS_DIR
     )
     
-    # Iniciar scheduler em uma thread separada
-    threading.Thread(target=start_scheduler, daemon=True).start()
+    # Iniciar scheduler em uma thread separada (apenas no escritor do índice,
+    # para que as tarefas não rodem uma vez por worker)
+    if is_index_writer():
+        threading.Thread(target=start_scheduler, daemon=True).start()
+        
+        # Executor dos lotes enfileirados (inclusive os interrompidos por uma parada anterior)
+        start_job_runner()
 
 @app.get("/")
 def read_root():
@@ -1,4 +1,5 @@
 # Importar todos os modelos para garantir que sejam registrados com Base
-from .person import Person
+from .person import Person, PersonImage, BatchUpload, BatchFile
+from .index_job import IndexJob
 from .settings import Settings
 from .local import Estado, Orgao
\ No newline at end of file
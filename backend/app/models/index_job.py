@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from datetime import datetime
+import uuid
+from ..database import Base
+
+class IndexJob(Base):
+    """
+    Modelo para os jobs de manutenção do índice FAISS (ex.: reconciliação) pedidos pela API
+    e executados pelo processo escritor do índice.
+    """
+    __tablename__ = "index_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, unique=True, index=True, default=lambda: uuid.uuid4().hex)
+    kind = Column(String, index=True)  # reconcile
+    status = Column(String, default='queued', index=True)  # queued, processing, completed, failed
+    result = Column(Text, nullable=True)  # Resultado do job em JSON
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
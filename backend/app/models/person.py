@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, Boolean, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
@@ -37,14 +37,16 @@ class PersonImage(Base):
     registro_unico = Column(String, ForeignKey("persons.registro_unico"), index=True)
     
     # Informações do arquivo
-    filename = Column(String)
+    filename = Column(String, index=True)
     file_path = Column(String)
     original_filename = Column(String)  # Nome original do arquivo
+    content_hash = Column(String, index=True)  # SHA-256 do conteúdo (detecção de duplicatas)
     
     # Informações do processamento
     processed = Column(Boolean, default=False)
     processed_date = Column(DateTime, default=None, nullable=True)
     face_detected = Column(Boolean, default=False)
+    quality_flags = Column(String, nullable=True)  # Critérios de qualidade não atendidos (ex.: "blur,pose")
     
     # Informações do FAISS
     faiss_id = Column(Integer, nullable=True)
@@ -64,8 +66,31 @@ class BatchUpload(Base):
     __tablename__ = "batch_uploads"
     id = Column(Integer, primary_key=True, index=True)
     batch_id = Column(String, unique=True, index=True)
-    status = Column(String, default='pending')  # pending, processing, completed, failed
+    status = Column(String, default='pending')  # pending, queued, processing, completed, failed
     total_files = Column(Integer)
-    processed_files = Column(Integer, default=0)
+    processed_files = Column(Integer, default=0)  # Arquivos concluídos (com sucesso ou falha)
+    failed_files = Column(Integer, default=0)
+    start_processed_files = Column(Integer, default=0)  # processed_files no início da execução atual
+    error = Column(String, nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    runner_id = Column(String, nullable=True)  # Executor que reservou o lote em processamento
+    heartbeat_at = Column(DateTime, nullable=True)  # Última renovação da reserva pelo executor
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BatchFile(Base):
+    """Modelo para o status de cada arquivo de um upload em lote (permite retomar o lote)"""
+    __tablename__ = "batch_files"
+    __table_args__ = (UniqueConstraint("batch_id", "filename", name="uq_batch_files_batch_filename"),)
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String, ForeignKey("batch_uploads.batch_id", ondelete="CASCADE"), index=True)
+    filename = Column(String)  # Nome do arquivo no diretório de uploads
+    original_filename = Column(String)
+    status = Column(String, default='pending', index=True)  # pending, done, failed
+    error = Column(String, nullable=True)
+    faiss_id = Column(Integer, nullable=True)
+    image_id = Column(Integer, ForeignKey("person_images.id", ondelete="SET NULL"), nullable=True)
+    source_ctime_ns = Column(BigInteger, nullable=True)  # ctime do arquivo registrado (detecta um novo arquivo com o mesmo nome)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -22,6 +22,7 @@ class PersonImageBase(BaseModel):
     processed: bool = Field(True, description="Status de processamento")
     face_detected: bool = Field(True, description="Se uma face foi detectada")
     faiss_id: Optional[int] = Field(None, description="ID no índice FAISS")
+    quality_flags: Optional[str] = Field(None, description="Critérios de qualidade não atendidos pela face")
 
 class PersonCreate(PersonBase):
     """
@@ -99,9 +100,47 @@ class SearchResponse(BaseModel):
     """Esquema para resposta de busca."""
     success: bool
     query_image: str
+    query_handle: Optional[str] = None  # Identificador para paginar/refinar sem reenviar a imagem
+    offset: int = 0
+    has_more: Optional[bool] = None
+    fusion: Optional[str] = None  # Combinação usada na busca com várias imagens
+    skipped_images: List[str] = []  # Imagens da busca combinada sem face detectada
     results: List[SearchResult] = []
     error: Optional[str] = None
 
+class FaceSearchResult(BaseModel):
+    """Esquema para os resultados de busca de uma das faces da imagem de consulta."""
+    face_index: int
+    bbox: List[int]
+    score: float
+    query_handle: Optional[str] = None
+    has_more: Optional[bool] = None
+    results: List[SearchResult] = []
+
+class MultiFaceSearchResponse(BaseModel):
+    """Esquema para resposta de busca de todas as faces de uma imagem."""
+    success: bool
+    query_image: str
+    faces: List[FaceSearchResult] = []
+    error: Optional[str] = None
+
+class VerifyScore(BaseModel):
+    """Esquema para a similaridade com uma das imagens comparadas na verificação."""
+    filename: str
+    score: float
+
+class VerifyResponse(BaseModel):
+    """Esquema para resposta de verificação 1:1."""
+    success: bool
+    score: Optional[float] = None  # Maior similaridade de cosseno encontrada
+    threshold: Optional[float] = None
+    match: Optional[bool] = None
+    registro_unico: Optional[str] = None
+    person_name: Optional[str] = None
+    best_match: Optional[str] = None
+    scores: List[VerifyScore] = []
+    error: Optional[str] = None
+
 class BatchProcessResponse(BaseModel):
     """Esquema para resposta de processamento em lote."""
     success: bool
@@ -0,0 +1,499 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models.person import BatchUpload, BatchFile
+from ..core.directory_scanner import ScanEntry, DirectoryWatcher, scan_images
+from .ingest_service import save_processed_images, remove_ingested_sources
+
+logger = logging.getLogger(__name__)
+
+# Lote usado pelo processamento do diretório de uploads (/persons/batch-process/)
+DIRECTORY_BATCH_ID = "upload-dir"
+
+# Tamanho dos blocos de nomes nas consultas IN do registro de arquivos
+REGISTER_CHUNK_SIZE = 1000
+
+
+def batch_prefix(batch_id: str) -> str:
+    """
+    Prefixo dos arquivos de um lote no diretório de uploads.
+    """
+    return "" if batch_id == DIRECTORY_BATCH_ID else f"{batch_id}_"
+
+
+def register_batch_files(
+    db: Session,
+    batch: BatchUpload,
+    upload_dir: str,
+    entries: Optional[List[ScanEntry]] = None
+) -> int:
+    """
+    Cria as linhas de status (pending) para os arquivos do lote que ainda não estão registrados.
+    Arquivos já registrados mantêm o status, de modo que um lote retomado não os reprocessa,
+    exceto quando o nome reaparece com um ctime mais recente (um novo arquivo deixado com o
+    mesmo nome): a linha volta para pending.
+
+    Args:
+        db: Sessão do banco de dados
+        batch: Lote de upload
+        upload_dir: Diretório onde os arquivos do lote estão salvos
+        entries: Arquivos a registrar (ex.: novos arquivos vindos do observador); se omitido,
+            o diretório é varrido uma vez
+
+    Returns:
+        Número de arquivos registrados (novos ou reabertos) nesta chamada
+    """
+    prefix = batch_prefix(batch.batch_id)
+    if entries is None:
+        entries = scan_images(upload_dir, prefix=prefix)
+    ctimes = {entry.name: entry.ctime_ns for entry in entries}
+    filenames = list(ctimes)
+    if batch.batch_id == DIRECTORY_BATCH_ID:
+        filenames = _exclude_batch_uploads(db, filenames)
+
+    # Verificar apenas os nomes candidatos, em blocos
+    registered = {}
+    for start in range(0, len(filenames), REGISTER_CHUNK_SIZE):
+        for row in db.query(
+            BatchFile.id, BatchFile.filename, BatchFile.status, BatchFile.source_ctime_ns, BatchFile.created_at
+        ).filter(
+            BatchFile.batch_id == batch.batch_id,
+            BatchFile.filename.in_(filenames[start:start + REGISTER_CHUNK_SIZE])
+        ):
+            registered[row.filename] = row
+
+    new_rows = [
+        {
+            "batch_id": batch.batch_id,
+            "filename": filename,
+            "original_filename": filename[len(prefix):],
+            "status": "pending",
+            "source_ctime_ns": ctimes[filename]
+        }
+        for filename in filenames if filename not in registered
+    ]
+    if new_rows:
+        db.bulk_insert_mappings(BatchFile, new_rows)
+
+    reopened = [
+        {
+            "id": row.id,
+            "status": "pending",
+            "error": None,
+            "faiss_id": None,
+            "image_id": None,
+            "source_ctime_ns": ctimes[filename]
+        }
+        for filename, row in registered.items() if _is_new_arrival(row, ctimes[filename])
+    ]
+    if reopened:
+        db.bulk_update_mappings(BatchFile, reopened)
+        logger.info(f"Batch {batch.batch_id}: {len(reopened)} files dropped again under a known name, reset to pending")
+    db.commit()
+    return len(new_rows) + len(reopened)
+
+
+def _is_new_arrival(row, ctime_ns: int) -> bool:
+    """
+    Indica se o arquivo com o nome de uma linha já registrada chegou depois do registro.
+    Linhas registradas antes da coluna source_ctime_ns são comparadas com created_at.
+    """
+    if row.source_ctime_ns is not None:
+        return ctime_ns > row.source_ctime_ns
+    if row.status == "pending" or row.created_at is None:
+        return False
+    return ctime_ns > int((row.created_at - datetime(1970, 1, 1)).total_seconds() * 1e9)
+
+
+def _exclude_batch_uploads(db: Session, filenames: List[str]) -> List[str]:
+    """
+    Remove da lista os arquivos que pertencem a uploads em lote ("<batch_id>_<nome>"),
+    que ficam no mesmo diretório mas são processados pelos seus próprios lotes.
+    """
+    prefixes = list({filename.split("_", 1)[0] for filename in filenames if "_" in filename})
+    batch_ids = set()
+    for start in range(0, len(prefixes), REGISTER_CHUNK_SIZE):
+        batch_ids.update(row[0] for row in db.query(BatchUpload.batch_id).filter(
+            BatchUpload.batch_id.in_(prefixes[start:start + REGISTER_CHUNK_SIZE])
+        ))
+    return [filename for filename in filenames if filename.split("_", 1)[0] not in batch_ids]
+
+
+def register_uploaded_file(db: Session, batch: BatchUpload, filename: str, ctime_ns: Optional[int] = None):
+    """
+    Registra um arquivo recebido por /persons/upload-file/ (já salvo com o prefixo do lote).
+    """
+    exists = db.query(BatchFile.id).filter(
+        BatchFile.batch_id == batch.batch_id,
+        BatchFile.filename == filename
+    ).first()
+    if not exists:
+        db.add(BatchFile(
+            batch_id=batch.batch_id,
+            filename=filename,
+            original_filename=filename[len(batch_prefix(batch.batch_id)):],
+            status='pending',
+            source_ctime_ns=ctime_ns
+        ))
+        db.commit()
+
+
+def has_batch_files(db: Session, batch: BatchUpload, status: Optional[str] = None) -> bool:
+    query = db.query(BatchFile.id).filter(BatchFile.batch_id == batch.batch_id)
+    if status:
+        query = query.filter(BatchFile.status == status)
+    return query.first() is not None
+
+
+def process_batch_upload(
+    db: Session,
+    batch: BatchUpload,
+    file_processor,
+    max_workers: int = 4,
+    sink_chunk_size: int = 500,
+    remove_sources: bool = False,
+    runner_id: Optional[str] = None,
+    cancel: Optional[threading.Event] = None
+) -> Dict[str, Any]:
+    """
+    Processa os arquivos pendentes de um lote, registrando o progresso no banco a cada bloco.
+
+    Cada bloco de resultados do pipeline é gravado em uma única transação: pessoas e imagens,
+    status de cada arquivo e contadores do lote. Se o processo for interrompido, os arquivos já
+    concluídos ficam marcados e uma nova chamada processa apenas os pendentes. Se o banco
+    rejeita o bloco, ele é gravado linha a linha: só os arquivos rejeitados ficam como failed,
+    e seus embeddings são removidos do índice.
+
+    Com runner_id, cada transação confirma antes que o lote ainda está reservado por este
+    executor (ver heartbeat_batch). Se a reserva foi perdida (o lote voltou à fila e pode
+    estar com outro executor), nada mais é gravado e a ingestão é interrompida.
+
+    Args:
+        db: Sessão do banco de dados
+        batch: Lote de upload
+        file_processor: Instância do FileProcessor
+        max_workers: Número de workers de decodificação do pipeline
+        sink_chunk_size: Arquivos gravados (e contabilizados no progresso) por transação
+        remove_sources: Remover os arquivos de upload registrados com sucesso, após cada commit
+        runner_id: Executor que reservou o lote (claim_next_batch)
+        cancel: Evento que interrompe a ingestão (definido também quando a reserva é perdida)
+
+    Returns:
+        Dicionário com as estatísticas desta execução e os contadores do lote
+    """
+    upload_dir = file_processor.upload_dir
+    total = db.query(func.count(BatchFile.id)).filter(BatchFile.batch_id == batch.batch_id).scalar()
+    batch.total_files = max(batch.total_files or 0, total)
+    batch.status = 'processing'
+    batch.started_at = datetime.utcnow()
+    batch.finished_at = None
+    batch.error = None
+    batch.start_processed_files = batch.processed_files or 0
+    db.commit()
+
+    pending = db.query(BatchFile.id, BatchFile.filename, BatchFile.original_filename).filter(
+        BatchFile.batch_id == batch.batch_id,
+        BatchFile.status == 'pending'
+    ).all()
+    file_ids = {os.path.join(upload_dir, row.filename): row.id for row in pending}
+    logger.info(f"Batch {batch.batch_id}: {len(pending)} pending files")
+    recorded = 0
+    cancel = cancel or threading.Event()
+
+    def paths():
+        for row in pending:
+            if cancel.is_set():
+                return
+            yield os.path.join(upload_dir, row.filename), row.original_filename
+
+    def sink(chunk: List[Dict[str, Any]]):
+        nonlocal recorded
+        if cancel.is_set():
+            return
+        now = datetime.utcnow()
+        chunk = [result for result in chunk if result.get("source_path") in file_ids]
+        successes = [result for result in chunk if result["success"]]
+        failures = [result for result in chunk if not result["success"]]
+
+        try:
+            saved = list(zip(successes, save_processed_images(db, successes)))
+            rejected = []
+        except Exception as e:
+            # Uma linha inválida não deve descartar o bloco: gravar linha a linha (savepoints)
+            db.rollback()
+            logger.warning(f"Batch {batch.batch_id}: chunk insert failed ({str(e)}), retrying row by row")
+            saved, rejected = _save_rows(db, successes)
+
+        try:
+            updates = [
+                {
+                    "id": file_ids[result["source_path"]],
+                    "status": "done",
+                    "faiss_id": result.get("faiss_id"),
+                    "image_id": image_id,
+                    "updated_at": now
+                }
+                for result, image_id in saved
+            ]
+            updates += [
+                {
+                    "id": file_ids[result["source_path"]],
+                    "status": "failed",
+                    "error": error,
+                    "updated_at": now
+                }
+                for result, error in rejected + [(result, result.get("error")) for result in failures]
+            ]
+            failed = len(failures) + len(rejected)
+
+            db.bulk_update_mappings(BatchFile, updates)
+            batch.processed_files = (batch.processed_files or 0) + len(updates)
+            batch.failed_files = (batch.failed_files or 0) + failed
+            if not _holds_lease(db, batch, runner_id):
+                # Os embeddings do bloco ficam órfãos no índice e são removidos pela reconciliação
+                db.rollback()
+                cancel.set()
+                logger.warning(f"Batch {batch.batch_id}: lease lost, discarding {len(updates)} results")
+                return
+            db.commit()
+            recorded += len(updates)
+        except Exception:
+            # Os arquivos do bloco continuam pendentes e serão reprocessados ao retomar o lote
+            db.rollback()
+            raise
+
+        # Embeddings das linhas rejeitadas não têm imagem no banco
+        rejected_ids = [result["faiss_id"] for result, _ in rejected if result.get("faiss_id") is not None]
+        if rejected_ids:
+            file_processor.faiss_index.remove_ids(rejected_ids)
+
+        remove_ingested_sources([result for result, _ in saved], remove_all=remove_sources)
+
+    result = file_processor.process_files(
+        paths(),
+        max_workers=max_workers,
+        sink=sink,
+        collect_details=False,
+        sink_chunk_size=sink_chunk_size
+    )
+
+    if cancel.is_set() or not _holds_lease(db, batch, runner_id):
+        # Outro executor é o dono do lote agora: não alterar o seu status
+        db.rollback()
+        logger.warning(f"Batch {batch.batch_id}: stopped after losing its lease")
+        result.update(
+            batch_id=batch.batch_id,
+            status="lease_lost",
+            total_files=batch.total_files,
+            processed_files=batch.processed_files,
+            failed_files=batch.failed_files
+        )
+        return result
+
+    # Os contadores são recalculados a partir das linhas, que são a fonte de verdade
+    counts = dict(db.query(BatchFile.status, func.count(BatchFile.id)).filter(
+        BatchFile.batch_id == batch.batch_id
+    ).group_by(BatchFile.status).all())
+    batch.total_files = max(batch.total_files or 0, sum(counts.values()))
+    batch.processed_files = counts.get("done", 0) + counts.get("failed", 0)
+    batch.failed_files = counts.get("failed", 0)
+    unrecorded = len(pending) - recorded
+    if unrecorded:
+        batch.status = 'failed'
+        batch.error = f"{unrecorded} files could not be recorded and remain pending"
+    elif counts.get("pending"):
+        # Arquivos registrados durante a execução (ex.: pelo observador da pasta de uploads)
+        batch.status = 'queued'
+    else:
+        batch.status = 'completed'
+    batch.finished_at = datetime.utcnow()
+    batch.runner_id = None
+    db.commit()
+
+    result.update(
+        batch_id=batch.batch_id,
+        status=batch.status,
+        total_files=batch.total_files,
+        processed_files=batch.processed_files,
+        failed_files=batch.failed_files
+    )
+    return result
+
+
+def _save_rows(
+    db: Session,
+    results: List[Dict[str, Any]]
+) -> Tuple[List[Tuple[Dict[str, Any], int]], List[Tuple[Dict[str, Any], str]]]:
+    """
+    Grava os resultados um a um, cada um em um savepoint, isolando as linhas que o banco
+    rejeita. O commit fica a cargo de quem chama.
+
+    Returns:
+        Resultados gravados com o ID da imagem e resultados rejeitados com o erro
+    """
+    saved = []
+    rejected = []
+    for result in results:
+        try:
+            with db.begin_nested():
+                image_ids = save_processed_images(db, [result])
+            saved.append((result, image_ids[0]))
+        except Exception as e:
+            logger.error(f"Could not record {result.get('original_filename')}: {str(e)}")
+            rejected.append((result, f"Database error: {str(e)}"))
+    return saved, rejected
+
+
+def watch_upload_dir(db: Session, watcher: DirectoryWatcher) -> int:
+    """
+    Registra no lote do diretório de uploads os arquivos que chegaram desde a última consulta
+    e o coloca na fila, se houver arquivos pendentes e ele não estiver na fila ou em execução.
+
+    Returns:
+        Número de arquivos novos registrados
+    """
+    entries = watcher.poll()
+    batch = get_directory_batch(db)
+    registered = 0
+    if entries:
+        registered = register_batch_files(db, batch, watcher.directory, entries)
+        watcher.commit(entries)
+        logger.info(f"Watch folder: {len(entries)} new files, {registered} registered for ingest")
+
+    if batch.status not in ('queued', 'processing') and has_batch_files(db, batch, status='pending'):
+        enqueue_batch(db, batch)
+    return registered
+
+
+def get_directory_batch(db: Session) -> BatchUpload:
+    """
+    Retorna (criando se necessário) o lote que acompanha o processamento do diretório de uploads.
+    """
+    batch = db.query(BatchUpload).filter(BatchUpload.batch_id == DIRECTORY_BATCH_ID).first()
+    if not batch:
+        batch = BatchUpload(batch_id=DIRECTORY_BATCH_ID, status='pending', total_files=0)
+        db.add(batch)
+        db.commit()
+    return batch
+
+
+def enqueue_batch(db: Session, batch: BatchUpload):
+    """
+    Coloca o lote na fila de processamento do executor de jobs.
+    """
+    batch.status = 'queued'
+    batch.error = None
+    db.commit()
+
+
+def claim_next_batch(db: Session, runner_id: Optional[str] = None) -> Optional[BatchUpload]:
+    """
+    Reserva o lote mais antigo da fila, marcando-o como em processamento.
+    O SKIP LOCKED garante que dois executores (ex.: workers diferentes) não peguem o mesmo lote.
+
+    Args:
+        db: Sessão do banco de dados
+        runner_id: Identificador do executor, gravado como dono da reserva
+    """
+    batch = db.query(BatchUpload).filter(
+        BatchUpload.status == 'queued'
+    ).order_by(BatchUpload.updated_at).with_for_update(skip_locked=True).first()
+    if not batch:
+        db.rollback()
+        return None
+
+    batch.status = 'processing'
+    batch.runner_id = runner_id
+    batch.heartbeat_at = datetime.utcnow()
+    db.commit()
+    return batch
+
+
+def heartbeat_batch(db: Session, batch_id: str, runner_id: str) -> bool:
+    """
+    Renova a reserva de um lote em processamento, independentemente dos commits de progresso
+    (um bloco pode levar mais que BATCH_JOB_STALE_MINUTES).
+
+    Returns:
+        False se o lote não está mais reservado por este executor
+    """
+    count = db.query(BatchUpload).filter(
+        BatchUpload.batch_id == batch_id,
+        BatchUpload.status == 'processing',
+        BatchUpload.runner_id == runner_id
+    ).update({BatchUpload.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return count > 0
+
+
+def _holds_lease(db: Session, batch: BatchUpload, runner_id: Optional[str]) -> bool:
+    """
+    Confirma, com a linha do lote bloqueada até o commit, que ele ainda está reservado
+    pelo executor (sem runner_id, o processamento não usa reserva).
+    """
+    if runner_id is None:
+        return True
+    row = db.query(BatchUpload.status, BatchUpload.runner_id).filter(
+        BatchUpload.id == batch.id
+    ).with_for_update().first()
+    return row is not None and row.status == 'processing' and row.runner_id == runner_id
+
+
+def requeue_stale_batches(db: Session, stale_minutes: int) -> int:
+    """
+    Devolve à fila os lotes em processamento cuja reserva não foi renovada (o processo que os
+    executava foi interrompido). O executor renova heartbeat_at periodicamente; lotes
+    reservados antes dessa coluna usam updated_at.
+
+    Returns:
+        Número de lotes devolvidos à fila
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=stale_minutes)
+    count = db.query(BatchUpload).filter(
+        BatchUpload.status == 'processing',
+        func.coalesce(BatchUpload.heartbeat_at, BatchUpload.updated_at) < cutoff
+    ).update({BatchUpload.status: 'queued', BatchUpload.runner_id: None}, synchronize_session=False)
+    db.commit()
+    if count:
+        logger.warning(f"Requeued {count} interrupted batch jobs")
+    return count
+
+
+def get_batch_progress(batch: BatchUpload) -> Dict[str, Any]:
+    """
+    Monta o progresso de um lote: contadores, vazão (imagens/s) e estimativa de término.
+    """
+    total = batch.total_files or 0
+    processed = batch.processed_files or 0
+
+    elapsed = None
+    images_per_second = None
+    eta_seconds = None
+    if batch.started_at:
+        end = batch.finished_at if batch.status in ('completed', 'failed') and batch.finished_at else datetime.utcnow()
+        elapsed = max((end - batch.started_at).total_seconds(), 0.0)
+        processed_in_run = processed - (batch.start_processed_files or 0)
+        if elapsed > 0 and processed_in_run > 0:
+            images_per_second = processed_in_run / elapsed
+            if batch.status == 'processing':
+                eta_seconds = max(total - processed, 0) / images_per_second
+
+    return {
+        "batch_id": batch.batch_id,
+        "status": batch.status,
+        "total_files": total,
+        "processed_files": processed,
+        "failed_files": batch.failed_files or 0,
+        "pending_files": max(total - processed, 0),
+        "created_at": batch.created_at,
+        "started_at": batch.started_at,
+        "finished_at": batch.finished_at,
+        "elapsed_seconds": elapsed,
+        "images_per_second": images_per_second,
+        "eta_seconds": eta_seconds,
+        "error": batch.error
+    }
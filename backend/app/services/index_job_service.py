@@ -0,0 +1,94 @@
+"""
+Fila persistente dos jobs de manutenção do índice pedidos pela API.
+
+O endpoint apenas registra o job (status "queued") e responde 202 com o identificador; o
+processo escritor do índice reserva os jobs da fila e os executa, gravando o resultado.
+Assim uma reconciliação longa não prende um worker da API nem esbarra no timeout do proxy,
+e roda no único processo que altera o índice.
+"""
+import json
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from sqlalchemy.orm import Session
+from ..models.index_job import IndexJob
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_JOB = "reconcile"
+
+
+def enqueue_index_job(db: Session, kind: str) -> IndexJob:
+    """
+    Coloca um job na fila. Se já há um job do mesmo tipo na fila ou em execução, ele é
+    retornado no lugar de um novo (uma reconciliação já cobre os pedidos seguintes).
+    """
+    job = db.query(IndexJob).filter(
+        IndexJob.kind == kind,
+        IndexJob.status.in_(('queued', 'processing'))
+    ).order_by(IndexJob.created_at).first()
+    if job is None:
+        job = IndexJob(kind=kind, status='queued')
+        db.add(job)
+        db.commit()
+    return job
+
+
+def claim_next_index_job(db: Session) -> Optional[IndexJob]:
+    """
+    Reserva o job mais antigo da fila, marcando-o como em execução.
+    """
+    job = db.query(IndexJob).filter(
+        IndexJob.status == 'queued'
+    ).order_by(IndexJob.created_at).with_for_update(skip_locked=True).first()
+    if not job:
+        db.rollback()
+        return None
+
+    job.status = 'processing'
+    job.started_at = datetime.utcnow()
+    db.commit()
+    return job
+
+
+def run_index_job(db: Session, job: IndexJob, handler: Callable[[Session], Dict[str, Any]]):
+    """
+    Executa um job reservado e grava o resultado (ou o erro).
+    """
+    try:
+        result = handler(db)
+        job.status = 'completed'
+        job.result = json.dumps(result, default=str)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Index job {job.job_id} ({job.kind}) failed: {str(e)}")
+        job.status = 'failed'
+        job.error = str(e)
+    job.finished_at = datetime.utcnow()
+    db.commit()
+
+
+def requeue_interrupted_index_jobs(db: Session) -> int:
+    """
+    Devolve à fila os jobs em execução (o escritor anterior foi interrompido).
+    """
+    count = db.query(IndexJob).filter(
+        IndexJob.status == 'processing'
+    ).update({IndexJob.status: 'queued'}, synchronize_session=False)
+    db.commit()
+    if count:
+        logger.warning(f"Requeued {count} interrupted index jobs")
+    return count
+
+
+def get_index_job_status(job: IndexJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error
+    }
@@ -0,0 +1,172 @@
+import os
+import logging
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+from sqlalchemy.orm import Session
+from ..models.person import Person, PersonImage
+from ..core.crop_store import CropStore, CROPS_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+# Tamanho dos blocos de IDs usados nas consultas IN e nas atualizações em lote
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def _recently_indexed(metadata: Dict[str, Any], cutoff: datetime) -> bool:
+    """
+    Indica se um embedding foi adicionado depois do tempo de corte.
+    Esses embeddings podem pertencer a um processamento cujo commit no banco ainda não ocorreu.
+    """
+    processed_date = (metadata or {}).get("processed_date")
+    if not processed_date:
+        return False
+    try:
+        return datetime.fromisoformat(processed_date) > cutoff
+    except ValueError:
+        return False
+
+
+def reconcile_index(
+    db: Session,
+    faiss_index,
+    face_processor,
+    processed_dir: str,
+    grace_minutes: int = 15
+) -> Dict[str, Any]:
+    """
+    Reconcilia incrementalmente o índice FAISS com a tabela person_images.
+
+    Compara, por operações de conjunto sobre arrays, os faiss_id gravados no banco com os
+    IDs presentes no índice: embeddings sem imagem correspondente (órfãos) são removidos e
+    imagens sem embedding no índice são reprocessadas e adicionadas. Quando o recorte
+    alinhado da imagem está no armazenamento de recortes, o embedding é recalculado a partir
+    dele, em lote e sem detecção; caso contrário, a imagem é processada novamente.
+
+    Args:
+        db: Sessão do banco de dados
+        faiss_index: Instância do índice FAISS
+        face_processor: Instância do processador de faces
+        processed_dir: Diretório onde o índice é salvo
+        grace_minutes: Embeddings mais recentes que isso não são considerados órfãos
+
+    Returns:
+        Dicionário com o delta aplicado
+    """
+    start_time = datetime.now()
+
+    # Uma única consulta com apenas as colunas necessárias
+    rows = db.query(PersonImage.id, PersonImage.faiss_id).filter(
+        PersonImage.face_detected == True
+    ).all()
+    image_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    db_faiss_ids = np.array([row[1] if row[1] is not None else -1 for row in rows], dtype=np.int64)
+    index_ids = faiss_index.get_ids()
+
+    # IDs no índice que nenhuma imagem referencia
+    orphan_ids = np.setdiff1d(index_ids, db_faiss_ids[db_faiss_ids >= 0])
+    cutoff = datetime.now() - timedelta(minutes=grace_minutes)
+    orphan_ids = [
+        faiss_id for faiss_id in orphan_ids.tolist()
+        if not _recently_indexed(faiss_index.get_metadata(faiss_id), cutoff)
+    ]
+
+    # Imagens cujo faiss_id é nulo ou não existe no índice
+    missing_image_ids = image_ids[~np.isin(db_faiss_ids, index_ids)]
+
+    logger.info(
+        f"Index reconciliation: {len(image_ids)} images in database, {len(index_ids)} embeddings in index, "
+        f"{len(orphan_ids)} orphans, {len(missing_image_ids)} missing"
+    )
+
+    removed = faiss_index.remove_ids(orphan_ids) if orphan_ids else 0
+
+    crop_store = CropStore(os.path.join(processed_dir, CROPS_DIRNAME))
+    embed_crops = getattr(face_processor, "embed_crops", None)
+
+    added = 0
+    failed = 0
+    for chunk_start in range(0, len(missing_image_ids), RECONCILE_CHUNK_SIZE):
+        chunk = missing_image_ids[chunk_start:chunk_start + RECONCILE_CHUNK_SIZE].tolist()
+        images = db.query(PersonImage, Person).join(
+            Person, PersonImage.registro_unico == Person.registro_unico
+        ).filter(PersonImage.id.in_(chunk)).all()
+
+        # Recortes guardados sob o faiss_id anterior da imagem
+        crop_keys, crops = [], None
+        if embed_crops is not None:
+            crop_keys, crops = crop_store.get_many(
+                [image.faiss_id for image, _ in images if image.faiss_id is not None]
+            )
+        crop_rows = {key: row for row, key in enumerate(crop_keys)}
+        crop_embeddings = embed_crops(crops) if crop_keys else None
+
+        embeddings: List[np.ndarray] = []
+        metadatas: List[Dict[str, Any]] = []
+        image_row_ids: List[int] = []
+        crop_keys_used: List[Any] = []
+        for image, person in images:
+            crop_row = crop_rows.get(image.faiss_id)
+            if crop_row is not None:
+                embedding = crop_embeddings[crop_row]
+            elif not image.file_path or not os.path.exists(image.file_path):
+                logger.warning(f"Arquivo não encontrado durante a reconciliação: {image.file_path}")
+                failed += 1
+                continue
+            else:
+                embedding = face_processor.extract_embedding(image.file_path)
+                if embedding is None:
+                    logger.warning(f"Não foi possível extrair embedding para {image.file_path}")
+                    failed += 1
+                    continue
+
+            embeddings.append(embedding)
+            metadatas.append({
+                "person_id": person.person_id,
+                "cpf": person.cpf,
+                "person_name": person.name,
+                "origin": person.origin,
+                "filename": image.filename,
+                "original_filename": image.original_filename,
+                "processed_date": image.processed_date.isoformat() if image.processed_date else ""
+            })
+            image_row_ids.append(image.id)
+            crop_keys_used.append(image.faiss_id if crop_row is not None else None)
+
+        # Imagens sem pessoa associada não retornam no join
+        failed += len(chunk) - len(images)
+
+        if embeddings:
+            faiss_ids = faiss_index.add_embeddings(np.vstack(embeddings), metadatas)
+            # O recorte passa a ser encontrado também pelo novo faiss_id (sem regravar os dados)
+            for faiss_id, crop_key in zip(faiss_ids, crop_keys_used):
+                if crop_key is not None:
+                    crop_store.alias(faiss_id, crop_key)
+            db.bulk_update_mappings(PersonImage, [
+                {"id": image_id, "faiss_id": faiss_id}
+                for image_id, faiss_id in zip(image_row_ids, faiss_ids)
+            ])
+            db.commit()
+            added += len(faiss_ids)
+
+    if removed or added or orphan_ids:
+        index_path = os.path.join(processed_dir, "faiss_index.bin")
+        metadata_path = os.path.join(processed_dir, "faiss_metadata.pkl")
+        faiss_index.save(index_path, metadata_path)
+
+    elapsed_time = (datetime.now() - start_time).total_seconds()
+    logger.info(
+        f"Index reconciliation completed: {len(orphan_ids)} orphans removed, {added} embeddings added, "
+        f"{failed} failed, {elapsed_time:.2f} seconds"
+    )
+
+    return {
+        "success": True,
+        "db_images": int(len(image_ids)),
+        "index_embeddings": int(len(index_ids)),
+        "orphans_removed": len(orphan_ids),
+        "missing": int(len(missing_image_ids)),
+        "added": added,
+        "failed": failed,
+        "elapsed_time": elapsed_time
+    }
@@ -0,0 +1,160 @@
+import os
+import uuid
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import insert, tuple_
+from sqlalchemy.orm import Session
+from ..models.person import Person, PersonImage
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def save_processed_image(db: Session, result: Dict[str, Any]) -> PersonImage:
+    """
+    Registra no banco a pessoa (se ainda não existir) e a imagem de um resultado de processamento.
+    O commit fica a cargo de quem chama, para permitir gravar vários resultados por transação.
+
+    Args:
+        db: Sessão do banco de dados
+        result: Resultado bem-sucedido de FileProcessor.process_image/persist_face
+
+    Returns:
+        A imagem criada (já com id, após o flush)
+    """
+    # Verificar se a pessoa já existe no banco de dados
+    db_person = db.query(Person).filter(
+        Person.name == result["person_name"],
+        Person.cpf == result["cpf"],
+        Person.person_id == result["person_id"]
+    ).first()
+
+    if not db_person:
+        # Criar nova pessoa
+        db_person = Person(
+            person_id=result["person_id"],
+            cpf=result["cpf"],
+            name=result["person_name"],
+            origin_code=result["origin"][:3],
+            origin=result["origin"],
+        )
+        db.add(db_person)
+        db.flush()  # Gera o registro_unico
+
+    # Criar nova entrada de imagem
+    db_image = PersonImage(
+        person_id=db_person.person_id,  # Mantido para compatibilidade
+        registro_unico=db_person.registro_unico,
+        filename=result["filename"],
+        original_filename=result["original_filename"],
+        content_hash=result.get("content_hash"),
+        file_path=result.get("file_path") or os.path.join(settings.PROCESSED_DIR, result["filename"]),
+        processed=True,
+        processed_date=datetime.now(),
+        face_detected=True,
+        quality_flags=_quality_flags(result),
+        faiss_id=result.get("faiss_id")
+    )
+    db.add(db_image)
+    db.flush()
+    return db_image
+
+
+def _quality_flags(result: Dict[str, Any]) -> Optional[str]:
+    return ",".join(result.get("quality_issues") or []) or None
+
+
+def _person_key(result: Dict[str, Any]) -> Tuple[str, str, str]:
+    return (result["person_name"], result["cpf"], result["person_id"])
+
+
+def save_processed_images(db: Session, results: List[Dict[str, Any]]) -> List[int]:
+    """
+    Versão em lote de save_processed_image: uma consulta para as pessoas já existentes,
+    um INSERT em lote para as novas pessoas e um INSERT ... RETURNING para as imagens.
+    O commit fica a cargo de quem chama (um por bloco).
+
+    Args:
+        db: Sessão do banco de dados
+        results: Resultados bem-sucedidos de FileProcessor.persist_face
+
+    Returns:
+        IDs das imagens criadas, na mesma ordem dos resultados
+    """
+    if not results:
+        return []
+
+    # Pessoas já existentes, chaveadas por (nome, cpf, person_id)
+    keys = list({_person_key(result) for result in results})
+    registros = {
+        (row.name, row.cpf, row.person_id): row.registro_unico
+        for row in db.query(Person.name, Person.cpf, Person.person_id, Person.registro_unico).filter(
+            tuple_(Person.name, Person.cpf, Person.person_id).in_(keys)
+        )
+    }
+
+    # Novas pessoas (uma por chave, mesmo que apareçam várias vezes no bloco)
+    new_persons = {}
+    for result in results:
+        key = _person_key(result)
+        if key not in registros and key not in new_persons:
+            new_persons[key] = {
+                "registro_unico": str(uuid.uuid4()),
+                "person_id": result["person_id"],
+                "cpf": result["cpf"],
+                "name": result["person_name"],
+                "origin_code": result["origin"][:3],
+                "origin": result["origin"],
+            }
+    if new_persons:
+        # O registro_unico é gerado aqui, então as novas pessoas não precisam de RETURNING
+        db.execute(insert(Person), list(new_persons.values()))
+        for key, person in new_persons.items():
+            registros[key] = person["registro_unico"]
+
+    now = datetime.now()
+    image_rows = [
+        {
+            "person_id": result["person_id"],  # Mantido para compatibilidade
+            "registro_unico": registros[_person_key(result)],
+            "filename": result["filename"],
+            "original_filename": result["original_filename"],
+            "content_hash": result.get("content_hash"),
+            "file_path": result.get("file_path") or os.path.join(settings.PROCESSED_DIR, result["filename"]),
+            "processed": True,
+            "processed_date": now,
+            "face_detected": True,
+            "quality_flags": _quality_flags(result),
+            "faiss_id": result.get("faiss_id")
+        }
+        for result in results
+    ]
+    return list(db.scalars(
+        insert(PersonImage).returning(PersonImage.id, sort_by_parameter_order=True),
+        image_rows
+    ))
+
+
+def remove_ingested_sources(results: List[Dict[str, Any]], remove_all: bool = True):
+    """
+    Remove os arquivos de origem das imagens já registradas no banco (chamar após o commit).
+    O conteúdo continua no armazenamento de processados (link, clone ou cópia).
+
+    Args:
+        results: Resultados bem-sucedidos já registrados
+        remove_all: Remover todas as origens; se False, apenas as colocadas com "move"
+    """
+    for result in results:
+        source_path = result.get("source_path")
+        if not result.get("success") or not source_path:
+            continue
+        if not remove_all and not result.get("move_source"):
+            continue
+        try:
+            os.remove(source_path)
+        except FileNotFoundError:
+            # Já removido, ou membro de um arquivo compactado
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove ingested file {source_path}: {str(e)}")
@@ -0,0 +1,116 @@
+import os
+import shutil
+import logging
+from datetime import datetime
+from typing import Dict, Any
+from sqlalchemy.orm import Session
+from ..models.person import PersonImage
+from ..core.image_store import (
+    ALIGNED_DIRNAME,
+    content_digest,
+    content_filename,
+    resolve_filename,
+    aligned_path,
+    is_content_addressed
+)
+
+logger = logging.getLogger(__name__)
+
+# Imagens migradas (e gravadas no banco) por transação
+MIGRATION_CHUNK_SIZE = 500
+
+
+def _move(source: str, target: str):
+    """
+    Move um arquivo para o destino; se o destino já existe (mesmo conteúdo), remove a origem.
+    """
+    if not os.path.exists(source):
+        # Já movido (arquivo compartilhado por mais de uma imagem)
+        return
+    if os.path.exists(target):
+        os.remove(source)
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(source, target)
+
+
+def migrate_storage(db: Session, processed_dir: str) -> Dict[str, Any]:
+    """
+    Move as imagens processadas do layout plano (processed_dir/<nome>) para o layout
+    endereçado por conteúdo, junto com os recortes alinhados, e grava o novo caminho em
+    PersonImage.file_path. O nome (PersonImage.filename e metadados do índice) é mantido,
+    e /recognition/image-by-filename resolve os nomes antigos pelo caminho gravado.
+    PersonImage.content_hash é preenchido nas imagens que ainda não o têm.
+
+    A migração pode ser interrompida e executada novamente: imagens já migradas são ignoradas.
+
+    Args:
+        db: Sessão do banco de dados
+        processed_dir: Diretório das imagens processadas
+
+    Returns:
+        Dicionário com as estatísticas da migração
+    """
+    start_time = datetime.now()
+    migrated = 0
+    missing = 0
+    last_id = 0
+
+    while True:
+        images = db.query(
+            PersonImage.id, PersonImage.filename, PersonImage.file_path, PersonImage.content_hash
+        ).filter(
+            PersonImage.id > last_id
+        ).order_by(PersonImage.id).limit(MIGRATION_CHUNK_SIZE).all()
+        if not images:
+            break
+        last_id = images[-1].id
+
+        updates = []
+        moves = []
+        for image in images:
+            if not image.file_path:
+                continue
+            legacy_path = os.path.join(processed_dir, image.filename or "")
+            if is_content_addressed(os.path.basename(image.file_path)):
+                if not image.content_hash:
+                    # O hash é o próprio nome do arquivo
+                    updates.append({"id": image.id, "content_hash": os.path.basename(image.file_path)[:64]})
+                # Já migrada; o arquivo ainda estará no local antigo se a execução anterior
+                # foi interrompida entre o commit e a movimentação
+                if not os.path.exists(image.file_path) and image.filename and os.path.exists(legacy_path):
+                    moves.append((legacy_path, image.file_path))
+                continue
+            if not os.path.exists(image.file_path):
+                missing += 1
+                continue
+
+            digest = content_digest(path=image.file_path)
+            new_path = resolve_filename(processed_dir, content_filename(digest, image.file_path))
+            moves.append((image.file_path, new_path))
+            updates.append({"id": image.id, "file_path": new_path, "content_hash": digest})
+
+        # O novo caminho é gravado antes da movimentação: o nome antigo continua em
+        # PersonImage.filename, o que permite concluir a movimentação em uma nova execução
+        if updates:
+            db.bulk_update_mappings(PersonImage, updates)
+            db.commit()
+            migrated += sum(1 for update in updates if "file_path" in update)
+
+        for source, target in moves:
+            _move(source, target)
+            legacy_crop = os.path.join(processed_dir, ALIGNED_DIRNAME, os.path.basename(source))
+            if os.path.exists(legacy_crop):
+                _move(legacy_crop, aligned_path(processed_dir, os.path.basename(target)))
+
+        if updates:
+            logger.info(f"Storage migration: {migrated} images migrated")
+
+    elapsed_time = (datetime.now() - start_time).total_seconds()
+    logger.info(f"Storage migration completed: {migrated} migrated, {missing} missing, {elapsed_time:.2f} seconds")
+    return {
+        "success": True,
+        "migrated": migrated,
+        "missing": missing,
+        "elapsed_time": elapsed_time
+    }
@@ -3,6 +3,8 @@ from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from ..models.person import BatchUpload
 from ..config import settings
+from .batch_service import DIRECTORY_BATCH_ID
+from ..core.search_cache import purge_expired_handles, QUERY_HANDLES_DIRNAME
 
 def clean_old_uploads(db: Session):
     """
@@ -13,29 +15,40 @@ def clean_old_uploads(db: Session):
         cutoff_time = datetime.utcnow() - timedelta(hours=24)
         
         # Buscar lotes antigos não concluídos
+        # (sem atividade recente; lotes em processamento podem ser retomados e não são removidos)
         old_batches = db.query(BatchUpload).filter(
-            BatchUpload.created_at < cutoff_time,
-            BatchUpload.status != 'completed'
+            BatchUpload.updated_at < cutoff_time,
+            BatchUpload.status.notin_(['completed', 'queued', 'processing']),
+            BatchUpload.batch_id != DIRECTORY_BATCH_ID
         ).all()
         
+        # Uma única varredura do diretório de uploads para todos os lotes
+        old_batch_ids = {batch.batch_id for batch in old_batches}
+        if old_batch_ids:
+            with os.scandir(settings.UPLOAD_DIR) as entries:
+                for entry in entries:
+                    batch_id = entry.name.split("_", 1)[0]
+                    if batch_id in old_batch_ids or any(
+                        entry.name.startswith(f"{old_id}_") for old_id in old_batch_ids if "_" in old_id
+                    ):
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+        
         for batch in old_batches:
-            # Encontrar e remover arquivos do lote
-            batch_files = [
-                f for f in os.listdir(settings.UPLOAD_DIR) 
-                if f.startswith(f"{batch.batch_id}_")
-            ]
-            
-            for filename in batch_files:
-                file_path = os.path.join(settings.UPLOAD_DIR, filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            
             # Remover registro do banco de dados
             db.delete(batch)
         
         db.commit()
         
         print(f"Cleaned up {len(old_batches)} old upload batches")
+        
+        # Identificadores de consulta expirados
+        purge_expired_handles(
+            os.path.join(settings.UPLOAD_DIR, "temp", QUERY_HANDLES_DIRNAME),
+            settings.QUERY_HANDLE_TTL_SECONDS
+        )
     
     except Exception as e:
         db.rollback()
@@ -0,0 +1,177 @@
+"""
+Executor de jobs de processamento em lote.
+
+A fila é persistente: são os registros de batch_uploads com status "queued". Os endpoints
+apenas enfileiram o lote e retornam imediatamente; threads deste executor reservam os lotes
+da fila e os processam, gravando o progresso no banco a cada bloco de arquivos.
+
+Cada lote reservado guarda o identificador do executor, que renova a reserva (heartbeat)
+em uma thread própria enquanto o processa. Um lote cuja reserva não é renovada volta à
+fila, e o executor anterior, ao perceber, para sem gravar mais nada.
+"""
+import os
+import socket
+import threading
+import logging
+import uuid
+from ..config import settings
+from ..database import SessionLocal
+from ..services.batch_service import (
+    claim_next_batch, requeue_stale_batches, process_batch_upload, heartbeat_batch
+)
+from ..core.dependencies import get_file_processor
+
+logger = logging.getLogger(__name__)
+
+
+class BatchJobRunner:
+    """
+    Threads que consomem a fila de lotes.
+    """
+    def __init__(
+        self,
+        workers: int = 1,
+        poll_interval: float = 2.0,
+        stale_minutes: int = 10,
+        heartbeat_interval: float = 30.0
+    ):
+        """
+        Args:
+            workers: Número de lotes processados simultaneamente
+            poll_interval: Intervalo, em segundos, entre consultas à fila
+            stale_minutes: Tempo sem heartbeat após o qual um lote em processamento volta à fila
+            heartbeat_interval: Intervalo, em segundos, de renovação da reserva dos lotes
+        """
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_minutes = stale_minutes
+        self.heartbeat_interval = heartbeat_interval
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self):
+        if settings.SHARED_INDEX:
+            # Há um único escritor: lotes em processamento foram interrompidos pela parada anterior
+            db = SessionLocal()
+            try:
+                requeue_stale_batches(db, stale_minutes=0)
+            finally:
+                db.close()
+
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"batch-job-{i}", daemon=True).start()
+        logger.info(f"Batch job runner started with {self.workers} workers")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """
+        Acorda os workers para que um lote recém-enfileirado comece sem esperar a próxima consulta.
+        """
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if not self._run_next():
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+            except Exception as e:
+                logger.error(f"Error in batch job runner: {str(e)}")
+                self._stop.wait(self.poll_interval)
+
+    def _run_next(self) -> bool:
+        """
+        Processa o próximo lote da fila.
+
+        Returns:
+            True se um lote foi processado
+        """
+        db = SessionLocal()
+        try:
+            requeue_stale_batches(db, self.stale_minutes)
+            batch = claim_next_batch(db, runner_id=self.runner_id)
+            if batch is None:
+                return False
+
+            logger.info(f"Starting batch job {batch.batch_id}")
+            cancel = threading.Event()
+            finished = threading.Event()
+            threading.Thread(
+                target=self._heartbeat, args=(batch.batch_id, cancel, finished), daemon=True
+            ).start()
+            try:
+                result = process_batch_upload(
+                    db,
+                    batch,
+                    get_file_processor(),
+                    max_workers=settings.BATCH_WORKERS,
+                    sink_chunk_size=settings.BATCH_PROGRESS_CHUNK_SIZE,
+                    remove_sources=settings.REMOVE_INGESTED_UPLOADS,
+                    runner_id=self.runner_id,
+                    cancel=cancel
+                )
+                logger.info(
+                    f"Batch job {batch.batch_id} finished: {result['status']}, "
+                    f"{result['processed_files']}/{result['total_files']} files, {result['failed_files']} failed"
+                )
+            except Exception as e:
+                logger.error(f"Batch job {batch.batch_id} failed: {str(e)}")
+                db.rollback()
+                # Um lote que voltou à fila (reserva perdida) pertence a outro executor
+                if batch.runner_id == self.runner_id:
+                    batch.status = 'failed'
+                    batch.error = str(e)
+                    batch.runner_id = None
+                    db.commit()
+            finally:
+                finished.set()
+            return True
+        finally:
+            db.close()
+
+    def _heartbeat(self, batch_id: str, cancel: threading.Event, finished: threading.Event):
+        """
+        Renova a reserva do lote até o fim do processamento, em uma sessão própria.
+        Se a reserva foi perdida, sinaliza o processamento para parar.
+        """
+        while not finished.wait(self.heartbeat_interval):
+            db = SessionLocal()
+            try:
+                if not heartbeat_batch(db, batch_id, self.runner_id):
+                    logger.warning(f"Batch job {batch_id} lost its lease, stopping")
+                    cancel.set()
+                    return
+            except Exception as e:
+                logger.error(f"Error renewing lease of batch job {batch_id}: {str(e)}")
+            finally:
+                db.close()
+
+
+# Executor deste processo (apenas no processo que altera o índice)
+job_runner = None
+
+
+def start_job_runner():
+    """Inicia o executor de jobs de lote neste processo."""
+    global job_runner
+    if job_runner is not None:
+        return job_runner
+
+    job_runner = BatchJobRunner(
+        workers=settings.BATCH_JOB_WORKERS,
+        poll_interval=settings.BATCH_JOB_POLL_SECONDS,
+        stale_minutes=settings.BATCH_JOB_STALE_MINUTES,
+        heartbeat_interval=settings.BATCH_JOB_HEARTBEAT_SECONDS
+    )
+    job_runner.start()
+    return job_runner
+
+
+def notify_job_runner():
+    """Acorda o executor local, se houver (em outros workers ele encontra o lote na próxima consulta)."""
+    if job_runner is not None:
+        job_runner.wake()
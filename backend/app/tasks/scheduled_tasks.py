@@ -1,6 +1,103 @@
+import os
+import logging
+import threading
 from apscheduler.schedulers.background import BackgroundScheduler
+from ..config import settings
 from ..database import SessionLocal
 from ..services.upload_cleanup import clean_old_uploads
+from ..services.index_reconciliation import reconcile_index
+from ..services.batch_service import watch_upload_dir
+from ..services.index_job_service import (
+    RECONCILE_JOB, claim_next_index_job, run_index_job, requeue_interrupted_index_jobs
+)
+from ..core.directory_scanner import DirectoryWatcher
+from ..core.dependencies import get_face_processor, get_faiss_index
+from .batch_jobs import notify_job_runner
+
+logger = logging.getLogger(__name__)
+
+def reconcile_index_job():
+    """
+    Reconcilia o índice FAISS com o banco de dados usando os processadores ativos.
+    """
+    faiss_index = get_faiss_index()
+    face_processor = get_face_processor()
+    if faiss_index is None or face_processor is None:
+        return
+    
+    db = SessionLocal()
+    try:
+        reconcile_index(db, faiss_index, face_processor, settings.PROCESSED_DIR)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error in index reconciliation: {str(e)}")
+    finally:
+        db.close()
+
+# Acorda o executor dos jobs de índice (pedido feito neste mesmo processo)
+_index_jobs_wake = threading.Event()
+
+def notify_index_jobs():
+    """Acorda o executor local (em outros workers o job é encontrado na próxima consulta)."""
+    _index_jobs_wake.set()
+
+def run_index_jobs():
+    """
+    Executa, no processo escritor do índice, os jobs de índice enfileirados pela API.
+    """
+    db = SessionLocal()
+    try:
+        requeue_interrupted_index_jobs(db)
+    finally:
+        db.close()
+
+    while True:
+        db = SessionLocal()
+        try:
+            job = claim_next_index_job(db)
+            if job is None:
+                _index_jobs_wake.wait(settings.BATCH_JOB_POLL_SECONDS)
+                _index_jobs_wake.clear()
+                continue
+            logger.info(f"Starting index job {job.job_id} ({job.kind})")
+            if job.kind == RECONCILE_JOB:
+                run_index_job(db, job, lambda session: reconcile_index(
+                    session, get_faiss_index(), get_face_processor(), settings.PROCESSED_DIR
+                ))
+            else:
+                run_index_job(db, job, lambda session: _unknown_job(job.kind))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error in index job runner: {str(e)}")
+        finally:
+            db.close()
+
+def _unknown_job(kind: str):
+    raise ValueError(f"Unknown index job kind: {kind}")
+
+# Observador da pasta de uploads (mantém a marca d'água entre as consultas)
+upload_watcher = None
+
+def watch_upload_dir_job():
+    """
+    Envia para ingestão os arquivos que chegaram à pasta de uploads desde a última consulta.
+    """
+    global upload_watcher
+    if upload_watcher is None:
+        upload_watcher = DirectoryWatcher(
+            settings.UPLOAD_DIR,
+            state_path=os.path.join(settings.PROCESSED_DIR, "upload_watch.json")
+        )
+    
+    db = SessionLocal()
+    try:
+        if watch_upload_dir(db, upload_watcher):
+            notify_job_runner()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error watching upload directory: {str(e)}")
+    finally:
+        db.close()
 
 def start_scheduler():
     scheduler = BackgroundScheduler()
@@ -13,4 +110,27 @@ def start_scheduler():
         minute=0
     )
     
-    scheduler.start()
\ No newline at end of file
+    # Reconciliar índice FAISS e banco de dados periodicamente
+    if settings.INDEX_RECONCILE_INTERVAL_MINUTES > 0:
+        scheduler.add_job(
+            reconcile_index_job,
+            'interval',
+            minutes=settings.INDEX_RECONCILE_INTERVAL_MINUTES,
+            max_instances=1,
+            coalesce=True
+        )
+    
+    # Ingestão contínua dos arquivos que chegam à pasta de uploads
+    if settings.WATCH_UPLOAD_DIR_SECONDS > 0:
+        scheduler.add_job(
+            watch_upload_dir_job,
+            'interval',
+            seconds=settings.WATCH_UPLOAD_DIR_SECONDS,
+            max_instances=1,
+            coalesce=True
+        )
+    
+    scheduler.start()
+    
+    # Jobs de índice pedidos pela API (ex.: reconciliação), fora das requisições
+    threading.Thread(target=run_index_jobs, name="index-jobs", daemon=True).start()